@@ -31,9 +31,15 @@
 
 '''
 This module contains the definiton of both CallbackHandler and
-CoreEvent.
+CoreEvent, and of the EventQueue which forwards events to an interface
+from a separate thread.
 '''
 
+import logging
+import threading
+from collections import namedtuple
+from Queue import Queue, Full
+
 EV_STATUS_CHANGED = 'EV_STATUS_CHANGED'
 EV_STARTED = 'EV_STARTED'
 EV_COMPLETE = 'EV_COMPLETE'
@@ -41,6 +47,23 @@ EV_FINISHED = 'EV_FINISHED'
 EV_DELAYED = 'EV_DELAYED'
 EV_TRIGGER_DEP = 'EV_TRIGGER_DEP'
 
+# Method of the interfaces called for each event
+EV_METHODS = {
+    EV_STATUS_CHANGED: 'ev_status_changed',
+    EV_STARTED: 'ev_started',
+    EV_COMPLETE: 'ev_complete',
+    EV_FINISHED: 'ev_finished',
+    EV_DELAYED: 'ev_delayed',
+    EV_TRIGGER_DEP: 'ev_trigger_dep',
+}
+
+# Behaviour of EventQueue when it is full
+QUEUE_BLOCK = 'block'
+QUEUE_DROP = 'drop'
+
+# Event queued by EventQueue
+EventRecord = namedtuple('EventRecord', ['ev_name', 'args'])
+
 class CallbackHandler(object):
     '''
     This class is a singleton. It registers the interface elements (console,
@@ -54,35 +77,146 @@ class CallbackHandler(object):
     def __init__(self):
         # interfaces that have to be notified
         self._interfaces = set()
+        # Entity types subscribed by event name, for each interface
+        self._subscriptions = {}
+        # Methods to call and their entity types, by event name
+        self._dispatch = {}
 
-    def attach(self, interface):
-        '''Attach an interface to the callback handler'''
+    def attach(self, interface, events=None, types=None):
+        '''
+        Attach an interface to the callback handler. The interface is only
+        notified of the events listed in events (all of them by default), for
+        objects which are instances of types (any object by default). An
+        interface attached again subscribes to more events.
+        '''
         assert interface, 'interface attached cannot be None'
         self._interfaces.add(interface)
+        subscriptions = self._subscriptions.setdefault(interface, {})
+        for ev_name in (events or EV_METHODS.keys()):
+            subscriptions[ev_name] = types
+        self._build_dispatch()
 
     def detach(self, interface):
         '''Detach an interface from the callback handler'''
         assert interface, 'interface detached cannot be None'
         if interface in self._interfaces:
             self._interfaces.remove(interface)
+            del self._subscriptions[interface]
+            self._build_dispatch()
+
+    def _build_dispatch(self):
+        '''Compute the methods called for each event'''
+        self._dispatch = {}
+        for interface, subscriptions in self._subscriptions.items():
+            for ev_name, types in subscriptions.items():
+                method = getattr(interface, EV_METHODS[ev_name], None)
+                if method is not None:
+                    self._dispatch.setdefault(ev_name, []).append(
+                                                            (method, types))
 
     def notify(self, obj, ev_name):
-        '''Notify the interfaces registered within the callback handler'''
-        for interface in self._interfaces:
-            if ev_name is EV_STATUS_CHANGED:
-                interface.ev_status_changed(obj)
-            elif ev_name is EV_STARTED:
-                interface.ev_started(obj)
-            elif ev_name is EV_COMPLETE:
-                interface.ev_complete(obj)
-            elif ev_name is EV_FINISHED:
-                interface.ev_finished(obj)
-            elif ev_name is EV_TRIGGER_DEP:
-                assert isinstance(obj, tuple)
-                (source, target) = obj
-                interface.ev_trigger_dep(source, target)
-            else:
-                interface.ev_delayed(obj)
+        '''Notify the interfaces which subscribed to the event'''
+        subscribers = self._dispatch.get(ev_name)
+        if not subscribers:
+            return
+        if ev_name is EV_TRIGGER_DEP:
+            assert isinstance(obj, tuple)
+            (source, target) = obj
+            for method, types in subscribers:
+                if types is None or isinstance(source, types):
+                    method(source, target)
+        else:
+            for method, types in subscribers:
+                if types is None or isinstance(obj, types):
+                    method(obj)
+
+class EventQueue(object):
+    '''
+    Forward the events it receives to an interface, from a separate thread.
+    The engine pushes an EventRecord of the values returned by
+    record(ev_name, obj) for each object, so the interface gets them as they
+    were at the time of the event and never reads the entities themselves.
+    Objects are queued as they are without record. When the queue is full,
+    events accepted by droppable(ev_name, obj) are dropped with the
+    QUEUE_DROP policy, other events wait for a free slot.
+    '''
+
+    def __init__(self, interface, maxsize, policy=QUEUE_BLOCK, droppable=None,
+                 record=None):
+        assert policy in (QUEUE_BLOCK, QUEUE_DROP), 'Invalid queue policy'
+        self.interface = interface
+        self.policy = policy
+        self.droppable = droppable
+        self.record = record
+        # Number of events dropped because the queue was full
+        self.dropped = 0
+        self._queue = Queue(maxsize)
+        self._thread = None
+
+    def start(self):
+        '''Start the thread handling queued events'''
+        self._thread = threading.Thread(target=self._consume)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        '''Wait for the queued events to be handled and stop the thread'''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _consume(self):
+        '''Call the interface for each queued event until stopped'''
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                getattr(self.interface, EV_METHODS[record.ev_name])(
+                                                                *record.args)
+            except Exception, exc:
+                logging.getLogger('milkcheck').error(
+                    'Cannot handle %s: %s' % (record.ev_name, exc))
+
+    def _put(self, ev_name, *objs):
+        '''Queue the event, applying the policy if the queue is full'''
+        args = objs
+        if self.record is not None:
+            args = tuple([self.record(ev_name, obj) for obj in objs])
+        record = EventRecord(ev_name, args)
+        if self.policy is QUEUE_DROP and self.droppable is not None and \
+           self.droppable(ev_name, objs[0]):
+            try:
+                self._queue.put_nowait(record)
+            except Full:
+                self.dropped += 1
+        else:
+            self._queue.put(record)
+
+    def ev_started(self, obj):
+        '''Queue EV_STARTED'''
+        self._put(EV_STARTED, obj)
+
+    def ev_complete(self, obj):
+        '''Queue EV_COMPLETE'''
+        self._put(EV_COMPLETE, obj)
+
+    def ev_finished(self, obj):
+        '''Queue EV_FINISHED'''
+        self._put(EV_FINISHED, obj)
+
+    def ev_status_changed(self, obj):
+        '''Queue EV_STATUS_CHANGED'''
+        self._put(EV_STATUS_CHANGED, obj)
+
+    def ev_delayed(self, obj):
+        '''Queue EV_DELAYED'''
+        self._put(EV_DELAYED, obj)
+
+    def ev_trigger_dep(self, obj_source, obj_triggered):
+        '''Queue EV_TRIGGER_DEP'''
+        self._put(EV_TRIGGER_DEP, obj_source, obj_triggered)
 
 def call_back_self():
     """Return a singleton instance of the CallbackHandler class"""
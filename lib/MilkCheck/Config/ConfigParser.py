@@ -55,6 +55,31 @@ class ConfigParser(object):
          'fanout':          { 'value': '64', 'type': int },
          'reverse_actions': { 'value': ['stop'], 'type': list },
          'summary':         { 'value': False, 'type': bool },
+         'timings':         { 'value': False, 'type': bool },
+         'critical_path':   { 'value': False, 'type': bool },
+         'trace_nodes':     { 'value': False, 'type': bool },
+         'backend':         { 'value': 'clustershell', 'type': str },
+         'backend_options': { 'value': {}, 'type': dict },
+         'adaptive_fanout': { 'value': False, 'type': bool },
+         'fanout_min':      { 'value': 1, 'type': int },
+         'fanout_max':      { 'value': 256, 'type': int },
+         'max_per_node':    { 'value': 0, 'type': int },
+         'circuit_breaker': { 'value': 0, 'type': int },
+         'preflight':       { 'value': False, 'type': bool },
+         'preflight_timeout': { 'value': 5, 'type': int },
+         'ssh_multiplex':   { 'value': False, 'type': bool },
+         'batch':           { 'value': False, 'type': bool },
+         'dedup':           { 'value': False, 'type': bool },
+         'output_budget':   { 'value': 0, 'type': int },
+         'output_action_budget': { 'value': 0, 'type': int },
+         'output_max_lines': { 'value': 0, 'type': int },
+         'output_max_bytes': { 'value': 0, 'type': int },
+         'fail_fast':       { 'value': False, 'type': bool },
+         'cache_ttl':       { 'value': 0, 'type': int },
+         'cache_file':      { 'value': '~/.milkcheck/cache', 'type': str },
+         'refresh_rate':    { 'value': 0, 'type': int },
+         'ui_queue_size':   { 'value': 0, 'type': int },
+         'ui_queue_policy': { 'value': 'block', 'type': str },
          }
 
     def __init__(self, options):
@@ -45,6 +45,7 @@ from MilkCheck.ServiceManager import service_manager_self
 from MilkCheck.Engine.BaseEntity import UnknownDependencyError
 from MilkCheck.Engine.Service import Service
 from MilkCheck.Engine.ServiceGroup import ServiceGroup, DepWrapper
+from MilkCheck.Engine.Timing import phase_timers_self
 
 class ConfigurationError(Exception):
     """Generic error for configuration rule file content error."""
@@ -85,7 +86,11 @@ class MilkCheckConfig(object):
         file descriptor
         '''
         # removes empty statement.
-        content = [item for item in yaml.safe_load_all(stream) if item]
+        phase_timers_self().start('yaml loading')
+        try:
+            content = [item for item in yaml.safe_load_all(stream) if item]
+        finally:
+            phase_timers_self().stop('yaml loading')
         if content:
             self._flow.extend(content)
 
@@ -96,7 +101,11 @@ class MilkCheckConfig(object):
         empty.
         '''
         if self._flow:
-            self._build_services()
+            phase_timers_self().start('build services')
+            try:
+                self._build_services()
+            finally:
+                phase_timers_self().stop('build services')
 
     def _build_services(self):
         '''
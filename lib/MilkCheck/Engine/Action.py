@@ -41,11 +41,19 @@ import time
 from ClusterShell.Worker.Popen import WorkerPopen
 from ClusterShell.Event import EventHandler
 from ClusterShell.NodeSet import NodeSet
-from ClusterShell.Task import task_self
 
 from MilkCheck.Callback import call_back_self
 from MilkCheck.EntityManager import EntityManager
 from MilkCheck.Engine.BaseEntity import BaseEntity
+from MilkCheck.Engine.Backend import ClusterShellBackend, ResultWorker, \
+                                     SharedHandler, ForwardHandler
+from MilkCheck.Engine.Fanout import AdaptiveFanout
+from MilkCheck.Engine.Batch import BatchRun
+from MilkCheck.Engine.Output import OutputStore
+from MilkCheck.Engine.Cache import ResultCache, CachingHandler
+from MilkCheck.Engine.Journal import RunJournal, read_journal
+from MilkCheck.Engine.Timing import NodeTimings
+from MilkCheck.Engine.Trace import TraceRecorder
 from MilkCheck.Engine.BaseEntity import DONE, TIMEOUT, ERROR, WAITING_STATUS, \
                                         NO_STATUS, DEP_ERROR, SKIPPED, WARNING
 from MilkCheck.Callback import EV_COMPLETE, EV_STARTED, EV_TRIGGER_DEP, \
@@ -56,8 +64,8 @@ class ActionManager(EntityManager):
     """
     The action manager handle the evolution of the fanout through the current
     running tasks. It provides two methods which allow the user to use
-    Action objects to perform task.This class is the only one where
-    clustershell is called
+    Action objects to perform task. Commands and timers are handled by
+    the execution backend, ClusterShell master task by default.
     """
 
     def __init__(self):
@@ -70,8 +78,47 @@ class ActionManager(EntityManager):
         self._tasks_done_count = 0
         # Count tasks which are running
         self._tasks_count = 0
-        # MasterTask
-        self._master_task = task_self()
+        # Running tasks and count of their service names, maintained by
+        # add_task() and remove_task()
+        self._running = set()
+        self._running_names = {}
+        # Folded running service names, None until computed again
+        self._running_folded = None
+        # Execution backend
+        self.backend = ClusterShellBackend()
+        # Adaptive fanout controller, None if fanout is static
+        self.adaptive_fanout = None
+        # Failures count needed to exclude a node, 0 if disabled
+        self.circuit_breaker = 0
+        self._node_failures = {}
+        self.broken_nodes = NodeSet()
+        # Batched actions of the current run, None if disabled
+        self.batch = None
+        # Share executions of identical commands
+        self.dedup = False
+        self._shared = {}
+        self.dedup_stats = {'executed': 0, 'shared': 0}
+        # Output of finished actions, None to keep workers as they are
+        self.output_store = None
+        # Results of idempotent actions, None if disabled
+        self.cache = None
+        # Journal of completed actions, None if disabled
+        self.journal = None
+        # Completion time of the nodes, None if disabled
+        self.node_timings = None
+        # Timeline of the run written at the end, None if disabled
+        self.tracer = None
+        # Results of the resumed run by action fullname
+        self.resumed = {}
+        # Cancel the whole run as soon as its final status is known
+        self.fail_fast = False
+        self._cancel_all = False
+        # Groups whose remaining actions are cancelled
+        self._cancelled = set()
+        # Entities already known to fail
+        self._doomed = set()
+        # Handler and cancel method of running actions
+        self._cancellers = {}
 
         self.dryrun = False
 
@@ -79,6 +126,10 @@ class ActionManager(EntityManager):
         """Perform an immediate action"""
         assert not action.to_skip(), "Action should be already SKIPPED"
 
+        if self.is_cancelled(action):
+            self._cancel(action)
+            return
+
         if not action.parent.simulate:
             self.add_task(action)
         call_back_self().notify(action.parent, EV_STARTED)
@@ -86,24 +137,258 @@ class ActionManager(EntityManager):
         nodes = None
         if action.mode != 'delegate':
             nodes = action.target
+            if nodes and self.broken_nodes:
+                self._exclude_broken_nodes(action)
 
         # In dry-run mode, all commands are replaced by a simple ':'
         command = ':'
         if not self.dryrun:
             command = action.resolve_property('command')
 
-        self._master_task.shell(command, nodes=nodes, timeout=action.timeout,
-                                handler=ActionEventHandler(action))
+        # Cached results of the service do not hold once it is changed
+        if self.cache and not action.idempotent and nodes and \
+           not self.dryrun:
+            self.cache.invalidate(action.parent, nodes)
+
+        handler = ActionEventHandler(action)
+        # Results may come at once, shared or batched commands keep running
+        self._cancellers[action] = (handler, None)
+
+        # Nodes where the resumed run already completed the action
+        resumed = self.resumed.pop(action.fullname(), None)
+        done = {}
+        if resumed and nodes:
+            done = dict([(node, (0, [])) for node, retcode
+                         in resumed[1].items()
+                         if retcode == 0 and node in nodes])
+
+        if resumed and nodes is None and resumed[0] == DONE:
+            # Local action already done by the resumed run
+            handler.ev_close(ResultWorker(NodeSet(), command))
+        elif done:
+            self._perform_partial(action, nodes, command, handler, done)
+        elif self.batch and action in self.batch:
+            # Results come from the batch script of the nodes
+            self.batch.attach(action, handler, self.backend)
+        elif nodes is not None and len(nodes) == 0:
+            # All nodes were excluded, there is nothing to run
+            handler.ev_close(ResultWorker(nodes, command))
+        elif action.unless and not self.dryrun:
+            self._perform_guarded(action, nodes, handler)
+        elif self.cache and action.idempotent and nodes and not self.dryrun:
+            self._perform_cached(action, nodes, command, handler)
+        elif self.dedup and nodes is not None:
+            self._perform_shared(action, command, handler)
+        else:
+            worker = self.backend.shell(command, nodes=nodes,
+                                        timeout=action.timeout,
+                                        handler=handler)
+            if action in self._cancellers:
+                self._cancellers[action] = (handler, worker.abort)
+
+    def enable_dedup(self):
+        """
+        Run identical commands (same command, target, mode and timeout)
+        only once while they are running and share their results.
+        """
+        self.dedup = True
+        self._shared = {}
+        self.dedup_stats = {'executed': 0, 'shared': 0}
+
+    def enable_cache(self, path, ttl):
+        """
+        Keep results of idempotent actions ttl seconds in the file path and
+        reuse them instead of running the actions again. Results of a
+        service are dropped on the nodes where its other actions run.
+        """
+        self.cache = ResultCache(path, ttl)
+
+    def enable_node_timings(self):
+        """Record the completion time of each node of the actions"""
+        self.node_timings = NodeTimings()
+
+    def enable_trace(self, path, nodes=False):
+        """
+        Record the timeline of the run and write it in the file path when
+        the manager is closed, with a span per node if nodes is set.
+        """
+        self.tracer = TraceRecorder(path, nodes)
+        return self.tracer
+
+    def enable_journal(self, path):
+        """Record the actions completed from now on in the journal path"""
+        self.journal = RunJournal(path)
+
+    def resume(self, path):
+        """
+        Reuse results of the run recorded in the journal path: nodes where
+        an action succeeded do not run it again.
+        """
+        self.resumed = read_journal(path)
+
+    def action_completed(self, action):
+        """Action got its final status"""
+        if self.journal and action.worker is not None and \
+           not action.parent.simulate:
+            self.journal.record(action)
+
+    def _perform_partial(self, action, nodes, command, handler, known,
+                         forward=ForwardHandler):
+        """
+        Run command of action only on the nodes whose result is not known.
+        known gives the results of the others as {node: (retcode, lines)}.
+        All results are gathered in the worker given to handler, forward
+        builds the handler of the command from this worker.
+        """
+        result = ResultWorker(nodes, command, handler, self.backend.output)
+        result.replayed.update(NodeSet.fromlist(known.keys()))
+        missing = NodeSet(nodes).difference(result.replayed)
+        if missing:
+            worker = self.backend.shell(command, nodes=missing,
+                                        timeout=action.timeout,
+                                        handler=forward(result))
+            if action in self._cancellers:
+                self._cancellers[action] = (handler, worker.abort)
+        else:
+            result._on_start()
+        for node, (retcode, lines) in sorted(known.items()):
+            for line in lines:
+                result._on_node_msgline(node, line)
+            result._on_node_rc(node, retcode)
+
+    def _perform_cached(self, action, nodes, command, handler):
+        """Only run command on the nodes without a cached result"""
+        key = self.cache.key(action, command)
+        found = self.cache.lookup(key, nodes)[0]
+        self._perform_partial(action, nodes, command, handler, found,
+                    lambda result: CachingHandler(result, self.cache, key))
+
+    def _perform_guarded(self, action, nodes, handler):
+        """Run the guard action of action first, see guard_done()"""
+        guard = action.parent._actions[action.unless]
+        worker = self.backend.shell(guard.resolve_property('command'),
+                                    nodes=nodes, timeout=guard.timeout,
+                                    handler=GuardHandler(action, handler))
+        if action in self._cancellers:
+            self._cancellers[action] = (handler, worker.abort)
+
+    def guard_done(self, action, handler, guard):
+        """
+        The guard action of action is over. Run action only on the nodes
+        where the guard failed, the others are considered done. Results of
+        both are gathered in the worker given to the action handler.
+        """
+        command = action.resolve_property('command')
+        if isinstance(guard, WorkerPopen):
+            if guard.retcode() == 0:
+                handler.ev_close(guard)
+            else:
+                guard.flush_buffers()
+                worker = self.backend.shell(command, timeout=action.timeout,
+                                            handler=handler)
+                self._cancellers[action] = (handler, worker.abort)
+            return
+
+        passed = {}
+        for retcode, nodes in guard.iter_retcodes():
+            if retcode == 0:
+                for node in nodes:
+                    passed[node] = (0, [])
+        guard.flush_buffers()
+        self._perform_partial(action, guard.nodes, command, handler, passed)
+
+    def _perform_shared(self, action, command, handler):
+        """Run command or join the running execution of the same one"""
+        key = (command, str(action.target), action.mode, action.timeout)
+        shared = self._shared.get(key)
+        if shared and shared.running():
+            self.dedup_stats['shared'] += 1
+            shared.share(handler)
+        else:
+            shared = SharedHandler(action.target, command,
+                                   self.backend.output)
+            self._shared[key] = shared
+            self.dedup_stats['executed'] += 1
+            shared.share(handler)
+            self.backend.shell(command, nodes=action.target,
+                               timeout=action.timeout, handler=shared)
 
     def perform_delayed_action(self, action):
         """Perform a delayed action and add it to the running tasks"""
         assert action, 'You cannot perform a NoneType object'
         assert isinstance(action, Action), 'Object should be an action'
+        if self.is_cancelled(action):
+            self._cancel(action)
+            return
         if not action.parent.simulate:
             self.add_task(action)
             call_back_self().notify(action, EV_DELAYED)
-        self._master_task.timer(handler=ActionEventHandler(action),
-                                fire=action.delay)
+        handler = ActionEventHandler(action)
+        timer = self.backend.timer(handler=handler, fire=action.delay)
+        self._cancellers[action] = (handler, timer.invalidate)
+
+    def is_cancelled(self, action):
+        """Return True if action belongs to cancelled work"""
+        if self._cancel_all:
+            return True
+        entity = action.parent
+        while entity is not None:
+            if entity in self._cancelled:
+                return True
+            entity = entity.parent
+        return False
+
+    def action_done(self, action):
+        """Action is over, it cannot be cancelled anymore"""
+        self._cancellers.pop(action, None)
+
+    def _cancel(self, action):
+        """
+        Stop action, running or not, and end it with DEP_ERROR as its
+        result would not change the outcome.
+        """
+        handler, cancel = self._cancellers.pop(action, (None, None))
+        if handler:
+            handler.cancelled = True
+        if cancel:
+            cancel()
+        if not action.start_time:
+            action.start_time = time.time()
+        action.stop_time = time.time()
+        if self._is_running_task(action):
+            self.remove_task(action)
+        action.update_status(DEP_ERROR)
+
+    def entity_failed(self, entity):
+        """
+        Entity ended with an error. Find the entities which are now sure to
+        fail because they strongly depend on it. If this decides the status
+        of the run (fail-fast mode) or of a group with fail_fast set, the
+        actions left within them are cancelled.
+        """
+        if self._cancel_all or entity in self._doomed:
+            return
+        doomed = set([entity])
+        stack = [entity]
+        while stack:
+            current = stack.pop()
+            for dep in current.dependents().values():
+                if dep.is_strong() and dep.target not in doomed:
+                    doomed.add(dep.target)
+                    stack.append(dep.target)
+        self._doomed.update(doomed)
+
+        scopes = [ent for ent in doomed if getattr(ent, 'fail_fast', False)]
+        if self.fail_fast and \
+           [ent for ent in doomed if getattr(ent, 'origin', False)]:
+            self._cancel_all = True
+        elif scopes:
+            self._cancelled.update(scopes)
+        else:
+            return
+        for action in list(self._cancellers):
+            if action in self._cancellers and self.is_cancelled(action):
+                self._cancel(action)
 
     def add_task(self, task):
         """
@@ -122,12 +407,15 @@ class ActionManager(EntityManager):
                 self.entities[fnt] = set()
             # New fnt is lower than the current fanout
             if not self.fanout or fnt < self.fanout:
-                self._master_task.set_info('fanout', fnt)
                 self.fanout = fnt
+                self._apply_fanout()
             # Finally add the task and manage counters
             self.entities[fnt].add(task)
+            self._running.add(task)
+            self._count_running(task, 1)
             self._tasks_done_count += 1
             self._tasks_count += 1
+            self._trace_counters()
 
     def remove_task(self, task):
         """
@@ -141,6 +429,8 @@ class ActionManager(EntityManager):
             fnt = task.fanout or self.default_fanout
             # Remove task
             self.entities[fnt].remove(task)
+            self._running.discard(task)
+            self._count_running(task, -1)
             call_back_self().notify(task.parent, EV_COMPLETE)
 
             # Category is empty so we delete it and we update
@@ -149,14 +439,162 @@ class ActionManager(EntityManager):
                 del self.entities[fnt]
                 if self.entities:
                     self.fanout = self.entities.keys()[0]
-                    self._master_task.set_info('fanout', self.fanout)
+                    self._apply_fanout()
                 else:
                     self.fanout = None
             # Current number of task is decremented
             self._tasks_count -= 1
+            self._trace_counters()
         if not self.tasks_count:
             call_back_self().notify(task.parent, EV_FINISHED)
 
+    def _trace_counters(self):
+        """Record the number of running tasks and the fanout"""
+        if self.tracer:
+            self.tracer.counter('tasks', running=self._tasks_count)
+            fanout = int(self.fanout or 0)
+            if fanout and self.adaptive_fanout:
+                fanout = min(fanout, self.adaptive_fanout.value)
+            self.tracer.counter('fanout', fanout=fanout)
+
+    def _count_running(self, task, delta):
+        """
+        Update the count of running tasks of the service of task and forget
+        the folded names if a service appeared or disappeared.
+        """
+        if task.parent is None:
+            return
+        name = task.parent.name
+        count = self._running_names.get(name, 0) + delta
+        if count > 0:
+            if name not in self._running_names:
+                self._running_folded = None
+            self._running_names[name] = count
+        else:
+            del self._running_names[name]
+            self._running_folded = None
+
+    def enable_adaptive_fanout(self, minimum, maximum):
+        """
+        Let the fanout evolve between minimum and maximum depending on how
+        the nodes respond. The default fanout is used as initial value and
+        then replaced by maximum, so only explicit entity fanouts still
+        limit the computed value.
+        """
+        self.adaptive_fanout = AdaptiveFanout(int(minimum), int(maximum),
+                                              int(self.default_fanout))
+        self.default_fanout = int(maximum)
+
+    def enable_circuit_breaker(self, threshold):
+        """
+        Exclude nodes from the target of the next actions once they timed
+        out or could not be reached by threshold actions.
+        """
+        self.circuit_breaker = threshold
+        self._node_failures = {}
+        self.broken_nodes = NodeSet()
+
+    def _exclude_broken_nodes(self, action):
+        """Remove broken nodes from the target of action"""
+        excluded = action.target.intersection(self.broken_nodes)
+        if excluded:
+            action.update_target(excluded, 'DIF')
+            action.pending_target.difference_update(excluded)
+            action.broken_nodes.update(excluded)
+
+    def _apply_fanout(self):
+        """Set the fanout of the backend from the current fanout"""
+        fanout = self.fanout
+        if self.adaptive_fanout:
+            fanout = min(fanout, self.adaptive_fanout.value)
+        self.backend.set_fanout(fanout)
+
+    def node_done(self, worker):
+        """
+        A node completed the command of worker. Feed the adaptive fanout
+        with it, nodes which could not be reached are failures. Results
+        which did not come from a command are ignored.
+        """
+        if isinstance(worker, ResultWorker) and \
+           worker.current_node in worker.replayed:
+            return
+        if self.adaptive_fanout and not isinstance(worker, WorkerPopen):
+            if worker.current_rc == 255:
+                self.adaptive_fanout.failure()
+            else:
+                self.adaptive_fanout.success()
+            if self.fanout:
+                self._apply_fanout()
+
+    def worker_done(self, worker, action):
+        """
+        Worker of action is over. Feed the adaptive fanout with the nodes
+        which timed out and count nodes failures for the circuit breaker,
+        once per action whatever the number of tries.
+        """
+        if self.circuit_breaker and not isinstance(worker, WorkerPopen):
+            failed = NodeSet.fromlist(worker.iter_keys_timeout())
+            for retcode, nodes in worker.iter_retcodes():
+                if retcode == 255:
+                    failed.update(nodes)
+            failed.difference_update(action.failed_nodes)
+            action.failed_nodes.update(failed)
+            for node in failed:
+                count = self._node_failures.get(node, 0) + 1
+                self._node_failures[node] = count
+                if count >= self.circuit_breaker:
+                    self.broken_nodes.add(node)
+        if self.adaptive_fanout and not isinstance(worker, WorkerPopen):
+            if worker.num_timeout():
+                self.adaptive_fanout.failure()
+                if self.fanout:
+                    self._apply_fanout()
+
+    def start_batch(self, source, action_name):
+        """
+        Send the batchable actions needed to run action_name from source
+        to the nodes, as one script per node.
+        """
+        self.batch = BatchRun(source, action_name, self.dryrun)
+        self.batch.start(self.backend)
+
+    def stop_batch(self):
+        """Forget the batched actions of the last run"""
+        self.batch = None
+
+    def enable_output_store(self, budget=0, action_budget=0, max_lines=0,
+                            max_bytes=0):
+        """
+        Keep output of distant actions within memory budgets (in bytes)
+        and truncated to max_lines lines and max_bytes bytes per node.
+        """
+        self.output_store = OutputStore(budget, action_budget, max_lines,
+                                        max_bytes)
+
+    def keep_output(self, worker, action):
+        """Return the results of worker as they should be kept"""
+        if self.output_store and not isinstance(worker, WorkerPopen):
+            return self.output_store.keep(worker, action.fullname())
+        return worker
+
+    def close(self):
+        """
+        Release resources held by the backend and the spooled output, save
+        cached results, close the journal and write the trace at the end of
+        a run
+        """
+        self.backend.close()
+        if self.output_store:
+            self.output_store.close()
+        if self.cache:
+            self.cache.save()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        if self.tracer:
+            self.tracer.close()
+            self.tracer = None
+
     def _is_running_task(self, task):
         """
         Allow us to determine whether a task is running or not
@@ -170,16 +608,30 @@ class ActionManager(EntityManager):
 
     def run(self):
         """ Run the action manager task"""
-        if not self._master_task.running():
-            self._master_task.run()
+        if not self.backend.running():
+            try:
+                self.backend.run()
+            finally:
+                self._cancel_all = False
+                self._cancelled = set()
+                self._doomed = set()
+                self._cancellers = {}
 
     @property
     def running_tasks(self):
         """Return a set of running tasks"""
-        running_tasks = set()
-        for tasks in self.entities.values():
-            running_tasks.update(tasks)
-        return running_tasks
+        return set(self._running)
+
+    @property
+    def running_names(self):
+        """
+        Return the folded names of the services with running tasks. The
+        string is only computed again when this set of names changed.
+        """
+        if self._running_folded is None:
+            self._running_folded = str(NodeSet.fromlist(
+                                            list(self._running_names)))
+        return self._running_folded
 
     @property
     def tasks_count(self):
@@ -217,9 +669,13 @@ class MilkCheckEventHandler(EventHandler):
         assert action, "should not be be None"
         # Current action hooked to the handler
         self._action = action
+        # Events of cancelled actions are ignored
+        self.cancelled = False
 
     def ev_start(self, worker):
         '''Command has been started on a nodeset'''
+        if self.cancelled:
+            return
         if not self._action.parent.simulate:
             call_back_self().notify(self._action, EV_STARTED)
 
@@ -230,24 +686,79 @@ class MilkCheckEventHandler(EventHandler):
         to handle action with a service which is specified as ghost. That means
         it does nothing
         '''
+        if self.cancelled:
+            return
+        action_manager_self().action_done(self._action)
         self._action.schedule(allow_delay=False)
        
         
+class GuardHandler(EventHandler):
+    '''
+    Handle the guard action run before an action which has the 'unless'
+    property. Once the guard is over, the action is run where it failed.
+    '''
+
+    def __init__(self, action, handler):
+        EventHandler.__init__(self)
+        self._action = action
+        # Handler of the guarded action
+        self._handler = handler
+
+    def ev_close(self, worker):
+        '''Guard is over on all the nodes'''
+        if not self._handler.cancelled:
+            action_manager_self().guard_done(self._action, self._handler,
+                                             worker)
+
 class ActionEventHandler(MilkCheckEventHandler):
     '''
     Inherit from our basic handler and specify others event raised to
     process an action.
     '''
-    
+
+    # Start time of the command and completion time of its nodes, only
+    # when node timings or node spans are recorded
+    _started = None
+    _latencies = None
+
+    def ev_start(self, worker):
+        '''Command has been started on a nodeset'''
+        MilkCheckEventHandler.ev_start(self, worker)
+        manager = action_manager_self()
+        if (manager.node_timings is not None or
+            (manager.tracer and manager.tracer.nodes)) and \
+           not isinstance(worker, WorkerPopen):
+            self._started = time.time()
+            self._latencies = {}
+
     def ev_hup(self, worker):
         '''Update remaining target'''
+        if self.cancelled:
+            return
         self._action.pending_target.remove(worker.current_node)
+        if self._latencies is not None:
+            self._latencies[worker.current_node] = time.time() - self._started
+        action_manager_self().node_done(worker)
 
     def ev_close(self, worker):
         '''
         This event is raised by the master task as soon as an action is
         done. It specifies the how the action will be computed.
         '''
+        if self.cancelled:
+            return
+        action_manager_self().action_done(self._action)
+        if self._latencies is not None:
+            # Nodes which timed out took the whole run of the command
+            for node in worker.iter_keys_timeout():
+                self._latencies[node] = time.time() - self._started
+            manager = action_manager_self()
+            if manager.node_timings is not None:
+                manager.node_timings.add(self._latencies)
+            if manager.tracer and manager.tracer.nodes:
+                manager.tracer.node_spans(self._action, self._started,
+                                          self._latencies)
+
         # Assign time duration to the current action
         self._action.stop_time = time.time()
 
@@ -256,19 +767,23 @@ class ActionEventHandler(MilkCheckEventHandler):
         action_manager_self().remove_task(self._action)
 
         # Get back the worker from ClusterShell
+        worker = action_manager_self().keep_output(worker, self._action)
         self._action.worker = worker
+        action_manager_self().worker_done(worker, self._action)
 
         # Checkout actions issues
         errors = self._action.nb_errors()
         timeouts = self._action.nb_timeout()
-        failed = errors + timeouts
+        broken = self._action.nb_broken()
+        failed = errors + timeouts + broken
 
-        # Classic Action was failed
-        if failed and self._action.tries <= self._action.maxretry:
+        # Classic Action was failed, excluded nodes are not worth a retry
+        if errors + timeouts and \
+           self._action.tries <= self._action.maxretry:
             self._action.schedule()
 
         # timeout when more timeouts than permited
-        elif timeouts > self._action.errors and errors == 0:
+        elif timeouts > self._action.errors and errors + broken == 0:
             self._action.update_status(TIMEOUT)
         # _action.errors has a higher priority than _action.warnings
         # failed when too many errors
@@ -312,6 +827,18 @@ class Action(BaseEntity):
         # Store pending targets
         self.pending_target = NodeSet()
 
+        # Nodes excluded by the circuit breaker
+        self.broken_nodes = NodeSet()
+        # Nodes whose failure was counted by the circuit breaker
+        self.failed_nodes = NodeSet()
+
+        # Name of the action of the same service run first, this action is
+        # only run on the nodes where it failed
+        self.unless = None
+
+        # Results of the action may be reused from the cache
+        self.idempotent = False
+
     def reset(self):
         '''
         Reset values of attributes in order to used the action multiple time.
@@ -321,6 +848,8 @@ class Action(BaseEntity):
         self.stop_time = None
         self.worker = None
         self.tries = 0
+        self.broken_nodes = NodeSet()
+        self.failed_nodes = NodeSet()
 
     def run(self):
         '''Prepare the current action and set up the master task'''
@@ -365,6 +894,7 @@ class Action(BaseEntity):
         self.status = status
         call_back_self().notify(self, EV_STATUS_CHANGED)
         if status not in (NO_STATUS, WAITING_STATUS):
+            action_manager_self().action_completed(self)
             if not self.parent.simulate:
                 call_back_self().notify(self, EV_COMPLETE)
             if self.children:
@@ -387,10 +917,12 @@ class Action(BaseEntity):
                 return len(list(self.worker.iter_keys_timeout()))
         return 0
         
+    def nb_broken(self):
+        '''Return the number of nodes excluded by the circuit breaker.'''
+        return len(self.broken_nodes)
+
     def nb_errors(self):
-        '''
-        Return the amount of error in the worker.
-        '''
+        '''Return the amount of error in the worker.'''
         error_count = 0
         if self.worker:
             if isinstance(self.worker, WorkerPopen):
@@ -438,3 +970,9 @@ class Action(BaseEntity):
 
         if 'cmd' in actdict:
             self.command = actdict['cmd']
+
+        if 'unless' in actdict:
+            self.unless = actdict['unless']
+
+        if 'idempotent' in actdict:
+            self.idempotent = actdict['idempotent']
@@ -0,0 +1,880 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the execution backends used by the ActionManager.
+
+A backend runs the commands and the timers requested by the engine. The
+ClusterShellBackend, based on the ClusterShell master task, is the default
+one. The FakeClusterBackend emulates a cluster of virtual nodes on the local
+host. The NodeLimitedBackend wraps another backend to limit the number of
+commands running at the same time on each node. It also contains the
+ResultWorker, a worker-like container of node results.
+
+Backends only keep the output the interfaces need: all of it, output of
+failing nodes (OUTPUT_ERRORS) or nothing (OUTPUT_NONE). Unless all of it is
+kept, the ClusterShell task keeps no output and results are kept per node
+by the workers of the backend, events are raised anyway.
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+from abc import ABCMeta, abstractmethod
+from collections import deque
+
+from ClusterShell.Event import EventHandler
+from ClusterShell.NodeSet import NodeSet
+from ClusterShell.Task import task_self
+
+from MilkCheck.Engine.BaseEntity import MilkCheckEngineError
+
+# Output kept by the workers
+OUTPUT_ALL = 'all'
+OUTPUT_ERRORS = 'errors'
+OUTPUT_NONE = 'none'
+
+class BackendError(MilkCheckEngineError):
+    '''
+    Error raised when the execution backend requested by the configuration
+    is unknown or cannot be set up with the provided options.
+    '''
+
+class ResultWorker(object):
+    '''
+    Worker-like container of results indexed by node. It provides the same
+    reading methods as a ClusterShell distant worker, so actions and
+    interfaces can use it the same way. Results are pushed through the
+    _on_node_* methods, which raise the events of the handler. Output is
+    kept according to the output policy.
+    '''
+
+    def __init__(self, nodes, command=None, handler=None, output=OUTPUT_ALL):
+        self.nodes = NodeSet(nodes)
+        self.command = command
+        self.eh = handler
+        self.output = output
+        self.current_node = None
+        self.current_msg = None
+        self.current_rc = None
+        self._buffers = {}
+        self._retcodes = {}
+        self._timeouts = set()
+        self._started = False
+        self._closed = False
+        # Nodes whose results were not produced by a command run for this
+        # worker (cached, resumed or shared results)
+        self.replayed = NodeSet()
+
+    def _on_start(self):
+        '''Raise ev_start the first time the worker gets started'''
+        if not self._started:
+            self._started = True
+            if self.eh:
+                self.eh.ev_start(self)
+
+    def _on_node_msgline(self, node, msg):
+        '''A new line of output is available for node'''
+        self.current_node = node
+        self.current_msg = msg
+        if self.output != OUTPUT_NONE:
+            self._buffers.setdefault(node, []).append(msg)
+        if self.eh:
+            self.eh.ev_read(self)
+
+    def _on_node_rc(self, node, rc):
+        '''Command is over on node'''
+        self.current_node = node
+        self.current_rc = rc
+        self._retcodes[node] = rc
+        if self.output == OUTPUT_ERRORS and rc == 0:
+            self._buffers.pop(node, None)
+        if self.eh:
+            self.eh.ev_hup(self)
+        self._check_fini()
+
+    def _on_node_timeout(self, node):
+        '''Command timed out on node'''
+        self.current_node = node
+        self._timeouts.add(node)
+        self._check_fini()
+
+    def _check_fini(self):
+        '''Close the worker as soon as all the nodes are done'''
+        if not self._closed and \
+           len(self._retcodes) + len(self._timeouts) >= len(self.nodes):
+            self._closed = True
+            if self.eh:
+                if self._timeouts:
+                    self.eh.ev_timeout(self)
+                self.eh.ev_close(self)
+
+    def abort(self):
+        '''Nothing runs behind a bare result worker'''
+        pass
+
+    def did_timeout(self):
+        '''Return True if at least one node timed out'''
+        return len(self._timeouts) > 0
+
+    def node_buffer(self, node):
+        '''Return the output of node'''
+        return '\n'.join(self._buffers.get(node, []))
+
+    def node_retcode(self, node):
+        '''Return the return code of node, raise KeyError if unknown'''
+        return self._retcodes[node]
+
+    def iter_node_buffers(self, match_keys=None):
+        '''Iterate over (node, buffer) couples'''
+        for node in sorted(self._buffers):
+            if match_keys is None or node in match_keys:
+                yield node, self.node_buffer(node)
+
+    def iter_buffers(self, match_keys=None):
+        '''Iterate over buffers and the nodeset which produced them'''
+        gathered = {}
+        for node, buf in self.iter_node_buffers(match_keys):
+            gathered.setdefault(buf, []).append(node)
+        for buf, nodes in gathered.items():
+            yield buf, NodeSet.fromlist(nodes)
+
+    def iter_node_retcodes(self):
+        '''Iterate over (node, retcode) couples'''
+        return self._retcodes.iteritems()
+
+    def iter_retcodes(self, match_keys=None):
+        '''Iterate over return codes and the nodeset which returned them'''
+        gathered = {}
+        for node, retcode in self._retcodes.items():
+            if match_keys is None or node in match_keys:
+                gathered.setdefault(retcode, []).append(node)
+        for retcode in sorted(gathered):
+            yield retcode, NodeSet.fromlist(gathered[retcode])
+
+    def num_timeout(self):
+        '''Return the number of nodes which timed out'''
+        return len(self._timeouts)
+
+    def iter_keys_timeout(self):
+        '''Iterate over the nodes which timed out'''
+        return iter(self._timeouts)
+
+    def flush_buffers(self):
+        '''Forget output of all the nodes'''
+        self._buffers.clear()
+
+    def flush_errors(self):
+        '''Error output is kept along with output, there is nothing else'''
+        pass
+
+class ExecutionBackend(object):
+    '''
+    This interface specifies what the ActionManager expects from an
+    execution backend. Handlers given to the backend receive the same events
+    as ClusterShell event handlers. Backends which do not implement all the
+    abstract methods cannot be instanciated.
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self):
+        # Output kept by the workers of the backend
+        self.output = OUTPUT_ALL
+
+    def set_output(self, output):
+        '''Change the output kept by the workers started from now on'''
+        self.output = output
+
+    @abstractmethod
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        '''
+        Run command on nodes, or locally if nodes is None, and return the
+        worker in charge of it.
+        '''
+        pass
+
+    @abstractmethod
+    def timer(self, fire, handler, interval=-1.0, autoclose=False):
+        '''Arm a timer which calls handler.ev_timer() after fire seconds'''
+        pass
+
+    @abstractmethod
+    def set_fanout(self, fanout):
+        '''Change the maximum number of commands running at the same time'''
+        pass
+
+    @abstractmethod
+    def running(self):
+        '''Return True if the backend is currently running'''
+        pass
+
+    @abstractmethod
+    def run(self):
+        '''Run everything which was scheduled until it is done'''
+        pass
+
+    def probe(self, nodes, timeout):
+        '''
+        Check nodes can be reached within timeout seconds and return the
+        nodeset of those which cannot. Backends which cannot tell consider
+        all the nodes reachable.
+        '''
+        return NodeSet()
+
+    def close(self):
+        '''Release resources kept during the run'''
+        pass
+
+class FilteredWorker(ResultWorker):
+    '''
+    Results of a distant command kept according to the output policy. They
+    are forwarded from the ClusterShell worker running the command, while
+    the task keeps no output.
+    '''
+
+    def __init__(self, nodes, command, handler, output):
+        ResultWorker.__init__(self, nodes, command, handler, output)
+        self.worker = None
+
+    def abort(self):
+        '''Abort the command'''
+        if self.worker:
+            self.worker.abort()
+
+class LocalHandler(EventHandler):
+    '''
+    Keep the output of a local command according to the output policy, as
+    the task keeps no output, and forward the events to handler.
+    '''
+
+    def __init__(self, handler, output):
+        EventHandler.__init__(self)
+        self.handler = handler
+        self.output = output
+        self.lines = []
+
+    def ev_start(self, worker):
+        '''Forward start of the command'''
+        if self.handler:
+            self.handler.ev_start(worker)
+
+    def ev_read(self, worker):
+        '''Keep and forward a line of output'''
+        if self.output != OUTPUT_NONE:
+            self.lines.append(worker.current_msg)
+        if self.handler:
+            self.handler.ev_read(worker)
+
+    def ev_error(self, worker):
+        '''Keep and forward a line of error output'''
+        if self.output != OUTPUT_NONE:
+            self.lines.append(worker.current_errmsg)
+        if self.handler:
+            self.handler.ev_error(worker)
+
+    def ev_written(self, worker):
+        '''Forward written data'''
+        if self.handler:
+            self.handler.ev_written(worker)
+
+    def ev_hup(self, worker):
+        '''Forward return code, output of a successful command is dropped'''
+        if self.output == OUTPUT_ERRORS and worker.current_rc == 0:
+            self.lines = []
+        if self.handler:
+            self.handler.ev_hup(worker)
+
+    def ev_timeout(self, worker):
+        '''Forward timeout of the command'''
+        if self.handler:
+            self.handler.ev_timeout(worker)
+
+    def ev_close(self, worker):
+        '''Forward end of the command'''
+        if self.handler:
+            self.handler.ev_close(worker)
+
+def local_output(worker):
+    '''Return the output of a local command'''
+    if isinstance(worker.eh, LocalHandler):
+        return '\n'.join(worker.eh.lines)
+    return worker.read()
+
+class ClusterShellBackend(ExecutionBackend):
+    '''
+    Default backend, it relies on the ClusterShell master task. Commands are
+    run over ssh on distant nodes.
+    '''
+
+    def __init__(self):
+        ExecutionBackend.__init__(self)
+        self._task = task_self()
+        self.set_output(OUTPUT_ALL)
+        # Directory of ssh master connection sockets
+        self.control_dir = None
+        self._ssh_options = None
+
+    def set_output(self, output):
+        '''
+        The task keeps output of the commands run from now on only when all
+        of it is kept. Otherwise workers of the backend keep it per node.
+        '''
+        ExecutionBackend.set_output(self, output)
+        self._task.set_default('stdout_msgtree', output == OUTPUT_ALL)
+        self._task.set_default('stderr_msgtree', output == OUTPUT_ALL)
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        '''Schedule command within the master task'''
+        if self.output == OUTPUT_ALL:
+            return self._task.shell(command, nodes=nodes, timeout=timeout,
+                                    handler=handler)
+        if not nodes:
+            return self._task.shell(command, timeout=timeout,
+                                    handler=LocalHandler(handler, self.output))
+        result = FilteredWorker(nodes, command, handler, self.output)
+        result.worker = self._task.shell(command, nodes=nodes,
+                                         timeout=timeout,
+                                         handler=ForwardHandler(result))
+        return result
+
+    def timer(self, fire, handler, interval=-1.0, autoclose=False):
+        '''Arm a timer within the master task'''
+        return self._task.timer(fire=fire, handler=handler, interval=interval,
+                                autoclose=autoclose)
+
+    def set_fanout(self, fanout):
+        '''Update the fanout of the master task'''
+        self._task.set_info('fanout', fanout)
+
+    def running(self):
+        '''Return True if the master task is running'''
+        return self._task.running()
+
+    def run(self):
+        '''Run the master task'''
+        self._task.run()
+
+    def probe(self, nodes, timeout):
+        '''
+        Run a no-op command on nodes with a short connection timeout. Nodes
+        which time out or where ssh fails (return code 255) are unreachable.
+        '''
+        connect_timeout = self._task.info('connect_timeout')
+        self._task.set_info('connect_timeout', timeout)
+        try:
+            worker = self.shell(':', nodes=nodes, timeout=2 * timeout)
+            self.run()
+        finally:
+            self._task.set_info('connect_timeout', connect_timeout)
+        reachable = NodeSet()
+        for retcode, rc_nodes in worker.iter_retcodes():
+            if retcode != 255:
+                reachable.update(rc_nodes)
+        worker.flush_buffers()
+        return NodeSet(nodes) - reachable
+
+    def enable_multiplexing(self, persist=60):
+        '''
+        Make ssh keep one master connection per node, shared by all the
+        commands run on it, so the ssh handshake is done once per node.
+        Master connections live in a private socket directory and stay
+        persist seconds after their last use, unless close() ends them.
+        '''
+        if self.control_dir:
+            return
+        self.control_dir = tempfile.mkdtemp(prefix='milkcheck-ssh-')
+        self._ssh_options = self._task.info('ssh_options')
+        options = '-oControlMaster=auto -oControlPath=%s ' \
+                  '-oControlPersist=%d' % \
+                  (os.path.join(self.control_dir, '%r@%h:%p'), persist)
+        if self._ssh_options:
+            options = '%s %s' % (self._ssh_options, options)
+        self._task.set_info('ssh_options', options)
+
+    def close(self):
+        '''End ssh master connections and remove their socket directory'''
+        if not self.control_dir:
+            return
+        devnull = open(os.devnull, 'w')
+        try:
+            for sock in os.listdir(self.control_dir):
+                host = sock.rsplit(':', 1)[0].split('@', 1)[-1]
+                subprocess.call(['ssh', '-oControlPath=%s' %
+                                 os.path.join(self.control_dir, sock),
+                                 '-Oexit', host],
+                                stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+        self._task.set_info('ssh_options', self._ssh_options)
+
+class FakeNodeHandler(EventHandler):
+    '''
+    Handle the events of one virtual node. The timer emulates the
+    connection to the node, then the command is run by a local process.
+    '''
+
+    def __init__(self, worker, node, failed):
+        EventHandler.__init__(self)
+        self._worker = worker
+        self._node = node
+        self._failed = failed
+
+    def ev_timer(self, timer):
+        '''Connection to the virtual node is established (or not)'''
+        self._worker._node_connected(self._node, self._failed, self)
+
+    def ev_read(self, worker):
+        '''Output of the local process of the virtual node'''
+        self._worker._node_msgline(self._node, worker.current_msg)
+
+    def ev_close(self, worker):
+        '''Local process of the virtual node is over'''
+        self._worker._node_closed(self._node, worker)
+
+class FakeWorker(ResultWorker):
+    '''
+    Worker emulating the execution of a command over virtual nodes. Each
+    node goes through a simulated connection then runs the command within
+    the local process pool of the FakeClusterBackend.
+    '''
+
+    def __init__(self, backend, nodes, command, timeout, handler):
+        ResultWorker.__init__(self, nodes, command, handler)
+        self._backend = backend
+        self._timeout = timeout
+        self._timers = []
+        self._popens = set()
+        self._aborted = False
+
+    def _start(self):
+        '''Arm the connection timers of all the nodes'''
+        for node in self.nodes:
+            latency, failed = self._backend.draw(node)
+            handler = FakeNodeHandler(self, node, failed)
+            self._timers.append(self._backend.timer(latency, handler))
+
+    def _node_connected(self, node, failed, handler):
+        '''Start command on node or fail as ssh would do'''
+        if self._aborted:
+            return
+        self._on_start()
+        if failed:
+            self._on_node_msgline(node,
+                'ssh: connect to host %s port 22: Connection refused' % node)
+            self._on_node_rc(node, 255)
+        else:
+            self._backend.submit(self, node, handler)
+
+    def _launch(self, node, handler):
+        '''Run command locally on behalf of node'''
+        popen = self._backend.local_shell(self.command, self._timeout, handler)
+        self._popens.add(popen)
+
+    def _node_msgline(self, node, msg):
+        '''Gather output of the local process of node'''
+        if not self._aborted:
+            self._on_node_msgline(node, msg)
+
+    def _node_closed(self, node, popen):
+        '''Gather results of the local process of node'''
+        self._popens.discard(popen)
+        self._backend.release()
+        if self._aborted:
+            return
+        popen.flush_buffers()
+        if popen.did_timeout():
+            self._on_node_timeout(node)
+        else:
+            self._on_node_rc(node, popen.retcode())
+
+    def abort(self):
+        '''Stop emulation of all the nodes which are not done yet'''
+        self._aborted = True
+        for timer in self._timers:
+            timer.invalidate()
+        self._backend.forget(self)
+        for popen in list(self._popens):
+            popen.abort()
+
+class FakeClusterBackend(ClusterShellBackend):
+    '''
+    Backend emulating a cluster of virtual nodes on the local host. Distant
+    commands are run locally, once per virtual node, through a pool of at
+    most 'pool' processes. Each node waits for a simulated connection
+    latency (a delay in seconds or a [min, max] range) and fails to connect
+    according to its failure rate. Latency and failure rate can be
+    customized per nodeset with the 'nodes' dictionary. The random generator
+    is seeded with 'seed' to make runs reproducible.
+    '''
+
+    def __init__(self, pool=16, latency=0, failure_rate=0.0, nodes=None,
+                 seed=None):
+        ClusterShellBackend.__init__(self)
+        assert pool > 0, 'Process pool size must be positive'
+        self.pool = pool
+        self._default = {'latency': latency, 'failure_rate': failure_rate}
+        self._profiles = []
+        for nodeset, profile in (nodes or {}).items():
+            self._profiles.append((NodeSet(nodeset), profile))
+        self._random = random.Random(seed)
+        self._running = 0
+        self._waiting = deque()
+
+    def draw(self, node):
+        '''Return the connection latency of node and if it failed'''
+        profile = self._default
+        for nodeset, custom in self._profiles:
+            if node in nodeset:
+                profile = dict(self._default, **custom)
+                break
+        latency = profile['latency']
+        if isinstance(latency, (list, tuple)):
+            latency = self._random.uniform(latency[0], latency[1])
+        failed = self._random.random() < profile['failure_rate']
+        # ClusterShell timers are only armed with a positive delay
+        return max(latency, 1e-6), failed
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        '''Emulate command on virtual nodes, local commands are run as is'''
+        if not nodes:
+            return ClusterShellBackend.shell(self, command, timeout=timeout,
+                                             handler=handler)
+        worker = FakeWorker(self, nodes, command, timeout, handler)
+        worker.output = self.output
+        worker._start()
+        return worker
+
+    def local_shell(self, command, timeout, handler):
+        '''Run command within a local process'''
+        return self._task.shell(command, timeout=timeout, handler=handler)
+
+    def submit(self, worker, node, handler):
+        '''Run command of node now or as soon as a process is available'''
+        if self._running < self.pool:
+            self._running += 1
+            worker._launch(node, handler)
+        else:
+            self._waiting.append((worker, node, handler))
+
+    def release(self):
+        '''A process is over, start the next waiting node if any'''
+        self._running -= 1
+        if self._waiting:
+            worker, node, handler = self._waiting.popleft()
+            self.submit(worker, node, handler)
+
+    def forget(self, worker):
+        '''Remove waiting nodes of an aborted worker'''
+        self._waiting = deque([item for item in self._waiting
+                                    if item[0] is not worker])
+
+class ForwardHandler(EventHandler):
+    '''
+    Forward the events of a distant worker to a ResultWorker, so results of
+    several workers can be gathered in a single one.
+    '''
+
+    def __init__(self, worker):
+        EventHandler.__init__(self)
+        self._worker = worker
+
+    def ev_start(self, worker):
+        '''First nodes are started'''
+        self._worker._on_start()
+
+    def ev_read(self, worker):
+        '''Forward output of the current node'''
+        self._worker._on_node_msgline(worker.current_node, worker.current_msg)
+
+    def ev_error(self, worker):
+        '''Forward error output of the current node along with its output'''
+        self._worker._on_node_msgline(worker.current_node,
+                                      worker.current_errmsg)
+
+    def ev_hup(self, worker):
+        '''Forward return code of the current node'''
+        self._worker._on_node_rc(worker.current_node, worker.current_rc)
+
+    def ev_timeout(self, worker):
+        '''Forward nodes which timed out'''
+        for node in worker.iter_keys_timeout():
+            self._worker._on_node_timeout(node)
+
+    def ev_close(self, worker):
+        '''Results were forwarded, they are no longer needed'''
+        worker.flush_buffers()
+        worker.flush_errors()
+
+class SharedHandler(EventHandler):
+    '''
+    Handle a worker whose results are shared by several consumers. Results
+    are recorded so consumers added while the worker is running get all of
+    them. Each consumer gets its own ResultWorker.
+    '''
+
+    def __init__(self, nodes, command, output=OUTPUT_ALL):
+        EventHandler.__init__(self)
+        self.record = ResultWorker(nodes, command, output=output)
+        self.views = []
+
+    def running(self):
+        '''Return True until all the results were received'''
+        return not self.record._closed
+
+    def share(self, handler):
+        '''Add a consumer and return its ResultWorker'''
+        view = ResultWorker(self.record.nodes, self.record.command, handler,
+                            self.record.output)
+        # Only the first consumer accounts for the command
+        if self.views:
+            view.replayed.update(view.nodes)
+        self.views.append(view)
+        record = self.record
+        if record._started:
+            view._on_start()
+        for node in sorted(record._buffers):
+            for msg in record._buffers[node]:
+                view._on_node_msgline(node, msg)
+        for node, retcode in record._retcodes.items():
+            view._on_node_rc(node, retcode)
+        for node in record._timeouts:
+            view._on_node_timeout(node)
+        return view
+
+    def _targets(self):
+        '''Return the record followed by all the views'''
+        return [self.record] + self.views
+
+    def ev_start(self, worker):
+        '''First nodes are started'''
+        for target in self._targets():
+            target._on_start()
+
+    def ev_read(self, worker):
+        '''Forward output of the current node'''
+        for target in self._targets():
+            target._on_node_msgline(worker.current_node, worker.current_msg)
+
+    def ev_hup(self, worker):
+        '''Forward return code of the current node'''
+        for target in self._targets():
+            target._on_node_rc(worker.current_node, worker.current_rc)
+
+    def ev_timeout(self, worker):
+        '''Forward nodes which timed out'''
+        for node in worker.iter_keys_timeout():
+            for target in self._targets():
+                target._on_node_timeout(node)
+
+    def ev_close(self, worker):
+        '''Results were forwarded, they are no longer needed'''
+        worker.flush_buffers()
+        self.record.flush_buffers()
+
+class SlotHandler(ForwardHandler):
+    '''
+    Forward the events of a worker started by the NodeLimitedBackend to the
+    LimitedWorker it belongs to, and release node slots as nodes are done.
+    '''
+
+    def __init__(self, limiter, worker):
+        ForwardHandler.__init__(self, worker)
+        self._limiter = limiter
+
+    def ev_hup(self, worker):
+        '''Node is done, its slot can be used by waiting commands'''
+        ForwardHandler.ev_hup(self, worker)
+        self._worker._release([worker.current_node])
+
+    def ev_timeout(self, worker):
+        '''Nodes timed out, their slots can be used by waiting commands'''
+        ForwardHandler.ev_timeout(self, worker)
+        self._worker._release(list(worker.iter_keys_timeout()))
+
+class LimitedWorker(ResultWorker):
+    '''
+    Gather results of a command run by the NodeLimitedBackend. Nodes of the
+    command are dispatched by subsets as node slots get available.
+    '''
+
+    def __init__(self, limiter, nodes, command, timeout, handler, rank=0):
+        ResultWorker.__init__(self, nodes, command, handler, limiter.output)
+        self._limiter = limiter
+        self._timeout = timeout
+        # Submission order within the limiter
+        self.rank = rank
+        self.pending = NodeSet(nodes)
+        # Nodes running the command, they hold a slot
+        self.running = NodeSet()
+        self._workers = []
+
+    def _launch(self, nodes):
+        '''Run command on nodes which got a slot'''
+        self.running.update(nodes)
+        self._workers.append(self._limiter.backend.shell(self.command,
+                                 nodes=nodes, timeout=self._timeout,
+                                 handler=SlotHandler(self._limiter, self)))
+
+    def _release(self, nodes):
+        '''Give back the slots of nodes which still hold one'''
+        nodes = [node for node in nodes if node in self.running]
+        if nodes:
+            self.running.difference_update(NodeSet.fromlist(nodes))
+            self._limiter.release(nodes)
+
+    def abort(self):
+        '''
+        Forget waiting nodes and abort running ones. Aborted commands raise
+        no more events, so their slots are given back here.
+        '''
+        self.pending = NodeSet()
+        for worker in self._workers:
+            worker.abort()
+        self._release(list(self.running))
+
+class NodeLimitedBackend(ExecutionBackend):
+    '''
+    Wrap another backend to run at most max_per_node commands at the same
+    time on each node, whatever the action they come from. Nodes beyond the
+    limit wait for a slot and are dispatched, in submission order, as soon
+    as commands end on them. Local commands are not limited.
+    '''
+
+    def __init__(self, backend, max_per_node):
+        ExecutionBackend.__init__(self)
+        assert max_per_node > 0, 'Commands per node must be positive'
+        self.backend = backend
+        self.max_per_node = max_per_node
+        self._running = {}
+        # Workers waiting for a slot, by node, in submission order. A node
+        # only has waiting workers while all its slots are used.
+        self._waiting = {}
+        self._submitted = 0
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        '''Queue command on nodes and dispatch what can be'''
+        if not nodes:
+            return self.backend.shell(command, timeout=timeout,
+                                      handler=handler)
+        self._submitted += 1
+        worker = LimitedWorker(self, nodes, command, timeout, handler,
+                               self._submitted)
+        ready = []
+        for node in worker.pending:
+            if self._running.get(node, 0) < self.max_per_node:
+                self._running[node] = self._running.get(node, 0) + 1
+                ready.append(node)
+            else:
+                self._waiting.setdefault(node, deque()).append(worker)
+        if ready:
+            ready = NodeSet.fromlist(ready)
+            worker.pending.difference_update(ready)
+            worker._launch(ready)
+        return worker
+
+    def release(self, nodes):
+        '''
+        Commands are over on nodes: give their slots to the first workers
+        waiting for them and start these workers on the nodes.
+        '''
+        ready = {}
+        for node in nodes:
+            self._running[node] -= 1
+            queue = self._waiting.get(node)
+            while queue and self._running[node] < self.max_per_node:
+                worker = queue.popleft()
+                # Aborted workers have no pending node anymore
+                if node in worker.pending:
+                    self._running[node] += 1
+                    ready.setdefault(worker, []).append(node)
+            if not queue:
+                self._waiting.pop(node, None)
+            if not self._running[node]:
+                del self._running[node]
+        for worker in sorted(ready, key=lambda worker: worker.rank):
+            nodes = NodeSet.fromlist(ready[worker])
+            worker.pending.difference_update(nodes)
+            worker._launch(nodes)
+
+    def running_on(self, node):
+        '''Return the number of commands currently running on node'''
+        return self._running.get(node, 0)
+
+    def probe(self, nodes, timeout):
+        '''Nodes are probed by the wrapped backend, before any command'''
+        return self.backend.probe(nodes, timeout)
+
+    def timer(self, fire, handler, interval=-1.0, autoclose=False):
+        '''Timers are handled by the wrapped backend'''
+        return self.backend.timer(fire, handler, interval, autoclose)
+
+    def set_fanout(self, fanout):
+        '''Fanout is handled by the wrapped backend'''
+        self.backend.set_fanout(fanout)
+
+    def set_output(self, output):
+        '''Output policy applies to the wrapped backend as well'''
+        ExecutionBackend.set_output(self, output)
+        self.backend.set_output(output)
+
+    def running(self):
+        '''Return True if the wrapped backend is running'''
+        return self.backend.running()
+
+    def run(self):
+        '''Run the wrapped backend'''
+        self.backend.run()
+
+    def close(self):
+        '''Close the wrapped backend'''
+        self.backend.close()
+
+BACKENDS = {
+    'clustershell': ClusterShellBackend,
+    'fake': FakeClusterBackend,
+}
+
+def make_backend(name, options=None):
+    '''Instanciate the backend called name, configured with options'''
+    if name not in BACKENDS:
+        raise BackendError("Unknown execution backend '%s'" % name)
+    try:
+        return BACKENDS[name](**(options or {}))
+    except TypeError, exc:
+        raise BackendError("Bad options for backend '%s': %s" % (name, exc))
@@ -39,6 +39,8 @@ import logging
 from subprocess import Popen, PIPE
 from ClusterShell.NodeSet import NodeSet
 
+from MilkCheck.Engine.Timing import phase_timers_self
+
 # Status available for an entity
 
 # Typically this means that the entity has no status (not any process done) 
@@ -421,6 +423,17 @@ class BaseEntity(object):
         else:
             return self.parents
 
+    def dependents(self):
+        """
+        Return child dependency list, the entities waiting for this one.
+
+        Return parent deps as children if algo is reversed.
+        """
+        if self._algo_reversed:
+            return self.parents
+        else:
+            return self.children
+
     def is_ready(self):
         '''
         Determine if the current services has to wait before to
@@ -610,7 +623,11 @@ class BaseEntity(object):
 
         # Replace all %xxx patterns
         origvalue = value
-        value = self._substitute(value)
+        phase_timers_self().start('substitutions')
+        try:
+            value = self._substitute(value)
+        finally:
+            phase_timers_self().stop('substitutions')
 
         # Debugging
         if origvalue != value:
@@ -0,0 +1,287 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the node-local batched execution of actions.
+
+Instead of one ssh round-trip per action and per node, batchable actions
+are gathered in a shell script sent once to each node. The script runs the
+slice of the actions graph of its node in dependency order and prints
+markers around each command. Markers are parsed to rebuild per-action
+results, used by the ActionManager when the engine reaches the actions.
+"""
+
+import random
+
+from ClusterShell.Event import EventHandler
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import NO_STATUS
+from MilkCheck.Engine.Backend import ResultWorker, ForwardHandler, OUTPUT_ALL
+
+def shell_quote(text):
+    '''Quote text for a POSIX shell'''
+    return "'%s'" % text.replace("'", "'\\''")
+
+class BatchWorker(ResultWorker):
+    '''
+    Results of a batched action. Results are filled from the batch output
+    before the engine reaches the action. Nodes where the action was not run
+    by the batch are dispatched the usual way once the action is attached.
+    '''
+
+    def __init__(self, action, command, output=OUTPUT_ALL):
+        ResultWorker.__init__(self, action.target, command, output=output)
+        self.action = action
+        self.skipped = NodeSet()
+        self._backend = None
+
+    def attach(self, handler, backend):
+        '''The engine reached the action, raise the events it missed'''
+        self.eh = handler
+        self._backend = backend
+        if self._started:
+            handler.ev_start(self)
+        if self.skipped:
+            self._fallback(self.skipped)
+        if self._closed:
+            handler.ev_close(self)
+
+    def skip(self, node):
+        '''Action was not run on node by the batch'''
+        self.skipped.add(node)
+        if self._backend:
+            self._fallback(NodeSet(node))
+
+    def _fallback(self, nodes):
+        '''Run the action on nodes with a dedicated command'''
+        self._backend.shell(self.command, nodes=nodes,
+                            timeout=self.action.timeout,
+                            handler=ForwardHandler(self))
+
+class BatchHandler(EventHandler):
+    '''
+    Parse the output of the batch scripts and dispatch it to the results of
+    the batched actions.
+    '''
+
+    def __init__(self, batch, actions):
+        EventHandler.__init__(self)
+        self._batch = batch
+        # Indexes of the actions run by the script, in order
+        self._actions = actions
+        # Index of the action currently running on each node
+        self._current = {}
+        self._done = {}
+
+    def ev_read(self, worker):
+        '''Dispatch a line of output'''
+        node = worker.current_node
+        msg = str(worker.current_msg)
+        if msg.startswith(self._batch.marker):
+            fields = msg[len(self._batch.marker):].split()
+            results = self._batch.results[int(fields[1])]
+            if fields[0] == 'BEGIN':
+                self._current[node] = int(fields[1])
+                results._on_start()
+            elif fields[0] == 'END':
+                self._current.pop(node, None)
+                self._done.setdefault(node, set()).add(int(fields[1]))
+                self._end(results, node, int(fields[2]))
+        elif node in self._current:
+            self._batch.results[self._current[node]]._on_node_msgline(node,
+                                                                      msg)
+
+    def _end(self, results, node, retcode):
+        '''Action is over on node'''
+        # timeout(1) returns 124 when the command timed out
+        if retcode == 124 and results.action.timeout:
+            results._on_node_timeout(node)
+        else:
+            results._on_node_rc(node, retcode)
+
+    def ev_hup(self, worker):
+        '''
+        Script is over on node. An interrupted action gets the script return
+        code, actions which were not reached are run the usual way.
+        '''
+        node = worker.current_node
+        done = self._done.get(node, set())
+        for idx in self._actions:
+            if idx in done:
+                continue
+            if idx == self._current.get(node):
+                self._end(self._batch.results[idx], node,
+                          worker.current_rc or 255)
+            else:
+                self._batch.results[idx].skip(node)
+
+    def ev_close(self, worker):
+        '''All results were dispatched'''
+        worker.flush_buffers()
+
+class BatchRun(object):
+    '''
+    Plan and run the batchable actions of a run. An action is batchable if
+    it runs on distant nodes without delay, retry, or action dependencies,
+    and if all the actions it depends on are batchable too, have exactly
+    the same target and are weak dependencies: scripts only order actions
+    within a node, they cannot know whether a dependency failed elsewhere.
+    Others are run the usual way by the engine.
+    '''
+
+    def __init__(self, source, action_name, dryrun=False):
+        self.marker = 'MILKCHECK-%016x ' % random.getrandbits(64)
+        self.dryrun = dryrun
+        # Batched actions in dependency order and their results
+        self.actions = []
+        self.results = []
+        self._index = {}
+        self._memo = {}
+        # Group terminals: {terminal: group}
+        self._terminals = {}
+        self._complete(source, action_name)
+
+    def __contains__(self, action):
+        return action in self._index
+
+    def _eligible(self, action):
+        '''Tell if action could be run by a batch script'''
+        return (action.mode != 'delegate' and action.target and
+                not action.delay and not action.maxretry and
+                not action.unless and
+                not action.parents and not action.children)
+
+    def _preds_of(self, entity, action_name):
+        '''Return actions to complete before entity: {action: strong}'''
+        preds = {}
+        for dep in entity.deps().values():
+            name = action_name
+            if dep.is_check():
+                name = 'status'
+            for action, strong in self._complete(dep.target, name).items():
+                preds[action] = preds.get(action) or \
+                                (strong and dep.is_strong())
+        return preds
+
+    def _complete(self, entity, action_name):
+        '''
+        Return the actions whose completion means entity is complete as
+        {action: strong}. None stands for an action which is not batched.
+        '''
+        key = (entity, action_name)
+        if key not in self._memo:
+            self._memo[key] = self.__complete(entity, action_name)
+        return self._memo[key]
+
+    def __complete(self, entity, action_name):
+        '''Compute _complete() of entity'''
+        # Locked or already done, nothing to wait for
+        if entity.status is not NO_STATUS:
+            return {}
+        # Entry point of a group: wait for the group dependencies
+        if entity in self._terminals and not entity.deps():
+            return self._preds_of(self._terminals[entity], action_name)
+        # Groups complete when their internal services are
+        if hasattr(entity, 'iter_subservices'):
+            if not entity.has_action(action_name) or \
+               entity.to_skip(action_name):
+                return self._preds_of(entity, action_name)
+            self._terminals[entity._source] = entity
+            self._terminals[entity._sink] = entity
+            exit_point = entity._source
+            if entity._algo_reversed:
+                exit_point = entity._sink
+            return self._preds_of(exit_point, action_name)
+        preds = self._preds_of(entity, action_name)
+        if entity.simulate:
+            return preds
+        # Missing or skipped actions do not propagate errors
+        if not entity.has_action(action_name) or entity.to_skip(action_name):
+            return dict.fromkeys(preds, False)
+        action = entity._actions[action_name]
+        if None in preds or not self._eligible(action):
+            return {None: True}
+        # Dependencies across nodes are ordered by the engine, and so are
+        # strong ones: a failure on any node keeps action from running on
+        # all of them
+        for pred, strong in preds.items():
+            # NodeSet only defines equality, not inequality
+            if strong or not pred.target == action.target:
+                return {None: True}
+        self._index[action] = len(self.actions)
+        self.actions.append(action)
+        return {action: True}
+
+    def _command(self, action):
+        '''Return the command of action'''
+        if self.dryrun:
+            return ':'
+        return action.resolve_property('command')
+
+    def script(self, indexes):
+        '''Generate the script running the actions of indexes in order'''
+        lines = ['mc_run() {',
+                 '  echo "%sBEGIN $1"' % self.marker,
+                 '  if [ -n "$2" ]; then',
+                 '    timeout "$2" sh -c "$3" </dev/null 2>&1',
+                 '  else',
+                 '    sh -c "$3" </dev/null 2>&1',
+                 '  fi',
+                 '  rc=$?',
+                 '  echo "%sEND $1 $rc"' % self.marker,
+                 '}']
+        for idx in indexes:
+            action = self.actions[idx]
+            lines.append('mc_run %d %s %s' % (idx,
+                            shell_quote(str(action.timeout or '')),
+                            shell_quote(self._command(action))))
+        return '\n'.join(lines)
+
+    def start(self, backend):
+        '''Send one script per set of nodes sharing the same actions'''
+        slices = {}
+        for idx, action in enumerate(self.actions):
+            self.results.append(BatchWorker(action, self._command(action),
+                                            backend.output))
+            for node in action.target:
+                slices.setdefault(node, []).append(idx)
+        groups = {}
+        for node, indexes in slices.items():
+            groups.setdefault(tuple(indexes), []).append(node)
+        for indexes, nodes in groups.items():
+            backend.shell('sh -c %s' % shell_quote(self.script(indexes)),
+                          nodes=NodeSet.fromlist(nodes),
+                          handler=BatchHandler(self, indexes))
+
+    def attach(self, action, handler, backend):
+        '''Complete action from the batch results'''
+        self.results[self._index[action]].attach(handler, backend)
@@ -0,0 +1,233 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the ResultCache class definition. It keeps the results
+of idempotent actions between runs, so nodes whose results did not expire
+are not run again.
+"""
+
+import os
+import time
+import json
+import fcntl
+import logging
+import tempfile
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.Backend import ForwardHandler
+
+class ResultCache(object):
+    '''
+    Results of idempotent actions by node, kept ttl seconds within the
+    file path. Results are indexed by service, action and resolved command.
+    Only return codes and output of nodes which did not time out are kept.
+    '''
+
+    def __init__(self, path, ttl):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        # {key: {node: [date, retcode, lines]}}
+        self._entries = {}
+        # Results dropped during the run: [(key prefix, nodes, date)]
+        self._dropped = []
+        self._changed = False
+        self.load()
+
+    def _lock(self, mode):
+        '''
+        Return the lock file of the cache once locked with mode. Runs sharing
+        the cache file hold it while they read or write it.
+        '''
+        lock = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock.fileno(), mode)
+        except IOError:
+            lock.close()
+            raise
+        return lock
+
+    def _read(self):
+        '''Return the results within the cache file'''
+        entries = {}
+        try:
+            cache_file = open(self.path)
+            try:
+                content = json.load(cache_file)
+            finally:
+                cache_file.close()
+        except (IOError, ValueError):
+            return entries
+        for key, nodes in content.items():
+            for node, (date, retcode, lines) in nodes.items():
+                entries.setdefault(str(key), {})[str(node)] = \
+                    [date, retcode, [line.encode('utf-8') for line in lines]]
+        return entries
+
+    def load(self):
+        '''Read unexpired results from the cache file'''
+        try:
+            lock = self._lock(fcntl.LOCK_SH)
+        except IOError:
+            return
+        try:
+            entries = self._read()
+        finally:
+            lock.close()
+        now = time.time()
+        for key, nodes in entries.items():
+            for node, entry in nodes.items():
+                if now - entry[0] < self.ttl:
+                    self._entries.setdefault(key, {})[node] = entry
+
+    def save(self):
+        '''
+        Write the results to the cache file if they changed. Results written
+        by other runs in the meantime are kept unless they are older than
+        ours or were dropped by this run.
+        '''
+        if not self._changed:
+            return
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            lock = self._lock(fcntl.LOCK_EX)
+            try:
+                entries = self._merge(self._read())
+                fd, tmp = tempfile.mkstemp(dir=directory)
+                cache_file = os.fdopen(fd, 'w')
+                try:
+                    json.dump(entries, cache_file)
+                finally:
+                    cache_file.close()
+                os.rename(tmp, self.path)
+            finally:
+                lock.close()
+            self._changed = False
+            self._dropped = []
+        except (IOError, OSError), exc:
+            logging.getLogger('milkcheck').warning(
+                'Cannot save results cache %s: %s' % (self.path, exc))
+
+    def _merge(self, entries):
+        '''
+        Merge our results into entries read from the cache file and return
+        the unexpired ones, ready to be written.
+        '''
+        for prefix, nodes, dropped in self._dropped:
+            for key, cached in entries.items():
+                if key.startswith(prefix):
+                    for node in nodes:
+                        if node in cached and cached[node][0] <= dropped:
+                            del cached[node]
+        for key, nodes in self._entries.items():
+            cached = entries.setdefault(key, {})
+            for node, entry in nodes.items():
+                if node not in cached or cached[node][0] < entry[0]:
+                    cached[node] = entry
+        now = time.time()
+        result = {}
+        for key, nodes in entries.items():
+            for node, (date, retcode, lines) in nodes.items():
+                if now - date < self.ttl:
+                    result.setdefault(key, {})[node] = \
+                        [date, retcode, [line.decode('utf-8', 'replace')
+                                         for line in lines]]
+        return result
+
+    def key(self, action, command):
+        '''Return the cache key of action run with command'''
+        return '%s:%s:%s' % (action.parent.fullname(), action.name, command)
+
+    def lookup(self, key, nodes):
+        '''
+        Return the cached results of nodes as a {node: (retcode, lines)}
+        dictionnary and the nodes which have no valid result.
+        '''
+        now = time.time()
+        found = {}
+        missing = NodeSet()
+        cached = self._entries.get(key, {})
+        for node in NodeSet(nodes):
+            if node in cached and now - cached[node][0] < self.ttl:
+                found[node] = (cached[node][1], cached[node][2])
+            else:
+                missing.add(node)
+        return found, missing
+
+    def store(self, key, node, retcode, lines):
+        '''Keep the result of node'''
+        self._entries.setdefault(key, {})[node] = [time.time(), retcode,
+                                                   list(lines)]
+        self._changed = True
+
+    def invalidate(self, service, nodes):
+        '''
+        Drop the results of the actions of service on nodes, they may have
+        changed once another action of service ran there.
+        '''
+        prefix = '%s:' % service.fullname()
+        nodes = NodeSet(nodes)
+        for key, cached in self._entries.items():
+            if key.startswith(prefix):
+                for node in nodes:
+                    cached.pop(node, None)
+        self._dropped.append((prefix, nodes, time.time()))
+        self._changed = True
+
+class CachingHandler(ForwardHandler):
+    '''
+    Forward the events of the worker running an idempotent action and store
+    the result of each node within the cache. Nodes which could not be
+    reached (255) are not stored.
+    '''
+
+    def __init__(self, worker, cache, key):
+        ForwardHandler.__init__(self, worker)
+        self._cache = cache
+        self._key = key
+        self._lines = {}
+
+    def ev_read(self, worker):
+        '''Record and forward output of the current node'''
+        self._lines.setdefault(worker.current_node, []).append(
+                                                    worker.current_msg)
+        ForwardHandler.ev_read(self, worker)
+
+    def ev_hup(self, worker):
+        '''Store and forward the result of the current node'''
+        node = worker.current_node
+        lines = self._lines.pop(node, [])
+        if worker.current_rc != 255:
+            self._cache.store(self._key, node, worker.current_rc, lines)
+        ForwardHandler.ev_hup(self, worker)
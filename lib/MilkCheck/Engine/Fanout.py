@@ -0,0 +1,102 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the AdaptiveFanout class definition, used by the
+ActionManager to adjust the fanout while actions are running.
+"""
+
+import time
+
+class AdaptiveFanout(object):
+    '''
+    Compute a fanout value following an AIMD (additive increase,
+    multiplicative decrease) scheme:
+
+     - each node which completes is a success, once a full window of
+       successes (as many as the current fanout) is reached, the fanout is
+       increased by 'step' if the completion rate did not drop compared to
+       the best rate observed so far, and decreased by 'step' otherwise
+       (more parallelism only increased latency);
+     - each node which times out or fails to connect (ssh returns 255)
+       divides the fanout by 'factor', at most once per window.
+
+    The value always stays between 'minimum' and 'maximum'.
+    '''
+
+    def __init__(self, minimum, maximum, initial=None, step=1, factor=2,
+                 tolerance=0.1):
+        assert 0 < minimum <= maximum, 'Invalid fanout bounds'
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.factor = factor
+        self.tolerance = tolerance
+        self.value = self._bound(initial or maximum)
+        # Statistics of the current window
+        self._window_start = time.time()
+        self._successes = 0
+        self._decreased = False
+        # Best completion rate (nodes per second) seen so far
+        self.best_rate = 0.0
+
+    def _bound(self, value):
+        '''Keep value within bounds'''
+        return max(self.minimum, min(self.maximum, int(value)))
+
+    def _new_window(self):
+        '''Start a new observation window'''
+        self._window_start = time.time()
+        self._successes = 0
+        self._decreased = False
+
+    def success(self):
+        '''A node completed its command'''
+        self._successes += 1
+        if self._successes < self.value:
+            return
+        elapsed = max(time.time() - self._window_start, 1e-6)
+        rate = self._successes / elapsed
+        if rate >= self.best_rate * (1 - self.tolerance):
+            self.best_rate = max(self.best_rate, rate)
+            self.value = self._bound(self.value + self.step)
+        else:
+            self.value = self._bound(self.value - self.step)
+        self._new_window()
+
+    def failure(self):
+        '''A node timed out or could not be reached'''
+        if not self._decreased:
+            self.value = self._bound(self.value / self.factor)
+            # Rates measured with a larger fanout are no longer relevant
+            self.best_rate = 0.0
+            self._new_window()
+            self._decreased = True
@@ -0,0 +1,184 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the RunJournal class definition. The journal keeps
+track of the actions completed during a run, so an interrupted run may be
+resumed without running again what already succeeded.
+
+It also writes and reads result files: the status of each action of a run
+and of each of its nodes, from which only what failed may be run again.
+"""
+
+import json
+
+from ClusterShell.NodeSet import NodeSet
+from ClusterShell.Worker.Popen import WorkerPopen
+
+from MilkCheck.Engine.BaseEntity import MilkCheckEngineError
+from MilkCheck.Engine.BaseEntity import NO_STATUS, DONE, ERROR, TIMEOUT, \
+                                        DEP_ERROR, LOCKED
+
+class JournalError(MilkCheckEngineError):
+    '''
+    Error raised when the journal of a run cannot be written or the journal
+    of the run to resume cannot be read.
+    '''
+
+class RunJournal(object):
+    '''
+    Append one line per completed action to the journal file: action
+    fullname, final status and nodes by return code. Lines are flushed as
+    soon as they are written so they survive an interrupted run.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._file = open(path, 'a')
+        except IOError, exc:
+            raise JournalError("Cannot open journal '%s': %s" % (path, exc))
+
+    def record(self, action):
+        '''Append the results of action'''
+        entry = {'action': action.fullname(), 'status': action.status}
+        worker = action.worker
+        if worker is not None and not isinstance(worker, WorkerPopen):
+            entry['retcodes'] = dict([(str(retcode), str(nodes))
+                                for retcode, nodes in worker.iter_retcodes()])
+            timeouts = NodeSet.fromlist(worker.iter_keys_timeout())
+            if timeouts:
+                entry['timeout'] = str(timeouts)
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def close(self):
+        '''Close the journal file'''
+        self._file.close()
+
+def read_journal(path):
+    '''
+    Return the results of the actions recorded in the journal path as a
+    {fullname: (status, {node: retcode})} dictionnary. The last record of an
+    action wins, an incomplete last line is ignored.
+    '''
+    try:
+        journal = open(path)
+    except IOError, exc:
+        raise JournalError("Cannot read journal '%s': %s" % (path, exc))
+    results = {}
+    try:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            retcodes = {}
+            for retcode, nodes in entry.get('retcodes', {}).items():
+                for node in NodeSet(str(nodes)):
+                    retcodes[node] = int(retcode)
+            results[str(entry['action'])] = (str(entry['status']), retcodes)
+    finally:
+        journal.close()
+    return results
+
+def _action_results(action, status):
+    '''Return the nodes of action by status'''
+    worker = action.worker
+    if status == DEP_ERROR:
+        if action.target:
+            return {DEP_ERROR: str(action.target)}
+    elif worker is not None and not isinstance(worker, WorkerPopen):
+        nodes = {DONE: NodeSet(), ERROR: NodeSet()}
+        for retcode, retnodes in worker.iter_retcodes():
+            nodes[retcode == 0 and DONE or ERROR].update(retnodes)
+        nodes[TIMEOUT] = NodeSet.fromlist(worker.iter_keys_timeout())
+        return dict([(status, str(nds)) for status, nds in nodes.items()
+                     if nds])
+    return {}
+
+def write_results(path, services, action_name):
+    '''
+    Write in path the status of the action action_name of services and
+    their subservices, with its nodes by status. Actions which could not run
+    because of a dependency get the status of their service.
+    '''
+    results = {}
+    services = list(services)
+    while services:
+        service = services.pop()
+        if service.status in (NO_STATUS, LOCKED):
+            continue
+        action = service._actions.get(action_name)
+        if action is not None:
+            status = action.status
+            if status == NO_STATUS:
+                status = service.status
+            results[action.fullname()] = {'status': status,
+                               'nodes': _action_results(action, status)}
+        if hasattr(service, 'iter_subservices'):
+            services.extend(service.iter_subservices())
+    try:
+        output = open(path, 'w')
+        try:
+            json.dump(results, output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+    except IOError, exc:
+        raise JournalError("Cannot write results '%s': %s" % (path, exc))
+
+def read_failures(path):
+    '''
+    Return the services of the result file path with a failing action as a
+    {fullname: nodes} dictionnary. Nodes are the failing ones, or None when
+    the failure is not bound to nodes (local actions).
+    '''
+    try:
+        input_file = open(path)
+        try:
+            results = json.load(input_file)
+        finally:
+            input_file.close()
+    except (IOError, ValueError), exc:
+        raise JournalError("Cannot read results '%s': %s" % (path, exc))
+    failures = {}
+    for fullname, result in results.items():
+        if result['status'] not in (ERROR, TIMEOUT, DEP_ERROR):
+            continue
+        service = str(fullname).rsplit('.', 1)[0]
+        nodes = NodeSet.fromlist([str(nds) for status, nds
+                                  in result.get('nodes', {}).items()
+                                  if status != DONE])
+        if not nodes or (service in failures and failures[service] is None):
+            failures[service] = None
+        else:
+            failures.setdefault(service, NodeSet()).update(nodes)
+    return failures
@@ -0,0 +1,182 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the OutputStore class definition, which keeps the
+output of the actions within memory budgets and spools the rest to disk.
+"""
+
+import os
+import shutil
+import tempfile
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.Backend import ResultWorker
+
+class StoredWorker(ResultWorker):
+    '''
+    Results of a distant action kept by the OutputStore. Identical buffers
+    are stored once, either in memory or in a spool file from which they
+    are read back when needed.
+    '''
+
+    def __init__(self, worker, buffers, spool=None):
+        ResultWorker.__init__(self, NodeSet(), getattr(worker, 'command', None))
+        self.spool = spool
+        # Buffer key of each node and buffers (or their spool location)
+        self._index = {}
+        self._data = {}
+        self._retcodes = dict(worker.iter_node_retcodes())
+        self._timeouts = set(worker.iter_keys_timeout())
+        self.nodes = NodeSet.fromlist(list(self._retcodes) +
+                                      list(self._timeouts))
+        self._started = self._closed = True
+        if spool:
+            spool_file = open(spool, 'wb')
+        offset = 0
+        for key, (buf, nodes) in enumerate(buffers):
+            if spool:
+                spool_file.write(buf)
+                self._data[key] = (offset, len(buf))
+                offset += len(buf)
+            else:
+                self._data[key] = buf
+            for node in nodes:
+                self._index[node] = key
+        if spool:
+            spool_file.close()
+
+    def _read(self, key):
+        '''Return the buffer stored under key'''
+        if self.spool:
+            offset, length = self._data[key]
+            spool_file = open(self.spool, 'rb')
+            try:
+                spool_file.seek(offset)
+                return spool_file.read(length)
+            finally:
+                spool_file.close()
+        return self._data[key]
+
+    def node_buffer(self, node):
+        '''Return the output of node'''
+        if node not in self._index:
+            return ''
+        return self._read(self._index[node])
+
+    def iter_node_buffers(self, match_keys=None):
+        '''Iterate over (node, buffer) couples'''
+        for node in sorted(self._index):
+            if match_keys is None or node in match_keys:
+                yield node, self._read(self._index[node])
+
+    def iter_buffers(self, match_keys=None):
+        '''Iterate over buffers and the nodeset which produced them'''
+        gathered = {}
+        for node, key in self._index.items():
+            if match_keys is None or node in match_keys:
+                gathered.setdefault(key, []).append(node)
+        for key in sorted(gathered):
+            yield self._read(key), NodeSet.fromlist(gathered[key])
+
+    def flush_buffers(self):
+        '''Forget output of all the nodes'''
+        self._index.clear()
+        self._data.clear()
+
+class OutputStore(object):
+    '''
+    Keep the output of finished actions. Output is truncated to max_lines
+    lines and max_bytes bytes per node, then kept in memory as long as it
+    fits within the budget of the action (action_budget bytes) and the
+    budget of the whole run (budget bytes). Beyond, it is written to a spool
+    file per action, within a spool directory removed by close(). A value of
+    0 means no limit. Only output retained once an action is over is
+    bounded, output of running commands is held by the backend.
+    '''
+
+    def __init__(self, budget=0, action_budget=0, max_lines=0, max_bytes=0):
+        self.budget = budget
+        self.action_budget = action_budget
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        # Bytes of output kept in memory
+        self.used = 0
+        # Bytes of output written to the spool
+        self.spooled = 0
+        self.spool_dir = None
+
+    def truncate(self, buf):
+        '''Truncate buf to the lines and bytes limits'''
+        if self.max_lines:
+            lines = buf.splitlines()
+            if len(lines) > self.max_lines:
+                buf = '\n'.join(lines[:self.max_lines] +
+                    ['[%d more lines]' % (len(lines) - self.max_lines)])
+        if self.max_bytes and len(buf) > self.max_bytes:
+            buf = '%s\n[%d more bytes]' % (buf[:self.max_bytes],
+                                           len(buf) - self.max_bytes)
+        return buf
+
+    def _spool_path(self, name):
+        '''Return a new spool file path for the action name'''
+        if not self.spool_dir:
+            self.spool_dir = tempfile.mkdtemp(prefix='milkcheck-output-')
+        fd, path = tempfile.mkstemp(prefix=name.replace('/', '_') + '-',
+                                    dir=self.spool_dir)
+        os.close(fd)
+        return path
+
+    def keep(self, worker, name):
+        '''
+        Return the results of worker, the distant worker of action name, as
+        a StoredWorker. Buffers held by worker are released.
+        '''
+        buffers = [(self.truncate(str(buf)), nodes)
+                   for buf, nodes in worker.iter_buffers()]
+        size = sum([len(buf) for buf, nodes in buffers])
+        spool = None
+        if (self.action_budget and size > self.action_budget) or \
+           (self.budget and self.used + size > self.budget):
+            spool = self._spool_path(name)
+            self.spooled += size
+        else:
+            self.used += size
+        stored = StoredWorker(worker, buffers, spool)
+        worker.flush_buffers()
+        return stored
+
+    def close(self):
+        '''Remove the spool files'''
+        if self.spool_dir:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+            self.spool_dir = None
@@ -44,7 +44,7 @@ from MilkCheck.Engine.BaseEntity import MilkCheckEngineError
 
 # Symbols
 from MilkCheck.Engine.BaseEntity import NO_STATUS, MISSING, DEP_ERROR
-from MilkCheck.Engine.BaseEntity import WAITING_STATUS
+from MilkCheck.Engine.BaseEntity import WAITING_STATUS, ERROR, TIMEOUT
 from MilkCheck.Callback import EV_STATUS_CHANGED, EV_TRIGGER_DEP
 
 class ActionNotFoundError(MilkCheckEngineError):
@@ -150,6 +150,11 @@ class Service(BaseEntity):
         if not self.simulate:
             call_back_self().notify(self, EV_STATUS_CHANGED)
 
+        # Cancel work which does not matter anymore before triggering
+        # the next services
+        if self.status in (ERROR, TIMEOUT, DEP_ERROR):
+            action_manager_self().entity_failed(self)
+
         # I got a status so I'm DONE or DEP_ERROR and I'm not the calling point
         if self.status not in (NO_STATUS, WAITING_STATUS) and not self.origin:
 
@@ -249,6 +254,8 @@ class Service(BaseEntity):
             for action in actions.values():
                 for dep in dependencies[action.name]:
                     action.add_dep(actions[dep])
+                if action.unless and action.unless not in actions:
+                    raise ActionNotFoundError(self.name, action.unless)
                 self.add_action(action)
 
         # Inherits properies between service and actions
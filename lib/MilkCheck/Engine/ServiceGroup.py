@@ -64,6 +64,8 @@ class ServiceGroup(Service):
         self._sink.simulate = True
         # subservices
         self._subservices = {}
+        # Cancel the subservices as soon as the group is known to fail
+        self.fail_fast = False
 
     def update_target(self, nodeset, mode=None):
         '''Update the attribute target of a ServiceGroup'''
@@ -291,6 +293,9 @@ class ServiceGroup(Service):
         """Populate group attributes from dict."""
         BaseEntity.fromdict(self, grpdict)
 
+        if 'fail_fast' in grpdict:
+            self.fail_fast = grpdict['fail_fast']
+
         if 'services' in grpdict:
             dep_mapping = {}
 
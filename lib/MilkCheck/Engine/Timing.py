@@ -0,0 +1,334 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the RunStatistics and NodeTimings class definitions.
+They gather the timings of the actions of a run and of their nodes, one
+action at a time as they complete. CriticalPath records which completion
+released each action to find the chain of actions the run waited for.
+PhaseTimers measures the time spent in each stage of the command line.
+"""
+
+import heapq
+import threading
+import time
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Callback import CoreEvent
+
+class RunStatistics(object):
+    '''
+    Timings of the completed actions of a run: wall time, slowest actions,
+    durations by action name, time spent waiting for delays, retries and
+    number of commands run (one per node and per try).
+    '''
+
+    def __init__(self, slowest=5):
+        self.slowest_count = slowest
+        self.start = None
+        self.stop = None
+        self.actions = 0
+        self.commands = 0
+        self.retries = 0
+        self.delayed = 0.0
+        # Durations by action name
+        self.durations = {}
+        # Heap of the slowest (duration, fullname)
+        self._slowest = []
+
+    def add(self, action):
+        '''Account for the completed action'''
+        duration = action.duration
+        if duration is None:
+            return
+        if self.start is None or action.start_time < self.start:
+            self.start = action.start_time
+        if self.stop is None or action.stop_time > self.stop:
+            self.stop = action.stop_time
+        self.actions += 1
+        self.durations.setdefault(action.name, []).append(duration)
+        entry = (duration, action.fullname())
+        if len(self._slowest) < self.slowest_count:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+        self.commands += action.tries * max(len(action.target or []), 1)
+        self.retries += max(action.tries - 1, 0)
+        if action.delay > 0:
+            self.delayed += action.delay * action.tries
+
+    @property
+    def wall_time(self):
+        '''Time between the first start and the last stop of actions'''
+        if self.start is None:
+            return 0.0
+        return self.stop - self.start
+
+    @property
+    def rate(self):
+        '''Commands run per second'''
+        if self.wall_time <= 0:
+            return 0.0
+        return self.commands / float(self.wall_time)
+
+    def slowest(self):
+        '''Return the slowest actions as (duration, fullname), slowest first'''
+        return sorted(self._slowest, reverse=True)
+
+    def percentiles(self, name, percents=(50, 90, 99)):
+        '''Return the duration percentiles of the actions called name'''
+        durations = sorted(self.durations[name])
+        count = len(durations)
+        return [durations[max(0, (count * pct + 99) // 100 - 1)]
+                for pct in percents]
+
+class NodeTimings(object):
+    '''
+    Completion time of each node, since the command of the action started,
+    aggregated over the actions of a run. A node is an outlier of an action
+    when it took more than factor times the median completion time of the
+    nodes of this action, and more than min_latency seconds.
+    '''
+
+    def __init__(self, factor=2.0, min_latency=0.1):
+        self.factor = factor
+        self.min_latency = min_latency
+        # Actions run, total completion time and outliers count by node
+        self.count = {}
+        self.total = {}
+        self.outliers = {}
+
+    def add(self, latencies):
+        '''Account for the {node: completion time} of one action'''
+        if not latencies:
+            return
+        values = sorted(latencies.values())
+        limit = max(values[len(values) // 2] * self.factor, self.min_latency)
+        for node, latency in latencies.iteritems():
+            self.count[node] = self.count.get(node, 0) + 1
+            self.total[node] = self.total.get(node, 0.0) + latency
+            if latency > limit:
+                self.outliers[node] = self.outliers.get(node, 0) + 1
+
+    def slowest(self, count=5):
+        '''
+        Return the count nodes with the highest mean completion time, as
+        (mean, nodes) with nodes of the same rounded mean folded together,
+        slowest first.
+        '''
+        means = sorted([(self.total[node] / self.count[node], node)
+                        for node in self.count], reverse=True)[:count]
+        groups = []
+        for mean, node in means:
+            if groups and '%.2f' % groups[-1][0] == '%.2f' % mean:
+                groups[-1][1].add(node)
+            else:
+                groups.append((mean, NodeSet(node)))
+        return groups
+
+    def consistent_outliers(self, ratio=0.5):
+        '''
+        Return the nodes which were outliers of at least two actions and of
+        at least ratio of the actions they ran.
+        '''
+        return NodeSet.fromlist([node for node, outliers
+                                 in self.outliers.iteritems()
+                                 if outliers >= 2 and
+                                    outliers >= ratio * self.count[node]])
+
+class CriticalPath(CoreEvent):
+    '''
+    Interface of the CallbackHandler recording, for each entity, the
+    completion which released it (EV_TRIGGER_DEP), and for each action when
+    its command was dispatched (EV_STARTED) and the last action completed
+    within each service (EV_COMPLETE).
+    '''
+
+    def __init__(self):
+        CoreEvent.__init__(self)
+        # Entity whose completion released each entity
+        self.released_by = {}
+        # First dispatch time of each action
+        self.dispatched = {}
+        # Last completed action within each service, and the last one of all
+        self.last_action = {}
+        self.last = None
+
+    def ev_trigger_dep(self, obj_source, obj_triggered):
+        '''Completion of obj_source released obj_triggered'''
+        self.released_by[obj_triggered] = obj_source
+
+    def ev_started(self, obj):
+        '''Command of an action was dispatched'''
+        # Actions are the entities with a worker
+        if obj not in self.dispatched and hasattr(obj, 'worker'):
+            self.dispatched[obj] = time.time()
+
+    def ev_complete(self, obj):
+        '''An action completed'''
+        if not hasattr(obj, 'worker') or obj.duration is None:
+            return
+        if self.last is None or obj.stop_time >= self.last.stop_time:
+            self.last = obj
+        service = obj.parent
+        while service is not None:
+            last = self.last_action.get(service)
+            if last is None or obj.stop_time >= last.stop_time:
+                self.last_action[service] = obj
+            service = service.parent
+
+    def ev_status_changed(self, obj):
+        '''Status changes are not needed'''
+        pass
+
+    def ev_delayed(self, obj):
+        '''Delays are accounted from the start time of actions'''
+        pass
+
+    def ev_finished(self, obj):
+        '''Nothing to do once all tasks are done'''
+        pass
+
+    def _releaser(self, entity):
+        '''Return the action whose completion released entity'''
+        seen = set()
+        while entity is not None and entity not in seen:
+            seen.add(entity)
+            source = self.released_by.get(entity)
+            if source is None:
+                entity = entity.parent
+            elif hasattr(source, 'worker'):
+                return source
+            elif source in self.last_action:
+                return self.last_action[source]
+            else:
+                entity = source
+        return None
+
+    def segments(self):
+        '''
+        Return the critical path, from the first action to the last action
+        completed, as (action, waited, ran) segments: time from ready to
+        dispatch (delays and queueing) and from dispatch to completion.
+        '''
+        path = []
+        seen = set()
+        action = self.last
+        while action is not None and action not in seen:
+            seen.add(action)
+            dispatched = self.dispatched.get(action, action.start_time)
+            path.append((action, max(dispatched - action.start_time, 0.0),
+                         max(action.stop_time - dispatched, 0.0)))
+            action = self._releaser(action)
+        path.reverse()
+        return path
+
+class PhaseTimers(object):
+    '''
+    Time spent in each phase of a run (configuration loading, variable
+    substitutions, engine, console output...). Phases may be nested: the
+    time of a phase excludes the phases started within it, so that the
+    times of all phases add up to the whole run. Each thread has its own
+    stack of phases. Nothing is recorded until the timers are enabled.
+    '''
+
+    _instance = None
+
+    def __init__(self):
+        self.enabled = False
+        self.times = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self, enabled=True):
+        '''Forget recorded times and enable or disable the timers'''
+        self.enabled = enabled
+        self.times = {}
+        self.calls = {}
+        self._local = threading.local()
+
+    def _stack(self):
+        '''Return the phases running in the current thread'''
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _charge(self, frame, now):
+        '''Add the time elapsed since the phase of frame was resumed'''
+        self._lock.acquire()
+        try:
+            self.times[frame[0]] = self.times.get(frame[0], 0.0) + \
+                                   now - frame[1]
+        finally:
+            self._lock.release()
+        frame[1] = now
+
+    def start(self, name):
+        '''Enter the phase name, pausing the current one'''
+        if not self.enabled:
+            return
+        now = time.time()
+        stack = self._stack()
+        if stack:
+            self._charge(stack[-1], now)
+        stack.append([name, now])
+
+    def stop(self, name):
+        '''Leave the phase name and resume the enclosing one'''
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if not stack or stack[-1][0] != name:
+            return
+        now = time.time()
+        self._charge(stack.pop(), now)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if stack:
+            stack[-1][1] = now
+
+    @property
+    def total(self):
+        '''Time spent in all phases'''
+        return sum(self.times.values())
+
+    def breakdown(self):
+        '''Return (name, time, calls) of each phase, longest first'''
+        return sorted([(name, duration, self.calls.get(name, 0))
+                       for name, duration in self.times.items()],
+                      key=lambda phase: phase[1], reverse=True)
+
+def phase_timers_self():
+    '''Return a singleton instance of the PhaseTimers class'''
+    if not PhaseTimers._instance:
+        PhaseTimers._instance = PhaseTimers()
+    return PhaseTimers._instance
@@ -0,0 +1,170 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""
+This module contains the TraceRecorder class definition. It records the
+timeline of a run and writes it in the Chrome Trace Event format, to be
+displayed by chrome://tracing or Perfetto.
+"""
+
+import json
+import logging
+import time
+
+from MilkCheck.Callback import CoreEvent
+
+# Process of the trace showing actions and nodes
+PID_ACTIONS = 1
+PID_NODES = 2
+
+class TraceRecorder(CoreEvent):
+    '''
+    Interface of the CallbackHandler recording a span per action split in
+    its delays and tries, spans of the phases of the run, counters of the
+    running tasks and of the fanout, and optionally a span per node of each
+    action. Each service and each node is shown on a track of its own.
+    '''
+
+    def __init__(self, path, nodes=False):
+        CoreEvent.__init__(self)
+        self.path = path
+        # Record a span per node
+        self.nodes = nodes
+        self.events = [{'ph': 'M', 'name': 'process_name', 'pid': pid,
+                        'args': {'name': name}}
+                       for pid, name in ((PID_ACTIONS, 'actions'),
+                                         (PID_NODES, 'nodes'))]
+        self._start = time.time()
+        self._tracks = {}
+        # Start of the delays and tries of each running action
+        self._phases = {}
+
+    def _ts(self, timestamp):
+        '''Return the trace timestamp, in microseconds, of timestamp'''
+        return int((timestamp - self._start) * 1000000)
+
+    def _track(self, pid, name):
+        '''Return the track id of name, declared on first use'''
+        if (pid, name) not in self._tracks:
+            tid = len(self._tracks) + 1
+            self._tracks[(pid, name)] = tid
+            self.events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid,
+                                'tid': tid, 'args': {'name': name}})
+        return self._tracks[(pid, name)]
+
+    def span(self, name, cat, start, stop, pid=PID_ACTIONS, track='run',
+             args=None):
+        '''Record a span from start to stop'''
+        event = {'ph': 'X', 'name': name, 'cat': cat, 'ts': self._ts(start),
+                 'dur': max(self._ts(stop) - self._ts(start), 0),
+                 'pid': pid, 'tid': self._track(pid, track)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def begin(self, name):
+        '''Start the phase name of the run'''
+        self.events.append({'ph': 'B', 'name': name, 'cat': 'phase',
+                            'ts': self._ts(time.time()), 'pid': PID_ACTIONS,
+                            'tid': self._track(PID_ACTIONS, 'run')})
+
+    def end(self, name):
+        '''End the phase name of the run'''
+        self.events.append({'ph': 'E', 'name': name, 'cat': 'phase',
+                            'ts': self._ts(time.time()), 'pid': PID_ACTIONS,
+                            'tid': self._track(PID_ACTIONS, 'run')})
+
+    def counter(self, name, **values):
+        '''Record the current values of the counter name'''
+        self.events.append({'ph': 'C', 'name': name, 'pid': PID_ACTIONS,
+                            'ts': self._ts(time.time()), 'args': values})
+
+    def node_spans(self, action, started, latencies):
+        '''Record the span of each node of action'''
+        for node, latency in latencies.iteritems():
+            self.span(action.fullname(), 'node', started, started + latency,
+                      PID_NODES, node)
+
+    def ev_started(self, obj):
+        '''A try of an action was dispatched'''
+        if hasattr(obj, 'worker'):
+            self._phases.setdefault(obj, []).append(('try', time.time()))
+
+    def ev_delayed(self, obj):
+        '''An action waits for its delay before being dispatched'''
+        self._phases.setdefault(obj, []).append(('delay', time.time()))
+
+    def ev_complete(self, obj):
+        '''An action completed, record its spans'''
+        if not hasattr(obj, 'worker') or obj.duration is None:
+            return
+        track = obj.parent.fullname()
+        self.span(obj.fullname(), 'action', obj.start_time, obj.stop_time,
+                  track=track, args={'status': obj.status,
+                                     'target': str(obj.target or ''),
+                                     'tries': obj.tries})
+        phases = self._phases.pop(obj, [])
+        # A single try is the action span itself
+        if len(phases) < 2:
+            return
+        ends = [start for _, start in phases[1:]] + [obj.stop_time]
+        tries = 0
+        for (kind, start), stop in zip(phases, ends):
+            if kind == 'try':
+                tries += 1
+                self.span('try %d' % tries, 'retry', start, stop, track=track)
+            else:
+                self.span('delay', 'delay', start, stop, track=track)
+
+    def ev_status_changed(self, obj):
+        '''Status changes are not traced'''
+        pass
+
+    def ev_trigger_dep(self, obj_source, obj_triggered):
+        '''Triggers are not traced'''
+        pass
+
+    def ev_finished(self, obj):
+        '''Nothing to do once all tasks are done'''
+        pass
+
+    def close(self):
+        '''Write the trace file'''
+        try:
+            trace = open(self.path, 'w')
+            try:
+                json.dump({'traceEvents': self.events,
+                           'displayTimeUnit': 'ms'}, trace)
+            finally:
+                trace.close()
+        except IOError, exc:
+            logging.getLogger('milkcheck').warning(
+                "Cannot write trace '%s': %s" % (self.path, exc))
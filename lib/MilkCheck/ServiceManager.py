@@ -33,17 +33,23 @@
 This module contains the ServiceManager class definition.
 '''
 
+import logging
+
+from ClusterShell.NodeSet import NodeSet
+
 # Classes
 from MilkCheck.EntityManager import EntityManager
 from MilkCheck.Engine.Service import Service
-from MilkCheck.Engine.Action import Action
+from MilkCheck.Engine.Action import Action, action_manager_self
+from MilkCheck.Engine.Timing import phase_timers_self
+from MilkCheck.Engine.Journal import read_failures
 
 # Exceptions
 from MilkCheck.Engine.BaseEntity import MilkCheckEngineError
 from MilkCheck.Engine.BaseEntity import VariableAlreadyExistError
 
 # Symbols
-from MilkCheck.Engine.BaseEntity import LOCKED, WARNING
+from MilkCheck.Engine.BaseEntity import BaseEntity, LOCKED, WARNING
 
 class ServiceNotFoundError(MilkCheckEngineError):
     '''
@@ -75,6 +81,8 @@ class ServiceManager(EntityManager):
         # Top service
         self.source = Service('root')
         self.source.simulate = True
+        # Nodes found unreachable by the pre-flight probe
+        self.unreachable = NodeSet()
 
     def __refresh_graph(self, reverse):
         '''Reinitialize the right values for the graph of services'''
@@ -192,6 +200,93 @@ class ServiceManager(EntityManager):
         elif conf.get('excluded_nodes') is not None:
             self.__update_usable_nodes(conf['excluded_nodes'], 'DIF')
 
+        # Run again what failed in a previous run
+        if conf.get('rerun_failed'):
+            self._restrict_to_failures(read_failures(conf['rerun_failed']))
+
+        # Avoid nodes which cannot be reached
+        self.unreachable = NodeSet()
+        if conf.get('preflight'):
+            self._preflight(conf.get('preflight_timeout', 5))
+
+    def _all_targets(self):
+        '''
+        Return the nodes targeted through ssh by the services which are not
+        locked. Targets of delegated actions are not reached through ssh.
+        '''
+        nodes = NodeSet()
+        services = [svc for svc in self.entities.values()
+                    if svc.status is not LOCKED]
+        while services:
+            service = services.pop()
+            for action in service.iter_actions():
+                if action.mode == 'delegate':
+                    continue
+                if action.target is not None:
+                    nodes.update(action.target)
+                elif service.target:
+                    nodes.update(service.target)
+            if hasattr(service, 'iter_subservices'):
+                services.extend(service.iter_subservices())
+        return nodes
+
+    def _exclude_unreachable(self, nodes):
+        '''
+        Remove nodes from the targets of the services, except from those of
+        delegated actions which are not run on the nodes themselves.
+        '''
+        services = list(self.entities.values())
+        while services:
+            service = services.pop()
+            actions = list(service.iter_actions())
+            delegated = [action for action in actions
+                         if action.mode == 'delegate']
+            if not delegated:
+                BaseEntity.update_target(service, nodes, 'DIF')
+            for action in actions:
+                if action.mode == 'delegate':
+                    continue
+                # The service target is kept for delegated actions, the
+                # inherited one is restricted on the action itself
+                if action.target is None and delegated and service.target:
+                    action.target = service.target
+                action.update_target(nodes, 'DIF')
+            if hasattr(service, 'iter_subservices'):
+                services.extend(service.iter_subservices())
+
+    def _restrict_to_failures(self, failures):
+        '''
+        Lock the services which did not fail and restrict the others to
+        their failing nodes. Failures are given by service fullname, nodes of
+        subservices apply to their top-level group.
+        '''
+        failing = {}
+        for fullname, nodes in failures.items():
+            name = fullname.split('.')[0]
+            if nodes is None or (name in failing and failing[name] is None):
+                failing[name] = None
+            else:
+                failing.setdefault(name, NodeSet()).update(nodes)
+        for name, service in self.entities.items():
+            if name not in failing:
+                service.status = LOCKED
+            elif failing[name] is not None:
+                service.update_target(failing[name], 'INT')
+
+    def _preflight(self, timeout):
+        '''
+        Probe all the targeted nodes once and remove those which cannot be
+        reached from the services, like excluded nodes.
+        '''
+        nodes = self._all_targets()
+        if not nodes:
+            return
+        self.unreachable = action_manager_self().backend.probe(nodes, timeout)
+        if self.unreachable:
+            logging.getLogger('milkcheck').warning(
+                "Unreachable nodes excluded: %s" % self.unreachable)
+            self._exclude_unreachable(self.unreachable)
+
     def __lock_services(self, services):
         '''
         Lock all services specified in the list. This will assign the LOCKED
@@ -233,10 +328,19 @@ class ServiceManager(EntityManager):
         self._variable_config(conf)
 
         # Make sure that the graph is usable
-        self.__refresh_graph(reverse)
+        timers = phase_timers_self()
+        timers.start('graph refresh')
+        try:
+            self.__refresh_graph(reverse)
+        finally:
+            timers.stop('graph refresh')
         # Apply configuration over the graph
         if conf:
-            self._apply_config(conf)
+            timers.start('apply config')
+            try:
+                self._apply_config(conf)
+            finally:
+                timers.stop('apply config')
 
         self.source.reset()
         # Enable reverse mode if needed
@@ -267,7 +371,19 @@ class ServiceManager(EntityManager):
         if conf and conf.get('nodeps'):
             self._lock_services_except(self.source.deps().keys())
 
-        self.source.run(action)
+        if conf and conf.get('batch'):
+            action_manager_self().start_batch(self.source, action)
+        tracer = action_manager_self().tracer
+        if tracer:
+            tracer.begin('run')
+        timers.start('engine')
+        try:
+            self.source.run(action)
+        finally:
+            timers.stop('engine')
+            action_manager_self().stop_batch()
+            if tracer:
+                tracer.end('run')
 
     def output_graph(self, services=None, excluded=None):
         """Return entities graph (DOT format)"""
@@ -286,9 +402,17 @@ class ServiceManager(EntityManager):
         Load the configuration within the manager thanks to MilkCheckConfig
         '''
         from MilkCheck.Config.Configuration import MilkCheckConfig
+        tracer = action_manager_self().tracer
         config = MilkCheckConfig()
+        if tracer:
+            tracer.begin('config load')
         config.load_from_dir(directory=conf)
+        if tracer:
+            tracer.end('config load')
+            tracer.begin('graph build')
         config.build_graph()
+        if tracer:
+            tracer.end('graph build')
 
 def service_manager_self():
     '''Return a singleton instance of a service manager'''
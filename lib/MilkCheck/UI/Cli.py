@@ -38,13 +38,27 @@ specificities.
 '''
 
 # classes
-import fcntl, termios, struct, os, sys, traceback, threading, select
+import fcntl, termios, struct, os, sys, traceback, threading, select, time
+import cProfile
+from collections import namedtuple
 from signal import SIGINT
+from ClusterShell.Event import EventHandler
 from ClusterShell.NodeSet import NodeSet
-from MilkCheck.Callback import CoreEvent, call_back_self
+from ClusterShell.Worker.Popen import WorkerPopen
+from MilkCheck.Callback import CoreEvent, EventQueue, call_back_self
+from MilkCheck.Callback import EV_STARTED, EV_COMPLETE, EV_STATUS_CHANGED, \
+                               EV_DELAYED, EV_TRIGGER_DEP, QUEUE_BLOCK, \
+                               QUEUE_DROP
 from MilkCheck.UI.OptionParser import McOptionParser
+from MilkCheck.UI.Events import JsonLinesWriter
 from MilkCheck.Engine.Action import Action, action_manager_self
+from MilkCheck.Engine.Backend import make_backend, BackendError, \
+                                     NodeLimitedBackend, local_output, \
+                                     OUTPUT_ALL, OUTPUT_ERRORS, OUTPUT_NONE
+from MilkCheck.Engine.Journal import JournalError, write_results
 from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Timing import RunStatistics, CriticalPath, \
+                                    phase_timers_self
 from MilkCheck.ServiceManager import service_manager_self
 from MilkCheck.Config.ConfigParser import ConfigParser, ConfigParserError
 from MilkCheck.Config.Configuration import ConfigurationError
@@ -76,6 +90,14 @@ RC_UNKNOWN_EXCEPTION = 12
 
 MAXTERMWIDTH = 120
 
+# Values of the actions and services displayed by the console. They are taken
+# when events are raised, so events can be displayed from another thread.
+# Results are only gathered when they are displayed, None otherwise.
+ActionRecord = namedtuple('ActionRecord', ['name', 'service', 'status',
+                          'duration', 'delay', 'target', 'command', 'buffers',
+                          'retcodes', 'timeouts', 'broken_nodes'])
+ServiceRecord = namedtuple('ServiceRecord', ['longname', 'status', 'simulate'])
+
 class Terminal(object):
     '''Allow the displayer to get informations from the terminal'''
 
@@ -125,6 +147,18 @@ class Terminal(object):
         '''
         return cls.isafgtty(sys.stdin) and cls.isafgtty(sys.stdout)
 
+class RefreshHandler(EventHandler):
+    '''Draw the running tasks line once the refresh delay is over'''
+
+    def __init__(self, console):
+        EventHandler.__init__(self)
+        self._console = console
+
+    def ev_timer(self, timer):
+        '''Refresh delay is over'''
+        self._console.refresh_timer = None
+        self._console.draw_running_tasks()
+
 class ConsoleDisplay(object):
     '''
     ConsoleDisplay provides methods allowing the CLI to print
@@ -150,6 +184,14 @@ class ConsoleDisplay(object):
         self.cleanup = True
         # Compute the number of escape characters
         self.escape = 0
+        # Maximum refreshes of the running tasks line per second. When
+        # set, stdout is flushed along with this line instead of each line.
+        self.refresh_rate = 0
+        self.refresh_timer = None
+        # Delayed updates are drawn by a timer, only usable from the thread
+        # running the engine
+        self.use_timer = True
+        self._last_refresh = 0
 
     def string_color(self, strg, color):
         '''Return a string formatted with a special color'''
@@ -160,10 +202,37 @@ class ConsoleDisplay(object):
             return '%s' % strg
 
     def print_running_tasks(self):
+        '''
+        Print the current running tasks, at most refresh_rate times per
+        second. Updates coming sooner are drawn by a timer once the delay is
+        over.
+        '''
+        if self.refresh_rate > 0 and self._show_running:
+            delay = self._last_refresh + 1.0 / self.refresh_rate - time.time()
+            if delay > 0:
+                if self.use_timer and self.refresh_timer is None:
+                    self.refresh_timer = action_manager_self().backend.timer(
+                        fire=delay, handler=RefreshHandler(self),
+                        autoclose=True)
+                return
+        self.draw_running_tasks()
+
+    def draw_running_tasks(self):
         '''Rewrite the current line and print the current running tasks'''
-        rtasks = [t.parent.name for t in action_manager_self().running_tasks]
+        phase_timers_self().start('console output')
+        try:
+            self._draw_running_tasks()
+        finally:
+            phase_timers_self().stop('console output')
+
+    def _draw_running_tasks(self):
+        '''Draw the running tasks line'''
+        self._last_refresh = time.time()
+        if self.refresh_rate > 0:
+            sys.stdout.flush()
+        rtasks = action_manager_self().running_names
         if rtasks and self._show_running:
-            tasks_disp = '[%s]' % NodeSet.fromlist(rtasks)
+            tasks_disp = '[%s]' % rtasks
             width = min(self._pl_width, self._term_width)
 
             # truncate display to avoid buggy display when the length on
@@ -181,6 +250,14 @@ class ConsoleDisplay(object):
 
     def output(self, line):
         '''Rewrite the current line and display line and jump to the next one'''
+        phase_timers_self().start('console output')
+        try:
+            self._output(line)
+        finally:
+            phase_timers_self().stop('console output')
+
+    def _output(self, line):
+        '''Write line, padded to hide the running tasks line'''
         width = min(self._pl_width, self._term_width)
         # Compute spaces at the end of the line to remove previous garbage
         # on stderr (escape characters are ignored)
@@ -188,19 +265,31 @@ class ConsoleDisplay(object):
         if not self._show_running:
             eol = ''
         sys.stdout.write('%s%s\n' % (line, eol))
-        sys.stdout.flush()
+        if self.refresh_rate <= 0:
+            sys.stdout.flush()
         self._pl_width = len(line)
         self.escape = 0
 
+    def flush(self):
+        '''Write the lines kept in the stdout buffer'''
+        sys.stdout.flush()
+
+    def close(self):
+        '''Cancel the pending refresh and write the lines left'''
+        if self.refresh_timer is not None:
+            self.refresh_timer.invalidate()
+            self.refresh_timer = None
+        self.flush()
+
     def print_status(self, entity):
-        '''Remove current line and print the status of an entity on STDOUT'''
+        '''Remove current line and print the status of a service record'''
         # On very wide terminal, do not put the status too far away
         msg_width = min(self._term_width, MAXTERMWIDTH) - \
                                                      (self._LARGEST_STATUS + 4)
         line = '%%-%ds%%%ds' % (msg_width, (self._LARGEST_STATUS + 4))
 
         # Label w/o description
-        label = entity.longname()
+        label = entity.longname
         if len(label) > msg_width:
             label = "%s..." % label[:msg_width - 3 ]
 
@@ -222,16 +311,24 @@ class ConsoleDisplay(object):
         else:
             line = line % (label, '[%s]' % entity.status)
         self.output(line)
+        # Errors are shown at once
+        if entity.status in (TIMEOUT, ERROR, DEP_ERROR):
+            self.flush()
 
-    def print_summary(self, actions):
-        '''Print the errors summary of the array actions'''
+    def print_summary(self, actions, unreachable=None):
+        '''
+        Print the errors summary of the array actions and the nodes found
+        unreachable before running them.
+        '''
         lines = []
 
         errors = 0
         others = 0
         to_spell = 'action'
+        broken = NodeSet()
 
         for ent in actions:
+            broken.update(ent.broken_nodes)
             if ent.status in (TIMEOUT, ERROR, DEP_ERROR):
                 lines.append(" + %s" % self.string_color(ent.longname(), 'RED'))
                 errors += 1
@@ -248,17 +345,95 @@ class ConsoleDisplay(object):
                        to_spell,
                        self.string_color(errors, (errors and 'RED' or 'GREEN')))
         lines.insert(0, header)
+        if broken:
+            lines.append(" %s: %s" % (
+                self.string_color('Excluded by circuit breaker', 'RED'),
+                self.string_color(broken, 'CYAN')))
+        if unreachable:
+            lines.append(" %s: %s" % (
+                self.string_color('Unreachable nodes', 'RED'),
+                self.string_color(unreachable, 'CYAN')))
+        self.output("\n".join(lines))
+
+    def print_timings(self, stats, node_timings=None):
+        '''
+        Print the timing statistics of the run, and the slowest and outlier
+        nodes from node_timings.
+        '''
+        lines = [" %s - wall time %.2f s, %s commands (%.1f/s)" % (
+                       self.string_color('Timings'.upper(), 'MAGENTA'),
+                       stats.wall_time,
+                       self.string_color(stats.commands, 'CYAN'), stats.rate)]
+        slowest = stats.slowest()
+        if slowest:
+            lines.append(" Slowest actions:")
+            for duration, fullname in slowest:
+                lines.append(" + %s %.2f s" % (
+                       self.string_color(fullname, 'CYAN'), duration))
+            lines.append(" Durations by action (p50/p90/p99/max):")
+            for name in sorted(stats.durations):
+                lines.append(" + %s %s s (%d)" % (
+                       self.string_color(name, 'CYAN'),
+                       ' / '.join(['%.2f' % duration for duration in
+                                   stats.percentiles(name, (50, 90, 99, 100))]),
+                       len(stats.durations[name])))
+        if stats.retries or stats.delayed:
+            lines.append(" Retries: %d, delays: %.2f s" % (stats.retries,
+                                                           stats.delayed))
+        if node_timings and node_timings.count:
+            lines.append(" Slowest nodes (mean):")
+            for mean, nodes in node_timings.slowest():
+                lines.append(" + %s %.2f s" % (
+                       self.string_color(nodes, 'CYAN'), mean))
+            outliers = node_timings.consistent_outliers()
+            if outliers:
+                lines.append(" %s: %s" % (
+                    self.string_color('Slow in most actions', 'RED'),
+                    self.string_color(outliers, 'CYAN')))
         self.output("\n".join(lines))
 
+    def print_critical_path(self, segments):
+        '''
+        Print the actions of the critical path with the time they waited
+        to be dispatched and the time they ran.
+        '''
+        total = sum([waited + ran for action, waited, ran in segments])
+        lines = ["\n %s - %.2f s" % (
+                 self.string_color('Critical path'.upper(), 'MAGENTA'), total)]
+        for action, waited, ran in segments:
+            lines.append(" + %s waited %.2f s, ran %.2f s" % (
+                         self.string_color(action.fullname(), 'CYAN'),
+                         waited, ran))
+        self.output("\n".join(lines))
+
+    def print_profile(self, timers):
+        '''
+        Print the time spent in each phase of the run, longest first, with
+        the number of times each phase was entered.
+        '''
+        total = timers.total
+        lines = ["\n %s - %.3f s" % (
+                 self.string_color('Profile'.upper(), 'MAGENTA'), total)]
+        for name, duration, calls in timers.breakdown():
+            lines.append(" + %s %.3f s (%d) %.1f%%" % (
+                         self.string_color(name, 'CYAN'), duration, calls,
+                         100.0 * duration / (total or 1)))
+        self.output("\n".join(lines))
+
+    def print_dedup_stats(self, stats):
+        '''Print how many executions were saved by sharing results'''
+        total = stats['executed'] + stats['shared']
+        self.output(" %s: %s of %d commands shared results of identical ones"
+                    % (self.string_color('Deduplication', 'MAGENTA'),
+                       self.string_color(stats['shared'], 'CYAN'), total))
+
     def print_action_command(self, action):
         '''Remove the current line and write informations about the command'''
-        target = action.resolve_property('target') or 'localhost'
         line = '%s %s %s %s\n > %s' % \
             (self.string_color(action.name, 'MAGENTA'),
-             action.parent.fullname(),
-             self.string_color('on', 'MAGENTA'), target,
-             self.string_color(
-                action.resolve_property('command'), 'CYAN'))
+             action.service,
+             self.string_color('on', 'MAGENTA'), action.target,
+             self.string_color(action.command, 'CYAN'))
         self.output(line)
 
     def __gen_action_output(self, iterbuf, iterrc, timeouts, error_only):
@@ -296,32 +471,22 @@ class ConsoleDisplay(object):
         '''Remove the current line and write grouped results of an action'''
         line = ['%s %s ran in %.2f s' % \
             (self.string_color(action.name, 'MAGENTA'),
-             action.parent.fullname(),
+             action.service,
              action.duration)]
-        buffers = []
-        retcodes = []
-        timeout = NodeSet()
-        # Local action
-        if action.worker.current_node is None:
-            buffers = [(action.worker.read(), 'localhost')]
-            if action.worker.did_timeout():
-                timeout.add('localhost')
-            if action.worker.retcode() is not None:
-                retcodes.append((action.worker.retcode(),'localhost'))
-        # Remote action
-        else:
-            buffers = action.worker.iter_buffers()
-            retcodes = action.worker.iter_retcodes()
-            timeout = NodeSet.fromlist(action.worker.iter_keys_timeout())
-
-        line += self.__gen_action_output(buffers, retcodes, timeout, error_only)
+        line += self.__gen_action_output(action.buffers, action.retcodes,
+                                         action.timeouts, error_only)
+        if action.broken_nodes:
+            line.append(' > %s %s' %
+                        (self.string_color(action.broken_nodes, 'CYAN'),
+                         self.string_color('excluded by circuit breaker',
+                                           'RED')))
         self.output("\n".join(line))
 
     def print_delayed_action(self, action):
         '''Display a message specifying that this action has been delayed'''
         line = '%s %s %s %s s' % \
             (self.string_color(action.name, 'MAGENTA'),
-             action.parent.fullname(),
+             action.service,
              self.string_color('will fire in', 'MAGENTA'),
              action.delay)
         self.output(line)
@@ -446,9 +611,147 @@ class CommandLine(CoreEvent):
 
         self._logger = ConfigParser.install_logger()
 
-        call_back_self().attach(self)
+        # Events handled by a separate thread, None if disabled
+        self._events = None
+        # Events written as JSON lines, None if disabled
+        self._writer = None
+        # Timings of completed actions, None if not displayed
+        self.stats = None
+        # Releases of the actions, None if not displayed
+        self.critical_path = None
+        # Timeline of the run, None if not written
+        self.tracer = None
+        self._subscribe(self)
         self.inter_thread = InteractiveThread(self._console)
 
+    def _subscribe(self, interface):
+        '''Attach interface to the events displayed by the console'''
+        # The console only displays events of actions and services
+        call_back_self().attach(interface, events=(EV_STARTED, EV_COMPLETE),
+                                types=(Action, Service))
+        call_back_self().attach(interface, events=(EV_DELAYED,),
+                                types=(Action,))
+        call_back_self().attach(interface, events=(EV_STATUS_CHANGED,),
+                                types=(Service,))
+
+    def _start_events(self, size, policy):
+        '''Display events from a separate thread fed by a queue'''
+        if policy not in (QUEUE_BLOCK, QUEUE_DROP):
+            raise ConfigParserError("Wrong value '%s' for 'ui_queue_policy'"
+                                    % policy)
+        self._events = EventQueue(self, size, policy, self._redraw_only,
+                                  self._record)
+        call_back_self().detach(self)
+        self._subscribe(self._events)
+        self._console.use_timer = False
+        self._events.start()
+
+    def _stop_events(self):
+        '''Wait for the queued events to be displayed'''
+        if self._events is not None:
+            self._events.stop()
+            call_back_self().detach(self._events)
+            self._subscribe(self)
+            self._console.use_timer = True
+            self._events = None
+
+    def _start_writer(self):
+        '''
+        Write events as JSON lines in the events file or on stdout. The
+        console displays nothing when they are written on stdout.
+        '''
+        if self._conf.get('events_file'):
+            try:
+                stream = open(self._conf['events_file'], 'w')
+            except IOError, exc:
+                raise ConfigurationError("Cannot write events in '%s': %s"
+                                         % (self._conf['events_file'], exc))
+        else:
+            stream = sys.stdout
+        self._writer = JsonLinesWriter(stream)
+        call_back_self().attach(self._writer)
+        if self._conf.get('output_format') == 'jsonl':
+            call_back_self().detach(self)
+
+    def _stop_writer(self):
+        '''Write the events left and display events on the console again'''
+        if self._writer is not None:
+            call_back_self().detach(self._writer)
+            if self._writer.stream is sys.stdout:
+                self._writer.flush()
+            else:
+                self._writer.close()
+            if self._conf.get('output_format') == 'jsonl':
+                self._subscribe(self)
+            self._writer = None
+
+    def _record(self, ev_name, obj):
+        '''
+        Account for the event and return the values of obj it displays. It
+        is called once for each event, from the thread running the engine.
+        '''
+        if isinstance(obj, Service):
+            return ServiceRecord(obj.longname(), obj.status, obj.simulate)
+        elif not isinstance(obj, Action):
+            return obj
+        target = command = None
+        buffers = retcodes = timeouts = None
+        if ev_name is EV_STARTED and self._conf['verbosity'] >= 2:
+            target = obj.resolve_property('target') or 'localhost'
+            command = obj.resolve_property('command')
+        elif ev_name is EV_COMPLETE:
+            self.actions.append(obj)
+            if self.stats:
+                self.stats.add(obj)
+            if self._results_shown(obj.status) is not None:
+                buffers, retcodes, timeouts = self._results(obj.worker)
+        return ActionRecord(obj.name, obj.parent.fullname(), obj.status,
+                            obj.duration, obj.delay, target, command,
+                            buffers, retcodes, timeouts,
+                            NodeSet(obj.broken_nodes))
+
+    @staticmethod
+    def _results(worker):
+        '''
+        Return the output, return codes and timeouts of the nodes of worker
+        as (buffer, nodeset) couples, (retcode, nodeset) couples and a
+        nodeset.
+        '''
+        # Local action
+        if isinstance(worker, WorkerPopen):
+            buffers = [(local_output(worker), NodeSet('localhost'))]
+            retcodes = []
+            timeouts = NodeSet()
+            if worker.did_timeout():
+                timeouts.add('localhost')
+            if worker.retcode() is not None:
+                retcodes.append((worker.retcode(), NodeSet('localhost')))
+        # Remote action
+        else:
+            buffers = [(str(buf), nodes)
+                       for buf, nodes in worker.iter_buffers()]
+            retcodes = list(worker.iter_retcodes())
+            timeouts = NodeSet.fromlist(worker.iter_keys_timeout())
+        return buffers, retcodes, timeouts
+
+    def _results_shown(self, status):
+        '''
+        Return None if results of actions ending with status are not
+        displayed, else whether only results of failing nodes are.
+        '''
+        if self._conf['verbosity'] >= 3 and status != SKIPPED:
+            return False
+        elif status in (TIMEOUT, ERROR, DEP_ERROR) and \
+             self._conf['verbosity'] >= 1:
+            return self._conf['verbosity'] == 1
+        return None
+
+    @staticmethod
+    def _redraw_only(ev_name, obj):
+        '''Tell if the event only redraws the running tasks line'''
+        return isinstance(obj, Service) and \
+               ev_name in (EV_STARTED, EV_COMPLETE)
+
     def execute(self, command_line):
         '''
         Ask for the manager to execute orders given by the command line.
@@ -456,15 +759,94 @@ class CommandLine(CoreEvent):
         self._mop = McOptionParser()
         self._mop.configure_mop()
         retcode = RC_OK
+        timers = phase_timers_self()
+        timers.reset(enabled=False)
+        profiler = None
 
         try:
             (self._options, self._args) = self._mop.parse_args(command_line)
 
             self._conf = ConfigParser(self._options)
+            if self._conf.get('profile') or self._conf.get('profile_file'):
+                timers.reset()
+                timers.start('cli')
+            if self._conf.get('profile_file'):
+                profiler = cProfile.Profile()
+                profiler.enable()
+            self._console.refresh_rate = self._conf['refresh_rate']
+            self.stats = None
+            action_manager_self().node_timings = None
+            if self._conf['timings']:
+                self.stats = RunStatistics()
+                action_manager_self().enable_node_timings()
+            if self.critical_path is not None:
+                call_back_self().detach(self.critical_path)
+            self.critical_path = None
+            if self._conf['critical_path']:
+                self.critical_path = CriticalPath()
+                call_back_self().attach(self.critical_path,
+                                        events=(EV_STARTED, EV_COMPLETE),
+                                        types=(Action,))
+                call_back_self().attach(self.critical_path,
+                                        events=(EV_TRIGGER_DEP,))
+            if self.tracer is not None:
+                call_back_self().detach(self.tracer)
+            self.tracer = None
+            action_manager_self().tracer = None
+            if self._conf.get('trace'):
+                self.tracer = action_manager_self().enable_trace(
+                                self._conf['trace'], self._conf['trace_nodes'])
+                call_back_self().attach(self.tracer,
+                                        events=(EV_STARTED, EV_COMPLETE,
+                                                EV_DELAYED),
+                                        types=(Action,))
+            jsonl = self._conf.get('output_format') == 'jsonl'
+            if jsonl or self._conf.get('events_file'):
+                self._start_writer()
+            if self._conf['ui_queue_size'] > 0 and not jsonl:
+                self._start_events(self._conf['ui_queue_size'],
+                                   self._conf['ui_queue_policy'])
 
             # Configure ActionManager
             action_manager_self().default_fanout = self._conf['fanout']
             action_manager_self().dryrun = self._conf['dryrun']
+            backend = make_backend(self._conf['backend'],
+                                   self._conf['backend_options'])
+            if self._conf['ssh_multiplex']:
+                backend.enable_multiplexing()
+            if self._conf['max_per_node'] > 0:
+                backend = NodeLimitedBackend(backend,
+                                             self._conf['max_per_node'])
+            backend.set_output(self.output_policy())
+            action_manager_self().backend = backend
+            action_manager_self().enable_circuit_breaker(
+                self._conf['circuit_breaker'])
+            action_manager_self().dedup = False
+            if self._conf['dedup']:
+                action_manager_self().enable_dedup()
+            action_manager_self().fail_fast = self._conf['fail_fast']
+            action_manager_self().cache = None
+            if self._conf['cache_ttl'] > 0:
+                action_manager_self().enable_cache(self._conf['cache_file'],
+                                                   self._conf['cache_ttl'])
+            action_manager_self().journal = None
+            action_manager_self().resumed = {}
+            if self._conf.get('resume'):
+                action_manager_self().resume(self._conf['resume'])
+            # A resumed run goes on with the same journal by default
+            journal = self._conf.get('journal') or self._conf.get('resume')
+            if journal:
+                action_manager_self().enable_journal(journal)
+            action_manager_self().output_store = None
+            output_limits = (self._conf['output_budget'],
+                             self._conf['output_action_budget'],
+                             self._conf['output_max_lines'],
+                             self._conf['output_max_bytes'])
+            if max(output_limits) > 0:
+                action_manager_self().enable_output_store(*output_limits)
+            if self._conf['adaptive_fanout']:
+                action_manager_self().enable_adaptive_fanout(
+                    self._conf['fanout_min'], self._conf['fanout_max'])
 
             manager = service_manager_self()
             # Case 0: build the graph
@@ -487,10 +869,25 @@ class CommandLine(CoreEvent):
 
                 # Run tasks
                 manager.call_services(services, action, conf=self._conf)
+                self._stop_events()
                 retcode = self.retcode()
 
-                if self._conf.get('summary', False):
-                    self._console.print_summary(self.actions)
+                if self._conf.get('results'):
+                    write_results(self._conf['results'],
+                                  manager.entities.values(), action)
+
+                if self._conf.get('summary', False) and not jsonl:
+                    self._console.print_summary(self.actions,
+                                                manager.unreachable)
+                    if self._conf['dedup']:
+                        self._console.print_dedup_stats(
+                            action_manager_self().dedup_stats)
+                    if self.stats:
+                        self._console.print_timings(self.stats,
+                                        action_manager_self().node_timings)
+                if self.critical_path is not None and not jsonl:
+                    self._console.print_critical_path(
+                                        self.critical_path.segments())
             # Case 2 : Check configuration
             elif self._conf.get('config_dir', False):
                 self._console.output("No actions specified, "
@@ -510,6 +907,8 @@ class CommandLine(CoreEvent):
                 IllegalDependencyTypeError,
                 ConfigParserError,
                 ConfigurationError,
+                BackendError,
+                JournalError,
                 ScannerError), exc:
             self._logger.error(str(exc))
             retcode = RC_EXCEPTION
@@ -534,6 +933,26 @@ class CommandLine(CoreEvent):
         # Quit the interactive thread
         self.inter_thread.quit()
         self.inter_thread.join()
+        self._stop_events()
+        self._stop_writer()
+        self._console.close()
+
+        # Release connections kept during the run
+        action_manager_self().close()
+
+        if profiler is not None:
+            profiler.disable()
+            try:
+                profiler.dump_stats(self._conf['profile_file'])
+            except IOError, exc:
+                self._logger.error("Cannot write profile '%s': %s"
+                                   % (self._conf['profile_file'], exc))
+        if timers.enabled:
+            timers.stop('cli')
+            if self._conf.get('output_format') != 'jsonl':
+                self._console.print_profile(timers)
+                self._console.flush()
+            timers.reset(enabled=False)
 
         return retcode
 
@@ -556,15 +975,29 @@ class CommandLine(CoreEvent):
         else:
             return RC_OK
 
+    def output_policy(self):
+        '''
+        Return the output of actions displayed at the current verbosity:
+        all of it, only output of failing nodes or nothing.
+        '''
+        if self._conf['verbosity'] >= 2:
+            return OUTPUT_ALL
+        elif self._conf['verbosity'] == 1:
+            return OUTPUT_ERRORS
+        else:
+            return OUTPUT_NONE
+
     def ev_started(self, obj):
         '''
         Something has started on the object given as parameter. This migh be
         the beginning of a command one a node, an action or a service.
         '''
-        if isinstance(obj, Action) and self._conf['verbosity'] >= 2:
+        if isinstance(obj, (Action, Service)):
+            obj = self._record(EV_STARTED, obj)
+        if isinstance(obj, ActionRecord) and self._conf['verbosity'] >= 2:
             self._console.print_action_command(obj)
             self._console.print_running_tasks()
-        elif isinstance(obj, Service) and self._conf['verbosity'] >= 1:
+        elif isinstance(obj, ServiceRecord) and self._conf['verbosity'] >= 1:
             self._console.print_running_tasks()
 
     def ev_complete(self, obj):
@@ -572,17 +1005,14 @@ class CommandLine(CoreEvent):
         Something is complete on the object given as parameter. This migh be
         the end of a command on a node,  an action or a service.
         '''
-        if isinstance(obj, Action):
-            self.actions.append(obj)
-            if self._conf['verbosity'] >= 3 and obj.status != SKIPPED:
-                self._console.print_action_results(obj)
-                self._console.print_running_tasks()
-            elif obj.status in (TIMEOUT, ERROR, DEP_ERROR) and \
-                      self._conf['verbosity'] >= 1:
-                self._console.print_action_results(obj,
-                                           self._conf['verbosity'] == 1)
+        if isinstance(obj, (Action, Service)):
+            obj = self._record(EV_COMPLETE, obj)
+        if isinstance(obj, ActionRecord):
+            error_only = self._results_shown(obj.status)
+            if error_only is not None:
+                self._console.print_action_results(obj, error_only)
                 self._console.print_running_tasks()
-        elif isinstance(obj, Service) and self._conf['verbosity'] >= 1:
+        elif isinstance(obj, ServiceRecord) and self._conf['verbosity'] >= 1:
             self._console.print_running_tasks()
 
     def ev_status_changed(self, obj):
@@ -590,7 +1020,9 @@ class CommandLine(CoreEvent):
         Status of the object given as parameter. Actions or Service's status
         might have changed.
         '''
-        if isinstance(obj, Service) and not (obj.status == SKIPPED and \
+        if isinstance(obj, (Action, Service)):
+            obj = self._record(EV_STATUS_CHANGED, obj)
+        if isinstance(obj, ServiceRecord) and not (obj.status == SKIPPED and \
                                self._conf['verbosity'] < 3) and \
                                obj.status in (TIMEOUT, ERROR, DEP_ERROR, DONE,
                                WARNING, SKIPPED) and not obj.simulate:
@@ -603,7 +1035,9 @@ class CommandLine(CoreEvent):
         Object given as parameter has been delayed. This event is only raised
         when an action was delayed
         '''
-        if isinstance(obj, Action) and self._conf['verbosity'] >= 3:
+        if isinstance(obj, (Action, Service)):
+            obj = self._record(EV_DELAYED, obj)
+        if isinstance(obj, ActionRecord) and self._conf['verbosity'] >= 3:
             self._console.print_delayed_action(obj)
             self._console.print_running_tasks()
 
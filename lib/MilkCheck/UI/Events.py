@@ -0,0 +1,128 @@
+#
+# Copyright CEA (2011-2014)
+#
+# This file is part of MilkCheck project.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+'''
+This module contains the JsonLinesWriter class definition. It is an
+interface of the CallbackHandler writing one JSON object per engine event,
+so the results of a run may be read by other tools.
+'''
+
+import json
+import time
+
+from ClusterShell.NodeSet import NodeSet
+from ClusterShell.Worker.Popen import WorkerPopen
+
+from MilkCheck.Callback import CoreEvent
+from MilkCheck.Engine.Action import Action
+
+class JsonLinesWriter(CoreEvent):
+    '''
+    Write one JSON object per event to stream. Lines are kept in memory and
+    written by chunks of buffer_size lines. Times are in seconds since the
+    writer was created and never decrease, even if the clock is set back.
+    '''
+
+    def __init__(self, stream, buffer_size=512):
+        CoreEvent.__init__(self)
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._lines = []
+        self._start = time.time()
+        self._last = 0.0
+
+    def _elapsed(self):
+        '''Return the time of the current event'''
+        self._last = max(self._last, time.time() - self._start)
+        return round(self._last, 6)
+
+    def _write(self, event, obj, **fields):
+        '''Add the line of event, about entity obj'''
+        entry = {'event': event, 'time': self._elapsed(),
+                 'type': isinstance(obj, Action) and 'action' or 'service',
+                 'name': obj.fullname(), 'status': obj.status}
+        if obj.target:
+            entry['target'] = str(obj.target)
+        entry.update(fields)
+        self._lines.append(json.dumps(entry))
+        if len(self._lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the lines kept in memory'''
+        if self._lines:
+            self._lines.append('')
+            self.stream.write('\n'.join(self._lines))
+            self.stream.flush()
+            self._lines = []
+
+    def close(self):
+        '''Write the lines left and close stream'''
+        self.flush()
+        self.stream.close()
+
+    def ev_started(self, obj):
+        '''An action or a service started'''
+        self._write('started', obj)
+
+    def ev_delayed(self, obj):
+        '''An action is delayed'''
+        self._write('delayed', obj, delay=obj.delay)
+
+    def ev_status_changed(self, obj):
+        '''Status of an action or a service changed'''
+        self._write('status_changed', obj)
+
+    def ev_complete(self, obj):
+        '''An action or a service is complete, actions give their results'''
+        fields = {}
+        worker = isinstance(obj, Action) and obj.worker
+        if isinstance(worker, WorkerPopen):
+            if worker.retcode() is not None:
+                fields['retcodes'] = {str(worker.retcode()): 'localhost'}
+            if worker.did_timeout():
+                fields['timeout'] = 'localhost'
+        elif worker:
+            fields['retcodes'] = dict([(str(retcode), str(nodes))
+                                for retcode, nodes in worker.iter_retcodes()])
+            timeouts = NodeSet.fromlist(worker.iter_keys_timeout())
+            if timeouts:
+                fields['timeout'] = str(timeouts)
+        self._write('complete', obj, **fields)
+
+    def ev_trigger_dep(self, obj_source, obj_triggered):
+        '''An action or a service triggered another one'''
+        self._write('trigger_dep', obj_source,
+                    triggered=obj_triggered.fullname())
+
+    def ev_finished(self, obj):
+        '''All tasks are done'''
+        self.flush()
@@ -95,6 +95,13 @@ class McOptionParser(OptionParser):
                         dest='summary',
                         help='Display summary of executed actions')
 
+        self.add_option('--timings', action='store_true', dest='timings',
+                        help='Add timing statistics to the summary')
+
+        self.add_option('--critical-path', action='store_true',
+                        dest='critical_path',
+                        help='Display the chain of actions the run waited for')
+
         # Configuration options
         self.add_option('-c', '--config-dir', action='callback',
                         callback=self.__check_dir, type='string',
@@ -104,6 +111,28 @@ class McOptionParser(OptionParser):
         self.add_option('-q', '--quiet', action='store_const', dest='verbosity',
                         const=0, help='Enable quiet mode')
 
+        self.add_option('--output-format', action='store', type='choice',
+                        choices=['console', 'jsonl'], dest='output_format',
+                        metavar='FORMAT',
+                        help='Display events on the console or as JSON lines '
+                             '(console, jsonl)')
+
+        self.add_option('--events-file', action='store', dest='events_file',
+                        metavar='FILE', help='Write events as JSON lines in FILE')
+
+        self.add_option('--trace', action='store', dest='trace',
+                        metavar='FILE',
+                        help='Write the timeline of the run in FILE (Chrome '
+                             'trace format)')
+
+        self.add_option('--profile', action='store_true', dest='profile',
+                        help='Display the time spent in each phase of the run')
+
+        self.add_option('--profile-file', action='store', dest='profile_file',
+                        metavar='FILE',
+                        help='Profile the run and write the statistics in '
+                             'FILE (implies --profile)')
+
         # Engine options
         eng = OptionGroup(self, 'Engine parameters',
             'Those options allow you to configure the behaviour of the engine')
@@ -131,6 +160,49 @@ class McOptionParser(OptionParser):
         eng.add_option('--nodeps', action='store_true', dest='nodeps',
                        default=False, help='Do not run dependencies')
 
+        eng.add_option('--backend', action='store', dest='backend',
+                       help='Use the specified execution backend')
+
+        eng.add_option('--adaptive-fanout', action='store_true',
+                       dest='adaptive_fanout',
+                       help='Adjust fanout to the responsiveness of nodes')
+
+        eng.add_option('--preflight', action='store_true', dest='preflight',
+                       help='Exclude unreachable nodes before running actions')
+
+        eng.add_option('--batch', action='store_true', dest='batch',
+                       help='Run actions of each node within a single script')
+
+        eng.add_option('--max-output-lines', action='store', type='int',
+                       dest='output_max_lines', metavar='N',
+                       help='Keep at most N lines of output per node')
+
+        eng.add_option('--max-output-bytes', action='store', type='int',
+                       dest='output_max_bytes', metavar='N',
+                       help='Keep at most N bytes of output per node')
+
+        eng.add_option('--fail-fast', action='store_true', dest='fail_fast',
+                       help='Cancel remaining actions once the run failed')
+
+        eng.add_option('--cache-ttl', action='store', type='int',
+                       dest='cache_ttl', metavar='SECONDS',
+                       help='Reuse results of idempotent actions for SECONDS')
+
+        eng.add_option('--journal', action='store', dest='journal',
+                       metavar='FILE',
+                       help='Record completed actions in FILE')
+
+        eng.add_option('--resume', action='store', dest='resume',
+                       metavar='FILE',
+                       help='Resume the run recorded in FILE')
+
+        eng.add_option('--results', action='store', dest='results',
+                       metavar='FILE',
+                       help='Write status of actions and nodes in FILE')
+
+        eng.add_option('--rerun-failed', action='store', dest='rerun_failed',
+                       metavar='FILE',
+                       help='Run again what failed in the results FILE')
 
         self.add_option_group(eng)
 
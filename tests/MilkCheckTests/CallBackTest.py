@@ -6,8 +6,11 @@ This module defines the tests cases targeting the CallBackHandler.
 '''
 
 # Classes
+import threading
 from unittest import TestCase
 from MilkCheck.Callback import CallbackHandler, call_back_self, CoreEvent
+from MilkCheck.Callback import EventQueue, QUEUE_DROP
+from MilkCheck.Engine.Service import Service
 
 # Symbols
 from MilkCheck.Callback import EV_STARTED, EV_COMPLETE, EV_STATUS_CHANGED
@@ -89,6 +92,23 @@ class CallBackHandlerTest(TestCase):
         call_back_self().notify((None, None), EV_TRIGGER_DEP)
         self.assertEqual(event.last_event, evname)
 
+    def test_subscriptions(self):
+        '''Test interfaces are only notified of subscribed events'''
+        event = EventTest()
+        call_back_self().detach(event)
+        call_back_self().attach(event, events=(EV_STARTED,))
+        call_back_self().attach(event, events=(EV_COMPLETE,), types=(int,))
+        call_back_self().notify(None, EV_STATUS_CHANGED)
+        self.assertEqual(event.last_event, None)
+        call_back_self().notify(None, EV_COMPLETE)
+        self.assertEqual(event.last_event, None)
+        call_back_self().notify(1, EV_COMPLETE)
+        self.assertEqual(event.last_event, EV_COMPLETE)
+        call_back_self().notify(None, EV_STARTED)
+        self.assertEqual(event.last_event, EV_STARTED)
+        call_back_self().detach(event)
+        self.assertFalse(call_back_self()._dispatch)
+
     def test_notimplemented(self):
         '''Test NotImplementedError'''
         result = []
@@ -108,3 +128,66 @@ class CallBackHandlerTest(TestCase):
         self.assertEqual(len(events), len(result),
                 "%s should raise NotImplementedError" %
                         list(set(events) - set(result) ))
+
+def status_record(ev_name, obj):
+    '''Return the status of obj, queued instead of obj'''
+    return obj.status
+
+class RecordingEvent(CoreEvent):
+    '''Record the status of services, once allowed to go on'''
+
+    def __init__(self):
+        CoreEvent.__init__(self)
+        self.proceed = threading.Event()
+        self.statuses = []
+
+    def ev_status_changed(self, status):
+        '''Record status queued for a service'''
+        self.proceed.wait()
+        self.statuses.append(status)
+
+    def ev_started(self, obj):
+        '''Record start of obj'''
+        self.proceed.wait()
+        self.statuses.append('started')
+
+class EventQueueTest(TestCase):
+    '''Test events handled from a separate thread'''
+
+    def tearDown(self):
+        '''Restore CallbackHandler'''
+        CallbackHandler._instance = None
+
+    def test_snapshot(self):
+        '''Test queued events keep the status at the time of the event'''
+        event = RecordingEvent()
+        queue = EventQueue(event, 10, record=status_record)
+        call_back_self().attach(queue)
+        queue.start()
+        service = Service('S1')
+        for status in ('WAITING_STATUS', 'DONE'):
+            service.status = status
+            call_back_self().notify(service, EV_STATUS_CHANGED)
+        event.proceed.set()
+        queue.stop()
+        self.assertEqual(event.statuses, ['WAITING_STATUS', 'DONE'])
+
+    def test_drop_policy(self):
+        '''Test droppable events are dropped when the queue is full'''
+        event = RecordingEvent()
+        queue = EventQueue(event, 1, QUEUE_DROP,
+                           lambda ev_name, obj: ev_name is EV_STARTED,
+                           status_record)
+        queue.start()
+        service = Service('S1')
+        # First event is taken by the thread, then one slot is available
+        queue.ev_started(service)
+        while not queue._queue.empty():
+            pass
+        for _ in range(3):
+            queue.ev_started(service)
+        self.assertEqual(queue.dropped, 2)
+        event.proceed.set()
+        queue.ev_status_changed(service)
+        queue.stop()
+        self.assertEqual(event.statuses, ['started', 'started', 'NO_STATUS'])
@@ -6,14 +6,18 @@ This modules defines the tests cases targeting the BaseService
 """
 
 import socket
+import time
 from unittest import TestCase
 
 from ClusterShell.NodeSet import NodeSet
 
 from MilkCheck.Engine.BaseEntity import NO_STATUS, DONE, ERROR, TIMEOUT, \
-                                        DEP_ERROR, SKIPPED, WARNING
+                                        DEP_ERROR, SKIPPED, WARNING, \
+                                        REQUIRE_WEAK
 from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
-from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Service import Service, ActionNotFoundError
+from MilkCheck.Engine.ServiceGroup import ServiceGroup
+from MilkCheck.Engine.Backend import FakeClusterBackend
 
 HOSTNAME = socket.gethostname().split('.')[0]
 
@@ -485,6 +489,24 @@ class ActionManagerTest(TestCase):
         self.assertTrue(task_manager.running_tasks)
         self.assertEqual(len(task_manager.running_tasks), 3)
 
+    def test_running_names(self):
+        """Test folded names of running services follow added tasks"""
+        task_manager = action_manager_self()
+        tasks = []
+        for name in ('S1', 'S2', 'S2', 'S3'):
+            svc = Service(name)
+            svc.add_action(Action('start'))
+            tasks.append(svc._actions['start'])
+            task_manager.add_task(tasks[-1])
+        self.assertEqual(task_manager.running_names, 'S[1-3]')
+        task_manager.remove_task(tasks[1])
+        self.assertEqual(task_manager.running_names, 'S[1-3]')
+        task_manager.remove_task(tasks[2])
+        self.assertEqual(task_manager.running_names, 'S[1,3]')
+        task_manager.remove_task(tasks[0])
+        task_manager.remove_task(tasks[3])
+        self.assertEqual(task_manager.running_names, '')
+
     def test_perform_action(self):
         """test perform an action without any delay"""
         action = Action('start', command='/bin/true')
@@ -529,3 +551,272 @@ class ActionManagerTest(TestCase):
         ActionManager._instance = None
         self.assertEqual(task_manager.tasks_done_count, 1)
         self.assert_near(0.3, 0.1, action.duration)
+
+class CircuitBreakerTest(TestCase):
+    """Test nodes exclusion by the circuit breaker"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        action_manager_self().backend = FakeClusterBackend(
+                                   nodes={'foo1': {'failure_rate': 1.0}})
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def _services(self, target1, target2):
+        """Return two services, the second one weakly depending on the first"""
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target=target1, command=':'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target=target2, command=':'))
+        svc2.add_dep(svc1, sgth=REQUIRE_WEAK)
+        return svc1, svc2
+
+    def test_broken_node_excluded(self):
+        """Test node failing to connect is excluded from next actions"""
+        action_manager_self().enable_circuit_breaker(1)
+        svc1, svc2 = self._services('foo[1-3]', 'foo[1-3]')
+        svc2.run('start')
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(action_manager_self().broken_nodes, NodeSet('foo1'))
+        action = svc2._actions['start']
+        self.assertEqual(action.broken_nodes, NodeSet('foo1'))
+        self.assertEqual(action.target, NodeSet('foo[2-3]'))
+        self.assertEqual(action.nb_errors(), 0)
+        self.assertEqual(action.nb_broken(), 1)
+        self.assertEqual(svc2.status, ERROR)
+
+    def test_all_nodes_broken(self):
+        """Test action is not run if all its nodes are excluded"""
+        action_manager_self().enable_circuit_breaker(1)
+        svc1, svc2 = self._services('foo[1-2]', 'foo1')
+        svc2._actions['start'].errors = 1
+        svc2.run('start')
+        action = svc2._actions['start']
+        self.assertEqual(len(action.target), 0)
+        self.assertEqual(action.nb_errors(), 0)
+        self.assertEqual(action.nb_broken(), 1)
+        self.assertEqual(svc2.status, WARNING)
+
+    def test_threshold(self):
+        """Test nodes are excluded only when threshold is reached"""
+        action_manager_self().enable_circuit_breaker(2)
+        svc1, svc2 = self._services('foo[1-3]', 'foo[1-3]')
+        svc2.run('start')
+        self.assertEqual(svc2._actions['start'].broken_nodes, NodeSet())
+        self.assertEqual(action_manager_self().broken_nodes, NodeSet('foo1'))
+
+    def test_retries_count_once(self):
+        """Test failures of the tries of an action count once"""
+        action_manager_self().enable_circuit_breaker(2)
+        svc1, svc2 = self._services('foo[1-2]', 'foo[1-2]')
+        svc1._actions['start'].maxretry = 2
+        svc1.run('start')
+        self.assertEqual(svc1._actions['start'].tries, 3)
+        self.assertEqual(action_manager_self().broken_nodes, NodeSet())
+
+class DedupTest(TestCase):
+    """Test identical commands are run once"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        action_manager_self().backend = FakeClusterBackend()
+        action_manager_self().enable_dedup()
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def _group(self, svc1, svc2):
+        """Run start on a service depending on svc1 and svc2"""
+        group = Service('G')
+        group.add_action(Action('start', command=':'))
+        group.add_dep(svc1)
+        group.add_dep(svc2)
+        group.run('start')
+        return group
+
+    def test_shared_execution(self):
+        """Test concurrent identical commands share results"""
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-2]',
+                               command='sleep 0.3; echo ok'))
+        # Second command starts while the first one is running
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo[1-2]',
+                               command='sleep 0.3; echo ok', delay=0.1))
+        self._group(svc1, svc2)
+        self.assertEqual(action_manager_self().dedup_stats,
+                         {'executed': 1, 'shared': 1})
+        for svc in (svc1, svc2):
+            self.assertEqual(svc.status, DONE)
+            self.assertEqual(list(svc._actions['start'].worker.iter_buffers()),
+                             [('ok', NodeSet('foo[1-2]'))])
+
+    def test_different_targets(self):
+        """Test commands on different targets are not shared"""
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo1', command='echo ok'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo2', command='echo ok'))
+        self._group(svc1, svc2)
+        self.assertEqual(action_manager_self().dedup_stats,
+                         {'executed': 2, 'shared': 0})
+
+    def test_sequential_commands(self):
+        """Test commands already over are run again"""
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo1', command='echo ok'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo1', command='echo ok'))
+        svc2.add_dep(svc1)
+        svc2.run('start')
+        self.assertEqual(svc2.status, DONE)
+        self.assertEqual(action_manager_self().dedup_stats,
+                         {'executed': 2, 'shared': 0})
+
+class FailFastTest(TestCase):
+    """Test work which cannot change the outcome is cancelled"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        action_manager_self().backend = FakeClusterBackend()
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def _service(self, name, command):
+        """Return a service with a start action"""
+        svc = Service(name)
+        svc.add_action(Action('start', target='foo[1-2]', command=command))
+        return svc
+
+    def _root(self, *deps, **sgth):
+        """Run start on a simulated service depending on deps"""
+        root = Service('root')
+        root.simulate = True
+        root.add_action(Action('start', command=':'))
+        for dep in deps:
+            root.add_dep(dep, **sgth)
+        start = time.time()
+        root.run('start')
+        return root, time.time() - start
+
+    def test_fail_fast(self):
+        """Test the run ends as soon as its status is known"""
+        action_manager_self().fail_fast = True
+        svc1 = self._service('S1', 'false')
+        svc2 = self._service('S2', 'sleep 2')
+        svc3 = self._service('S3', 'true')
+        svc3.add_dep(svc2)
+        root, duration = self._root(svc1, svc3)
+        self.assertTrue(duration < 1)
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(svc2.status, DEP_ERROR)
+        self.assertEqual(svc3.status, DEP_ERROR)
+        self.assertEqual(root.status, DEP_ERROR)
+        self.assertEqual(action_manager_self().tasks_count, 0)
+
+    def test_weak_failure(self):
+        """Test weak failures do not cancel anything"""
+        action_manager_self().fail_fast = True
+        svc1 = self._service('S1', 'false')
+        svc2 = self._service('S2', 'sleep 0.3')
+        svc3 = self._service('S3', 'true')
+        svc3.add_dep(svc1, sgth=REQUIRE_WEAK)
+        svc3.add_dep(svc2)
+        root, duration = self._root(svc3)
+        self.assertEqual(svc2.status, DONE)
+        self.assertEqual(svc3.status, DONE)
+        self.assertEqual(root.status, DONE)
+
+    def test_disabled(self):
+        """Test running actions are not cancelled by default"""
+        svc1 = self._service('S1', 'false')
+        svc2 = self._service('S2', 'sleep 0.3')
+        root, duration = self._root(svc1, svc2)
+        self.assertEqual(svc2.status, DONE)
+        self.assertEqual(root.status, DEP_ERROR)
+
+    def test_group(self):
+        """Test subservices of a fail_fast group are cancelled"""
+        group = ServiceGroup('G')
+        group.fail_fast = True
+        sub1 = self._service('A', 'false')
+        sub2 = self._service('B', 'sleep 2')
+        group.add_inter_dep(target=sub1)
+        group.add_inter_dep(target=sub2)
+        svc = self._service('S', 'sleep 0.3')
+        root, duration = self._root(group, svc)
+        self.assertTrue(duration < 1)
+        self.assertEqual(sub2.status, DEP_ERROR)
+        self.assertEqual(group.status, DEP_ERROR)
+        # Outside of the group, work goes on
+        self.assertEqual(svc.status, DONE)
+
+class RecordingBackend(FakeClusterBackend):
+    """Fake backend recording distant commands"""
+
+    def __init__(self, **options):
+        FakeClusterBackend.__init__(self, **options)
+        self.commands = []
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        if nodes:
+            self.commands.append((command, str(nodes)))
+        return FakeClusterBackend.shell(self, command, nodes, timeout, handler)
+
+class GuardedActionTest(TestCase):
+    """Test actions run only where their guard action failed"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def _run(self, guard_cmd, **options):
+        """Run start guarded by status on foo[1-3]"""
+        backend = RecordingBackend(**options)
+        action_manager_self().backend = backend
+        service = Service('S')
+        status = Action('status', target='foo[1-3]', command=guard_cmd)
+        start = Action('start', target='foo[1-3]', command='echo started')
+        start.unless = 'status'
+        service.add_actions(status, start)
+        service.run('start')
+        return service, backend
+
+    def test_guard_succeeds(self):
+        """Test action is not run where the guard succeeds"""
+        service, backend = self._run('true')
+        self.assertEqual(service.status, DONE)
+        self.assertEqual(backend.commands, [('true', 'foo[1-3]')])
+        worker = service._actions['start'].worker
+        self.assertEqual([(rc, str(nds)) for rc, nds in worker.iter_retcodes()],
+                         [(0, 'foo[1-3]')])
+
+    def test_guard_fails(self):
+        """Test action is run where the guard failed"""
+        service, backend = self._run('false')
+        self.assertEqual(service.status, DONE)
+        self.assertEqual(backend.commands, [('false', 'foo[1-3]'),
+                                            ('echo started', 'foo[1-3]')])
+        self.assertEqual(list(service._actions['start'].worker.iter_buffers()),
+                         [('started', NodeSet('foo[1-3]'))])
+
+    def test_partial(self):
+        """Test results of guard and action are gathered"""
+        service, backend = self._run('true',
+                                     nodes={'foo2': {'failure_rate': 1.0}})
+        self.assertEqual(backend.commands[1], ('echo started', 'foo2'))
+        self.assertEqual(service.status, ERROR)
+        worker = service._actions['start'].worker
+        self.assertEqual([(rc, str(nds)) for rc, nds in worker.iter_retcodes()],
+                         [(0, 'foo[1,3]'), (255, 'foo2')])
+
+    def test_unknown_guard(self):
+        """Test guard action must exist"""
+        service = Service('S')
+        self.assertRaises(ActionNotFoundError, service.fromdict,
+                          {'actions': {'start': {'cmd': 'true',
+                                                 'unless': 'status'}}})
@@ -0,0 +1,292 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the execution backends
+"""
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import DONE, ERROR, TIMEOUT, REQUIRE_WEAK
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import BackendError, ClusterShellBackend, \
+                                     ExecutionBackend, FakeClusterBackend, ResultWorker, \
+                                     NodeLimitedBackend, make_backend, \
+                                     local_output, OUTPUT_ALL, \
+                                     OUTPUT_ERRORS, OUTPUT_NONE
+
+class MakeBackendTest(TestCase):
+    """Test backend instanciation from configuration"""
+
+    def test_default_backend(self):
+        """Test creation of the ClusterShell backend"""
+        self.assertTrue(isinstance(make_backend('clustershell'),
+                                   ClusterShellBackend))
+
+    def test_fake_backend(self):
+        """Test creation of the fake backend with options"""
+        backend = make_backend('fake', {'pool': 4, 'seed': 1})
+        self.assertTrue(isinstance(backend, FakeClusterBackend))
+        self.assertEqual(backend.pool, 4)
+
+    def test_unknown_backend(self):
+        """Test unknown backend raises BackendError"""
+        self.assertRaises(BackendError, make_backend, 'foo')
+
+    def test_bad_options(self):
+        """Test unknown backend option raises BackendError"""
+        self.assertRaises(BackendError, make_backend, 'fake', {'bar': 1})
+
+    def test_incomplete_backend(self):
+        """Test a backend missing methods cannot be instanciated"""
+        class LazyBackend(ExecutionBackend):
+            """Backend which only runs commands"""
+            def shell(self, command, nodes=None, timeout=None, handler=None):
+                pass
+        self.assertRaises(TypeError, LazyBackend)
+
+class ClusterShellBackendTest(TestCase):
+    """Test the ClusterShell backend"""
+
+    def test_multiplexing(self):
+        """Test ssh master connections setup and cleanup"""
+        backend = ClusterShellBackend()
+        backend.enable_multiplexing(persist=10)
+        control_dir = backend.control_dir
+        self.assertTrue(os.path.isdir(control_dir))
+        options = backend._task.info('ssh_options')
+        self.assertTrue('-oControlMaster=auto' in options)
+        self.assertTrue('-oControlPath=%s/' % control_dir in options)
+        self.assertTrue('-oControlPersist=10' in options)
+        backend.close()
+        self.assertFalse(os.path.exists(control_dir))
+        self.assertEqual(backend.control_dir, None)
+        self.assertEqual(backend._task.info('ssh_options'), None)
+
+    def test_output_policy(self):
+        """Test the task keeps no output unless all of it is kept"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        # Run the command of the node locally, the node is set in NODE
+        ssh = os.path.join(tmpdir, 'ssh')
+        open(ssh, 'w').write('#!/bin/sh\n'
+                             'while [ $# -gt 2 ]; do shift; done\n'
+                             'NODE=$1 exec sh -c "$2"\n')
+        os.chmod(ssh, 0755)
+        backend = ClusterShellBackend()
+        self.addCleanup(backend.set_output, OUTPUT_ALL)
+        self.addCleanup(backend._task.set_info, 'ssh_path',
+                        backend._task.info('ssh_path'))
+        backend._task.set_info('ssh_path', ssh)
+        backend.set_output(OUTPUT_ERRORS)
+        distant = backend.shell('echo out; [ $NODE = foo1 ]',
+                                nodes='foo[1-2]')
+        local = backend.shell('echo ko; false')
+        backend.run()
+        self.assertEqual(backend._task._msgtree, None)
+        self.assertEqual(list(distant.iter_buffers()),
+                         [('out', NodeSet('foo2'))])
+        self.assertEqual(distant.node_retcode('foo1'), 0)
+        self.assertEqual(local_output(local), 'ko')
+
+class ResultWorkerTest(TestCase):
+    """Test the worker-like results container"""
+
+    def test_results(self):
+        """Test results are gathered by node"""
+        worker = ResultWorker('foo[1-3]')
+        worker._on_node_msgline('foo1', 'ok')
+        worker._on_node_msgline('foo2', 'ok')
+        worker._on_node_rc('foo1', 0)
+        worker._on_node_rc('foo2', 1)
+        worker._on_node_timeout('foo3')
+        self.assertEqual(worker.node_buffer('foo1'), 'ok')
+        self.assertEqual(worker.node_retcode('foo2'), 1)
+        self.assertEqual(list(worker.iter_buffers()),
+                         [('ok', NodeSet('foo[1-2]'))])
+        self.assertEqual([(rc, str(nds)) for rc, nds in worker.iter_retcodes()],
+                         [(0, 'foo1'), (1, 'foo2')])
+        self.assertEqual(worker.num_timeout(), 1)
+        self.assertEqual(list(worker.iter_keys_timeout()), ['foo3'])
+
+    def test_output_errors(self):
+        """Test only output of failing nodes is kept"""
+        worker = ResultWorker('foo[1-3]', output=OUTPUT_ERRORS)
+        for node in ('foo1', 'foo2', 'foo3'):
+            worker._on_node_msgline(node, 'out')
+        worker._on_node_rc('foo1', 0)
+        worker._on_node_rc('foo2', 1)
+        worker._on_node_timeout('foo3')
+        self.assertEqual(list(worker.iter_buffers()),
+                         [('out', NodeSet('foo[2-3]'))])
+
+    def test_output_none(self):
+        """Test no output is kept"""
+        worker = ResultWorker('foo1', output=OUTPUT_NONE)
+        worker._on_node_msgline('foo1', 'out')
+        worker._on_node_rc('foo1', 1)
+        self.assertEqual(list(worker.iter_buffers()), [])
+        self.assertEqual(worker.node_retcode('foo1'), 1)
+
+class FakeClusterBackendTest(TestCase):
+    """Test actions run with the fake cluster backend"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def run_action(self, action, **options):
+        """Run action within a service, using a fake backend"""
+        action_manager_self().backend = FakeClusterBackend(**options)
+        service = Service('TEST')
+        service.add_action(action)
+        service.run(action.name)
+        return action
+
+    def test_run_on_virtual_nodes(self):
+        """Test command is run once per virtual node"""
+        action = self.run_action(Action('start', target='foo[1-10]',
+                                        command='echo ok'))
+        self.assertEqual(action.status, DONE)
+        self.assertEqual(list(action.worker.iter_buffers()),
+                         [('ok', NodeSet('foo[1-10]'))])
+
+    def test_connection_failures(self):
+        """Test nodes failing to connect return 255"""
+        action = self.run_action(Action('start', target='foo[1-4]',
+                                        command='true'),
+                                 nodes={'foo[1-2]': {'failure_rate': 1.0}})
+        self.assertEqual(action.status, ERROR)
+        self.assertEqual(action.nb_errors(), 2)
+        self.assertEqual(action.worker.node_retcode('foo1'), 255)
+        self.assertEqual(action.worker.node_retcode('foo3'), 0)
+
+    def test_latency_and_pool(self):
+        """Test latency is applied and the pool bounds parallelism"""
+        start = time.time()
+        action = self.run_action(Action('start', target='foo[1-4]',
+                                        command='sleep 0.2'),
+                                 pool=2, latency=0.1)
+        self.assertEqual(action.status, DONE)
+        # 0.1s of latency then two rounds of 0.2s
+        self.assertTrue(0.45 < time.time() - start < 1.0)
+
+    def test_timeout(self):
+        """Test virtual nodes timeout"""
+        action = self.run_action(Action('start', target='foo[1-2]',
+                                        command='sleep 1', timeout=0.2))
+        self.assertEqual(action.status, TIMEOUT)
+        self.assertEqual(action.nb_timeout(), 2)
+
+    def test_output_policy(self):
+        """Test output of successful nodes is dropped"""
+        backend = NodeLimitedBackend(FakeClusterBackend(), 1)
+        backend.set_output(OUTPUT_ERRORS)
+        action_manager_self().backend = backend
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-2]',
+                               command='echo out; false'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo[1-2]', command='echo out'))
+        svc2.add_dep(svc1, sgth=REQUIRE_WEAK)
+        svc2.run('start')
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(list(svc1._actions['start'].worker.iter_buffers()),
+                         [('out', NodeSet('foo[1-2]'))])
+        self.assertEqual(svc2.status, DONE)
+        self.assertEqual(list(svc2._actions['start'].worker.iter_buffers()), [])
+
+    def test_local_action(self):
+        """Test local actions are run as is"""
+        action = self.run_action(Action('start', target='foo[1-2]',
+                                        command='true'))
+        action.mode = 'delegate'
+        action.reset()
+        action.parent.reset()
+        action.parent.run('start')
+        self.assertEqual(action.status, DONE)
+
+class NodeLimitedBackendTest(TestCase):
+    """Test the number of commands per node is limited"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def test_commands_queued_per_node(self):
+        """Test commands beyond the limit wait for a free slot"""
+        limiter = NodeLimitedBackend(FakeClusterBackend(), 1)
+        action_manager_self().backend = limiter
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-2]', command='sleep 0.2'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo[2-3]', command='sleep 0.2'))
+        group = Service('G')
+        group.add_action(Action('start', command=':'))
+        group.add_dep(svc1)
+        group.add_dep(svc2)
+        start = time.time()
+        group.run('start')
+        # foo2 ran both commands one after the other
+        self.assertTrue(0.4 < time.time() - start < 0.8)
+        self.assertEqual(group.status, DONE)
+        self.assertEqual(svc2._actions['start'].worker.node_retcode('foo2'), 0)
+        self.assertEqual(limiter.running_on('foo2'), 0)
+
+    def test_limit_per_node(self):
+        """Test limit greater than one lets commands run together"""
+        action_manager_self().backend = NodeLimitedBackend(
+                                            FakeClusterBackend(), 2)
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo1', command='sleep 0.2'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo1', command='sleep 0.2'))
+        group = Service('G')
+        group.add_action(Action('start', command=':'))
+        group.add_dep(svc1)
+        group.add_dep(svc2)
+        start = time.time()
+        group.run('start')
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(group.status, DONE)
+
+    def test_aborted_worker_skipped(self):
+        """Test slots freed on a node go to workers still waiting for it"""
+        limiter = NodeLimitedBackend(FakeClusterBackend(), 1)
+        action_manager_self().backend = limiter
+        first = limiter.shell('sleep 0.1', nodes='foo[1-2]')
+        aborted = limiter.shell('true', nodes='foo1')
+        last = limiter.shell('true', nodes='foo[1-3]')
+        self.assertEqual(str(last.pending), 'foo[1-2]')
+        aborted.abort()
+        limiter.run()
+        self.assertEqual(list(aborted.iter_retcodes()), [])
+        self.assertEqual(first.node_retcode('foo1'), 0)
+        self.assertEqual([(rc, str(nds)) for rc, nds in last.iter_retcodes()],
+                         [(0, 'foo[1-3]')])
+        self.assertEqual(limiter.running_on('foo1'), 0)
+
+    def test_aborted_running_command(self):
+        """Test slots of an aborted command are given back"""
+        limiter = NodeLimitedBackend(FakeClusterBackend(), 1)
+        action_manager_self().backend = limiter
+        running = limiter.shell('sleep 2', nodes='foo1')
+        waiting = limiter.shell('true', nodes='foo1')
+        self.assertEqual(str(waiting.pending), 'foo1')
+        running.abort()
+        self.assertEqual(str(waiting.pending), '')
+        start = time.time()
+        limiter.run()
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(waiting.node_retcode('foo1'), 0)
+        self.assertEqual(limiter.running_on('foo1'), 0)
@@ -0,0 +1,202 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the batched execution
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import DONE, ERROR, TIMEOUT, DEP_ERROR, \
+                                        REQUIRE_WEAK
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.ServiceGroup import ServiceGroup
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Engine.Batch import BatchRun
+from MilkCheck.ServiceManager import ServiceManager, service_manager_self
+
+class CountingBackend(FakeClusterBackend):
+    """Fake backend counting distant commands"""
+
+    def __init__(self, **options):
+        FakeClusterBackend.__init__(self, **options)
+        self.commands = []
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        if nodes:
+            self.commands.append((command, NodeSet(nodes)))
+        return FakeClusterBackend.shell(self, command, nodes, timeout, handler)
+
+class BatchTest(TestCase):
+    """Test actions run by batch scripts"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        ServiceManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+        ServiceManager._instance = None
+
+    def _run(self, services, **options):
+        """Run start on all services within batch scripts"""
+        backend = CountingBackend(**options)
+        action_manager_self().backend = backend
+        manager = service_manager_self()
+        manager.register_services(*services)
+        manager.call_services(None, 'start',
+                              conf={'reverse_actions': [], 'batch': True})
+        return backend
+
+    def _service(self, name, target='foo[1-2]', command=None, **props):
+        """Return a service with a start action"""
+        svc = Service(name)
+        action = Action('start', target=target,
+                        command=command or 'echo %s' % name)
+        for prop, value in props.items():
+            setattr(action, prop, value)
+        svc.add_action(action)
+        return svc
+
+    def test_chain(self):
+        """Test a chain of services is run with one command per node"""
+        svc1 = self._service('S1')
+        svc2 = self._service('S2')
+        svc2.add_dep(svc1, sgth=REQUIRE_WEAK)
+        backend = self._run([svc1, svc2])
+        self.assertEqual(len(backend.commands), 1)
+        self.assertEqual(svc1.status, DONE)
+        self.assertEqual(svc2.status, DONE)
+        self.assertEqual(list(svc2._actions['start'].worker.iter_buffers()),
+                         [('S2', NodeSet('foo[1-2]'))])
+
+    def test_slices(self):
+        """Test nodes running the same actions share a command"""
+        svc1 = self._service('S1', target='foo[1-4]')
+        svc2 = self._service('S2', target='foo[3-4]')
+        svc3 = self._service('S3', target='foo[3-4]')
+        svc3.add_dep(svc2, sgth=REQUIRE_WEAK)
+        backend = self._run([svc1, svc2, svc3])
+        self.assertEqual(sorted(str(nodes) for cmd, nodes in backend.commands),
+                         ['foo[1-2]', 'foo[3-4]'])
+        self.assertEqual(svc3.status, DONE)
+
+    def test_dependency_across_nodes(self):
+        """Test actions requiring actions of other nodes are not batched"""
+        svc1 = self._service('S1', target='foo1', command='sleep 0.2; false')
+        svc2 = self._service('S2', target='foo2')
+        svc2.add_dep(svc1)
+        backend = self._run([svc1, svc2])
+        self.assertEqual(len(backend.commands), 1)
+        self.assertEqual(backend.commands[0][1], NodeSet('foo1'))
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(svc2.status, DEP_ERROR)
+        self.assertEqual(svc2._actions['start'].worker, None)
+
+    def test_failure(self):
+        """Test errors of batched actions"""
+        svc1 = self._service('S1', command='false')
+        svc2 = self._service('S2')
+        svc2.add_dep(svc1, sgth=REQUIRE_WEAK)
+        self._run([svc1, svc2])
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(svc2.status, DONE)
+
+    def test_strong_dependency(self):
+        """Test actions strongly depending on others are not batched"""
+        svc1 = self._service('S1', command='mkdir %s' % self._lock())
+        svc2 = self._service('S2')
+        svc2.add_dep(svc1)
+        backend = self._run([svc1, svc2])
+        # S1 failed on one node only, S2 did not run at all
+        self.assertEqual(svc1._actions['start'].nb_errors(), 1)
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(svc2.status, DEP_ERROR)
+        self.assertEqual(len(backend.commands), 1)
+        self.assertEqual(svc2._actions['start'].worker, None)
+
+    def _lock(self):
+        """Return a path which can be created once, removed at cleanup"""
+        path = os.path.join(tempfile.mkdtemp(), 'lock')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        return path
+
+    def test_timeout(self):
+        """Test timeout of batched actions"""
+        svc1 = self._service('S1', command='sleep 1', timeout=0.2)
+        self._run([svc1])
+        self.assertEqual(svc1.status, TIMEOUT)
+        self.assertEqual(svc1._actions['start'].nb_timeout(), 2)
+
+    def test_unreachable_fallback(self):
+        """Test actions of unreachable nodes are run the usual way"""
+        svc1 = self._service('S1')
+        svc2 = self._service('S2')
+        svc2.add_dep(svc1)
+        backend = self._run([svc1, svc2],
+                            nodes={'foo1': {'failure_rate': 1.0}})
+        self.assertEqual(svc1.status, ERROR)
+        self.assertEqual(svc2.status, DEP_ERROR)
+        # Batch script then S1 on foo1
+        self.assertEqual(len(backend.commands), 2)
+        self.assertEqual(backend.commands[1], ('echo S1', NodeSet('foo1')))
+        worker = svc1._actions['start'].worker
+        self.assertEqual(worker.node_retcode('foo1'), 255)
+        self.assertEqual(worker.node_retcode('foo2'), 0)
+
+    def test_not_batchable(self):
+        """Test actions depending on a not batchable one are not batched"""
+        svc1 = self._service('S1')
+        svc2 = self._service('S2', delay=0.1)
+        svc3 = self._service('S3')
+        svc4 = self._service('S4')
+        svc2.add_dep(svc1)
+        svc3.add_dep(svc2)
+        svc4.add_dep(svc1, sgth=REQUIRE_WEAK)
+        backend = self._run([svc1, svc2, svc3, svc4])
+        for svc in (svc1, svc2, svc3, svc4):
+            self.assertEqual(svc.status, DONE)
+        self.assertEqual(len(backend.commands), 3)
+        self.assertEqual(backend.commands[1:],
+                         [('echo S2', NodeSet('foo[1-2]')),
+                          ('echo S3', NodeSet('foo[1-2]'))])
+
+    def test_plan_group(self):
+        """Test planning of actions within a group"""
+        svc1 = self._service('S1')
+        group = ServiceGroup('G')
+        sub1 = self._service('A')
+        sub2 = self._service('B')
+        group.add_inter_dep(target=sub1)
+        group.add_inter_dep(target=sub2, base=sub1, sgth=REQUIRE_WEAK)
+        group.add_dep(svc1, sgth=REQUIRE_WEAK)
+        svc2 = self._service('S2')
+        svc2.add_dep(group, sgth=REQUIRE_WEAK)
+        source = Service('root')
+        source.simulate = True
+        source.add_dep(svc2)
+        batch = BatchRun(source, 'start')
+        actions = [action.parent.name for action in batch.actions]
+        self.assertEqual(actions, ['S1', 'B', 'A', 'S2'])
+        runs = [line.split()[1] for line in batch.script(range(4)).splitlines()
+                if line.startswith('mc_run ')]
+        self.assertEqual(runs, ['0', '1', '2', '3'])
+
+    def test_plan_strong(self):
+        """Test actions strongly depending on others are left out"""
+        svc1 = self._service('S1')
+        svc2 = self._service('S2')
+        svc3 = self._service('S3')
+        svc2.add_dep(svc1)
+        svc3.add_dep(svc2, sgth=REQUIRE_WEAK)
+        source = Service('root')
+        source.simulate = True
+        source.add_dep(svc3)
+        batch = BatchRun(source, 'start')
+        self.assertEqual([action.parent.name for action in batch.actions],
+                         ['S1'])
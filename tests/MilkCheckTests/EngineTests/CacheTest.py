@@ -0,0 +1,150 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the results cache
+"""
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import DONE
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Engine.Cache import ResultCache
+
+class CountingBackend(FakeClusterBackend):
+    """Fake backend counting the nodes which ran a command"""
+
+    def __init__(self, **options):
+        FakeClusterBackend.__init__(self, **options)
+        self.nodes = NodeSet()
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        if nodes:
+            self.nodes.add(nodes)
+        return FakeClusterBackend.shell(self, command, nodes, timeout, handler)
+
+class ResultCacheTest(TestCase):
+    """Test results are kept between runs"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup(self):
+        """Test lookup returns cached nodes and missing ones"""
+        cache = ResultCache(self.path, 60)
+        cache.store('key', 'foo1', 0, ['ok'])
+        found, missing = cache.lookup('key', NodeSet('foo[1-2]'))
+        self.assertEqual(found, {'foo1': (0, ['ok'])})
+        self.assertEqual(missing, NodeSet('foo2'))
+
+    def test_save_and_load(self):
+        """Test results are read back from the cache file"""
+        cache = ResultCache(self.path, 60)
+        cache.store('key', 'foo1', 1, ['ko'])
+        cache.save()
+        found, missing = ResultCache(self.path, 60).lookup('key', 'foo1')
+        self.assertEqual(found, {'foo1': (1, ['ko'])})
+
+    def test_expired(self):
+        """Test expired results are ignored"""
+        cache = ResultCache(self.path, 0.1)
+        cache.store('key', 'foo1', 0, [])
+        cache.save()
+        time.sleep(0.2)
+        self.assertEqual(cache.lookup('key', 'foo1'), ({}, NodeSet('foo1')))
+        self.assertEqual(ResultCache(self.path, 0.1)._entries, {})
+
+    def test_bad_file(self):
+        """Test an unreadable cache file is ignored"""
+        os.mkdir(os.path.dirname(self.path))
+        open(self.path, 'w').write('{bad')
+        self.assertEqual(ResultCache(self.path, 60)._entries, {})
+
+    def test_concurrent_saves(self):
+        """Test results saved by another run are kept"""
+        first = ResultCache(self.path, 60)
+        second = ResultCache(self.path, 60)
+        first.store('key1', 'foo1', 0, [])
+        first.save()
+        second.store('key2', 'foo1', 0, [])
+        second.save()
+        cache = ResultCache(self.path, 60)
+        self.assertEqual(sorted(cache._entries), ['key1', 'key2'])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))),
+                         ['cache', 'cache.lock'])
+
+    def test_invalidate(self):
+        """Test results of a service are dropped on some nodes"""
+        first = ResultCache(self.path, 60)
+        first.store('S:status:cmd', 'foo1', 0, [])
+        first.store('S:status:cmd', 'foo2', 0, [])
+        first.store('T:status:cmd', 'foo1', 0, [])
+        first.save()
+        second = ResultCache(self.path, 60)
+        second.invalidate(Service('S'), 'foo1')
+        self.assertEqual(second.lookup('S:status:cmd', 'foo[1-2]')[1],
+                         NodeSet('foo1'))
+        second.save()
+        cache = ResultCache(self.path, 60)
+        self.assertEqual(cache.lookup('S:status:cmd', 'foo[1-2]')[1],
+                         NodeSet('foo1'))
+        self.assertEqual(cache.lookup('T:status:cmd', 'foo1')[1], NodeSet())
+
+class CachedActionTest(TestCase):
+    """Test idempotent actions reuse cached results"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        self.tmpdir = tempfile.mkdtemp()
+        action_manager_self().enable_cache(os.path.join(self.tmpdir, 'cache'),
+                                           60)
+
+    def tearDown(self):
+        ActionManager._instance = None
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, target):
+        """Run the idempotent status action on target"""
+        backend = CountingBackend()
+        action_manager_self().backend = backend
+        service = Service('S')
+        action = Action('status', target=target, command='echo ok')
+        action.idempotent = True
+        service.add_action(action)
+        service.run('status')
+        return action, backend.nodes
+
+    def test_cached_nodes(self):
+        """Test only nodes without results run the action"""
+        action, nodes = self._run('foo[1-2]')
+        self.assertEqual(nodes, NodeSet('foo[1-2]'))
+        action, nodes = self._run('foo[1-3]')
+        self.assertEqual(nodes, NodeSet('foo3'))
+        self.assertEqual(action.status, DONE)
+        self.assertEqual(list(action.worker.iter_buffers()),
+                         [('ok', NodeSet('foo[1-3]'))])
+        action, nodes = self._run('foo[1-3]')
+        self.assertEqual(nodes, NodeSet())
+        self.assertEqual(action.status, DONE)
+
+    def test_changed_nodes(self):
+        """Test other actions of the service drop its cached results"""
+        self._run('foo[1-3]')
+        backend = CountingBackend()
+        action_manager_self().backend = backend
+        service = Service('S')
+        service.add_action(Action('start', target='foo2', command='true'))
+        service.run('start')
+        action, nodes = self._run('foo[1-3]')
+        self.assertEqual(nodes, NodeSet('foo2'))
@@ -0,0 +1,92 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the adaptive fanout
+"""
+
+from unittest import TestCase
+
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend, ResultWorker
+from MilkCheck.Engine.Fanout import AdaptiveFanout
+
+class AdaptiveFanoutTest(TestCase):
+    """Test the AIMD fanout computation"""
+
+    def test_initial_value(self):
+        """Test initial value is bounded"""
+        self.assertEqual(AdaptiveFanout(2, 8, 64).value, 8)
+        self.assertEqual(AdaptiveFanout(2, 8, 1).value, 2)
+        self.assertEqual(AdaptiveFanout(2, 8).value, 8)
+
+    def test_additive_increase(self):
+        """Test fanout grows by one after a full window of successes"""
+        fanout = AdaptiveFanout(1, 10, 4)
+        for _ in range(3):
+            fanout.success()
+        self.assertEqual(fanout.value, 4)
+        fanout.success()
+        self.assertEqual(fanout.value, 5)
+
+    def test_multiplicative_decrease(self):
+        """Test fanout is halved once per window on failures"""
+        fanout = AdaptiveFanout(1, 64, 32)
+        fanout.failure()
+        self.assertEqual(fanout.value, 16)
+        fanout.failure()
+        self.assertEqual(fanout.value, 16)
+        for _ in range(16):
+            fanout.success()
+        fanout.failure()
+        self.assertEqual(fanout.value, 8)
+
+    def test_minimum(self):
+        """Test fanout does not go below minimum"""
+        fanout = AdaptiveFanout(3, 64, 4)
+        fanout.failure()
+        self.assertEqual(fanout.value, 3)
+
+class ActionManagerAdaptiveTest(TestCase):
+    """Test adaptive fanout within the ActionManager"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def test_unreachable_nodes(self):
+        """Test unreachable nodes decrease the fanout"""
+        manager = action_manager_self()
+        manager.backend = FakeClusterBackend(failure_rate=1.0)
+        manager.enable_adaptive_fanout(2, 32)
+        self.assertEqual(manager.adaptive_fanout.value, 32)
+        self.assertEqual(manager.default_fanout, 32)
+        service = Service('TEST')
+        service.add_action(Action('start', target='foo[1-5]', command=':'))
+        service.run('start')
+        self.assertEqual(manager.adaptive_fanout.value, 16)
+
+    def test_replayed_results(self):
+        """Test results which did not come from a command are ignored"""
+        manager = action_manager_self()
+        manager.enable_adaptive_fanout(1, 32)
+        worker = ResultWorker('foo[1-2]')
+        worker.replayed.add('foo1')
+        worker._on_node_rc('foo1', 0)
+        manager.node_done(worker)
+        self.assertEqual(manager.adaptive_fanout._successes, 0)
+        worker._on_node_rc('foo2', 0)
+        manager.node_done(worker)
+        self.assertEqual(manager.adaptive_fanout._successes, 1)
+
+    def test_explicit_fanout(self):
+        """Test explicit fanout still limits the computed value"""
+        manager = action_manager_self()
+        manager.enable_adaptive_fanout(1, 32)
+        action = Action('start', target='foo1', command=':')
+        action.fanout = 4
+        manager.add_task(action)
+        self.assertEqual(manager.backend._task.info('fanout'), 4)
+        manager.remove_task(action)
@@ -0,0 +1,137 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the run journal
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import DONE, ERROR, DEP_ERROR
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Engine.Journal import JournalError, read_journal, \
+                                     write_results, read_failures
+
+class CountingBackend(FakeClusterBackend):
+    """Fake backend counting the nodes which ran a command"""
+
+    def __init__(self, **options):
+        FakeClusterBackend.__init__(self, **options)
+        self.nodes = NodeSet()
+
+    def shell(self, command, nodes=None, timeout=None, handler=None):
+        if nodes:
+            self.nodes.add(nodes)
+        return FakeClusterBackend.shell(self, command, nodes, timeout, handler)
+
+class RunJournalTest(TestCase):
+    """Test completed actions are journaled and resumed"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal')
+
+    def tearDown(self):
+        ActionManager._instance = None
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, resume=False, **options):
+        """Run S1 then S2 and record them in the journal"""
+        ActionManager._instance = None
+        manager = action_manager_self()
+        manager.backend = CountingBackend(**options)
+        if resume:
+            manager.resume(self.path)
+        manager.enable_journal(self.path)
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-3]', command='true'))
+        svc2 = Service('S2')
+        local = Action('start', command='true')
+        local.mode = 'delegate'
+        svc2.add_action(local)
+        svc1.add_dep(svc2)
+        svc1.run('start')
+        manager.close()
+        return svc1, svc2, manager.backend.nodes
+
+    def test_record(self):
+        """Test actions are recorded with their results"""
+        self._run(nodes={'foo2': {'failure_rate': 1.0}})
+        results = read_journal(self.path)
+        self.assertEqual(results['S2.start'], (DONE, {}))
+        self.assertEqual(results['S1.start'],
+                         (ERROR, {'foo1': 0, 'foo2': 255, 'foo3': 0}))
+
+    def test_incomplete_line(self):
+        """Test an interrupted record is ignored"""
+        self._run()
+        open(self.path, 'a').write('{"action": "S3.st')
+        self.assertEqual(sorted(read_journal(self.path)),
+                         ['S1.start', 'S2.start'])
+
+    def test_resume(self):
+        """Test only nodes which did not succeed run again"""
+        self._run(nodes={'foo2': {'failure_rate': 1.0}})
+        svc1, svc2, nodes = self._run(resume=True)
+        self.assertEqual(nodes, NodeSet('foo2'))
+        self.assertEqual(svc1.status, DONE)
+        self.assertEqual(svc2.status, DONE)
+        # The new results are journaled
+        self.assertEqual(read_journal(self.path)['S1.start'][0], DONE)
+
+    def test_missing_journal(self):
+        """Test resuming a missing journal raises JournalError"""
+        self.assertRaises(JournalError, action_manager_self().resume,
+                          self.path)
+
+class ResultsTest(TestCase):
+    """Test results of a run are written and their failures read"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'results')
+
+    def tearDown(self):
+        ActionManager._instance = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_failures(self):
+        """Test failing services are read with their failing nodes"""
+        action_manager_self().backend = FakeClusterBackend(
+                                    nodes={'foo2': {'failure_rate': 1.0}})
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-3]', command='true'))
+        svc1.add_action(Action('stop', target='foo[1-3]', command='true'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo[4-5]', command='true'))
+        svc3 = Service('S3')
+        svc3.add_action(Action('start', target='foo6', command='true'))
+        svc2.add_dep(svc1)
+        svc3.add_dep(svc2)
+        svc3.run('start')
+        self.assertEqual(svc2.status, DEP_ERROR)
+        write_results(self.path, [svc1, svc2, svc3], 'start')
+        self.assertEqual(read_failures(self.path),
+                         {'S1': NodeSet('foo2'), 'S2': NodeSet('foo[4-5]'),
+                          'S3': NodeSet('foo6')})
+
+    def test_local_failure(self):
+        """Test local failures are not bound to nodes"""
+        svc = Service('S1')
+        svc.add_action(Action('start', command='false'))
+        svc.run('start')
+        write_results(self.path, [svc], 'start')
+        self.assertEqual(read_failures(self.path), {'S1': None})
+
+    def test_bad_results(self):
+        """Test an invalid result file raises JournalError"""
+        open(self.path, 'w').write('{"S1.start": ')
+        self.assertRaises(JournalError, read_failures, self.path)
@@ -0,0 +1,98 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the output store
+"""
+
+import os
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.BaseEntity import DONE
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend, ResultWorker
+from MilkCheck.Engine.Output import OutputStore, StoredWorker
+
+def result_worker(outputs):
+    """Return a finished ResultWorker holding outputs of each node"""
+    worker = ResultWorker(NodeSet.fromlist(outputs.keys()))
+    for node, lines in outputs.items():
+        for line in lines:
+            worker._on_node_msgline(node, line)
+        worker._on_node_rc(node, 0)
+    return worker
+
+class OutputStoreTest(TestCase):
+    """Test output is kept within limits"""
+
+    def test_truncate_lines(self):
+        """Test output is truncated to max_lines"""
+        store = OutputStore(max_lines=2)
+        self.assertEqual(store.truncate('a\nb'), 'a\nb')
+        self.assertEqual(store.truncate('a\nb\nc\nd'), 'a\nb\n[2 more lines]')
+
+    def test_truncate_bytes(self):
+        """Test output is truncated to max_bytes"""
+        store = OutputStore(max_bytes=4)
+        self.assertEqual(store.truncate('abcdef'), 'abcd\n[2 more bytes]')
+
+    def test_keep_in_memory(self):
+        """Test output within budget is kept in memory"""
+        store = OutputStore(budget=100)
+        worker = result_worker({'foo1': ['ok'], 'foo2': ['ok'],
+                                'foo3': ['ko']})
+        stored = store.keep(worker, 'S1.start')
+        self.assertTrue(isinstance(stored, StoredWorker))
+        self.assertEqual(stored.spool, None)
+        self.assertEqual(store.used, 4)
+        self.assertEqual(list(worker.iter_buffers()), [])
+        self.assertEqual(stored.node_buffer('foo3'), 'ko')
+        self.assertEqual(sorted((buf, str(nodes))
+                                for buf, nodes in stored.iter_buffers()),
+                         [('ko', 'foo3'), ('ok', 'foo[1-2]')])
+        self.assertEqual(stored.node_retcode('foo1'), 0)
+
+    def test_spool(self):
+        """Test output beyond the budgets is spooled and read back"""
+        store = OutputStore(budget=8, action_budget=6)
+        stored1 = store.keep(result_worker({'foo1': ['abcd']}), 'S1.start')
+        stored2 = store.keep(result_worker({'foo1': ['1234567']}), 'S2.start')
+        stored3 = store.keep(result_worker({'foo1': ['abc'], 'foo2': ['de']}),
+                             'S3.start')
+        self.assertEqual(stored1.spool, None)
+        self.assertTrue(os.path.isfile(stored2.spool))
+        self.assertTrue(os.path.isfile(stored3.spool))
+        self.assertEqual((store.used, store.spooled), (4, 12))
+        self.assertEqual(stored2.node_buffer('foo1'), '1234567')
+        self.assertEqual(dict(stored3.iter_node_buffers()),
+                         {'foo1': 'abc', 'foo2': 'de'})
+        spool_dir = store.spool_dir
+        store.close()
+        self.assertFalse(os.path.exists(spool_dir))
+
+class ActionOutputTest(TestCase):
+    """Test actions keep their output within the output store"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        action_manager_self().close()
+        ActionManager._instance = None
+
+    def test_action_output(self):
+        """Test output of an action is truncated and spooled"""
+        manager = action_manager_self()
+        manager.backend = FakeClusterBackend()
+        manager.enable_output_store(action_budget=1, max_lines=1)
+        service = Service('TEST')
+        action = Action('start', target='foo[1-3]', command='echo a; echo b')
+        service.add_action(action)
+        service.run('start')
+        self.assertEqual(action.status, DONE)
+        self.assertTrue(isinstance(action.worker, StoredWorker))
+        self.assertTrue(action.worker.spool)
+        self.assertEqual(list(action.worker.iter_buffers()),
+                         [('a\n[1 more lines]', NodeSet('foo[1-3]'))])
@@ -0,0 +1,170 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the run statistics
+"""
+
+import time
+from unittest import TestCase
+
+from ClusterShell.NodeSet import NodeSet
+
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Engine.Timing import RunStatistics, NodeTimings, \
+                                    CriticalPath, PhaseTimers
+from MilkCheck.Callback import CallbackHandler, call_back_self
+
+class RunStatisticsTest(TestCase):
+    """Test timings gathered from completed actions"""
+
+    def _action(self, service, name, start, stop, target=None, tries=1,
+                delay=0):
+        """Return a completed action"""
+        action = Action(name, target=target, delay=delay)
+        Service(service).add_action(action)
+        action.start_time = start
+        action.stop_time = stop
+        action.tries = tries
+        return action
+
+    def test_statistics(self):
+        """Test wall time, commands and retries"""
+        stats = RunStatistics(slowest=2)
+        stats.add(self._action('S1', 'start', 10, 11, 'foo[1-4]'))
+        stats.add(self._action('S2', 'start', 10.5, 14, tries=2, delay=1))
+        stats.add(self._action('S3', 'start', 11, 13))
+        stats.add(Action('stop'))
+        self.assertEqual(stats.actions, 3)
+        self.assertEqual(stats.wall_time, 4)
+        self.assertEqual(stats.commands, 7)
+        self.assertEqual(stats.rate, 1.75)
+        self.assertEqual(stats.retries, 1)
+        self.assertEqual(stats.delayed, 2)
+        self.assertEqual(stats.slowest(), [(3.5, 'S2.start'), (2, 'S3.start')])
+
+    def test_percentiles(self):
+        """Test duration percentiles by action name"""
+        stats = RunStatistics()
+        for index in range(1, 11):
+            stats.add(self._action('S%d' % index, 'start', 1, 1 + index))
+        stats.add(self._action('S1', 'stop', 1, 6))
+        self.assertEqual(stats.percentiles('start', (50, 90, 99, 100)),
+                         [5, 9, 10, 10])
+        self.assertEqual(stats.percentiles('stop'), [5, 5, 5])
+
+class NodeTimingsTest(TestCase):
+    """Test completion times of the nodes"""
+
+    def setUp(self):
+        ActionManager._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+
+    def test_outliers(self):
+        """Test nodes slow in most of their actions are reported"""
+        timings = NodeTimings()
+        timings.add({'foo1': 0.1, 'foo2': 0.1, 'foo3': 0.1, 'foo4': 1.0})
+        timings.add({'foo1': 0.2, 'foo2': 0.2, 'foo3': 0.5, 'foo4': 1.5})
+        timings.add({'foo1': 0.2, 'foo4': 0.2})
+        self.assertEqual(timings.consistent_outliers(), NodeSet('foo4'))
+        self.assertEqual([(round(mean, 2), str(nodes)) for mean, nodes
+                          in timings.slowest(3)],
+                         [(0.9, 'foo4'), (0.3, 'foo3'), (0.17, 'foo1')])
+
+    def test_fold_slowest(self):
+        """Test nodes of the same mean are folded"""
+        timings = NodeTimings()
+        timings.add({'foo1': 0.5, 'foo2': 0.5, 'foo3': 0.1})
+        self.assertEqual([str(nodes) for mean, nodes in timings.slowest()],
+                         ['foo[1-2]', 'foo3'])
+
+    def test_run(self):
+        """Test completion times are recorded while actions run"""
+        manager = action_manager_self()
+        manager.backend = FakeClusterBackend(nodes={'foo2': {'latency': 0.3}})
+        manager.enable_node_timings()
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-4]', command='true'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', target='foo[1-4]', command='true'))
+        svc2.add_dep(svc1)
+        svc2.run('start')
+        self.assertEqual(manager.node_timings.count['foo1'], 2)
+        self.assertEqual(manager.node_timings.consistent_outliers(),
+                         NodeSet('foo2'))
+
+class CriticalPathTest(TestCase):
+    """Test the chain of actions the run waited for"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+
+    def _service(self, name, command):
+        """Return a service with a start action"""
+        service = Service(name)
+        service.add_action(Action('start', target='foo[1-2]',
+                                  command=command))
+        return service
+
+    def test_segments(self):
+        """Test the slowest dependency is on the critical path"""
+        action_manager_self().backend = FakeClusterBackend()
+        path = CriticalPath()
+        call_back_self().attach(path)
+        svc1 = self._service('S1', 'sleep 0.3')
+        svc2 = self._service('S2', 'true')
+        svc3 = self._service('S3', 'sleep 0.1')
+        svc3.add_dep(svc1)
+        svc3.add_dep(svc2)
+        svc3.run('start')
+        segments = path.segments()
+        self.assertEqual([action.fullname() for action, waited, ran
+                          in segments], ['S1.start', 'S3.start'])
+        self.assertTrue(0.3 <= segments[0][2] < 0.5)
+        self.assertTrue(segments[1][1] < 0.1)
+
+class PhaseTimersTest(TestCase):
+    """Test the time spent in each phase"""
+
+    def test_disabled(self):
+        """Test nothing is recorded until timers are enabled"""
+        timers = PhaseTimers()
+        timers.start('run')
+        timers.stop('run')
+        self.assertEqual(timers.breakdown(), [])
+
+    def test_nested_phases(self):
+        """Test nested phases are not counted in the enclosing one"""
+        timers = PhaseTimers()
+        timers.reset()
+        timers.start('run')
+        for _ in range(2):
+            timers.start('output')
+            time.sleep(0.1)
+            timers.stop('output')
+        timers.stop('run')
+        (name, duration, calls), run = timers.breakdown()
+        self.assertEqual((name, calls), ('output', 2))
+        self.assertTrue(0.2 <= duration < 0.3)
+        self.assertEqual(run[0], 'run')
+        self.assertTrue(run[1] < 0.05)
+        self.assertEqual(timers.total, duration + run[1])
+
+    def test_unbalanced_stop(self):
+        """Test leaving a phase which is not running is ignored"""
+        timers = PhaseTimers()
+        timers.reset()
+        timers.stop('run')
+        timers.start('run')
+        timers.stop('output')
+        timers.stop('run')
+        self.assertEqual([name for name, duration, calls
+                          in timers.breakdown()], ['run'])
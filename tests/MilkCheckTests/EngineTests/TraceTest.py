@@ -0,0 +1,90 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the execution trace
+"""
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Callback import CallbackHandler, call_back_self, \
+                               EV_STARTED, EV_COMPLETE, EV_DELAYED
+
+class TraceRecorderTest(TestCase):
+    """Test the timeline recorded from a run"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+        self.path = tempfile.mktemp(prefix='mc-trace-')
+
+    def tearDown(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _run(self, action, nodes=False):
+        """Run action with a trace and return the written events"""
+        manager = action_manager_self()
+        manager.backend = FakeClusterBackend()
+        tracer = manager.enable_trace(self.path, nodes)
+        call_back_self().attach(tracer,
+                                events=(EV_STARTED, EV_COMPLETE, EV_DELAYED),
+                                types=(Action,))
+        service = Service('S1')
+        service.add_action(action)
+        service.run(action.name)
+        manager.close()
+        return json.load(open(self.path))['traceEvents']
+
+    def _spans(self, events, cat):
+        """Return the names of the spans of the category cat"""
+        return [event['name'] for event in events
+                if event['ph'] == 'X' and event['cat'] == cat]
+
+    def test_action_spans(self):
+        """Test spans of an action and of its nodes"""
+        events = self._run(Action('start', target='foo[1-2]',
+                                  command='true'), nodes=True)
+        self.assertEqual(self._spans(events, 'action'), ['S1.start'])
+        self.assertEqual(self._spans(events, 'node'), ['S1.start'] * 2)
+        self.assertEqual(self._spans(events, 'retry'), [])
+        tracks = [event['args']['name'] for event in events
+                  if event['name'] == 'thread_name']
+        self.assertEqual(sorted(tracks), ['S1', 'foo1', 'foo2'])
+
+    def test_delay_and_retries(self):
+        """Test delays and tries are split in spans"""
+        action = Action('start', target='foo1', command='false', delay=0.1)
+        action.maxretry = 1
+        events = self._run(action)
+        self.assertEqual(self._spans(events, 'delay'), ['delay', 'delay'])
+        self.assertEqual(self._spans(events, 'retry'), ['try 1', 'try 2'])
+        self.assertEqual(self._spans(events, 'node'), [])
+        delay = [event for event in events if event['name'] == 'delay'][0]
+        self.assertTrue(delay['dur'] >= 100000)
+
+    def test_counters(self):
+        """Test running tasks and fanout are recorded as counters"""
+        events = self._run(Action('start', target='foo1', command='true'))
+        counters = [(event['name'], event['args']) for event in events
+                    if event['ph'] == 'C']
+        self.assertEqual(counters, [('tasks', {'running': 1}),
+                                    ('fanout', {'fanout': 64}),
+                                    ('tasks', {'running': 0}),
+                                    ('fanout', {'fanout': 0})])
+
+    def test_unwritable_trace(self):
+        """Test a trace which cannot be written does not fail the run"""
+        self.path = '/nonexistent/trace'
+        tracer = action_manager_self().enable_trace(self.path)
+        tracer.begin('run')
+        tracer.end('run')
+        action_manager_self().close()
+        self.assertEqual(action_manager_self().tracer, None)
@@ -10,7 +10,8 @@ RunningTasksManager and the ServiceManager itself
 import time
 from unittest import TestCase
 from ClusterShell.NodeSet import NodeSet
-from MilkCheck.Engine.Action import Action
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Backend import FakeClusterBackend, NodeLimitedBackend
 from MilkCheck.Engine.Service import Service
 from MilkCheck.Engine.ServiceGroup import ServiceGroup
 from MilkCheck.ServiceManager import ServiceManager, service_manager_self
@@ -20,7 +21,7 @@ from MilkCheck.ServiceManager import VariableAlreadyExistError
 
 # Symbols
 from MilkCheck.Engine.BaseEntity import NO_STATUS, DONE, REQUIRE_WEAK
-from MilkCheck.Engine.BaseEntity import DEP_ERROR, ERROR, WARNING
+from MilkCheck.Engine.BaseEntity import DEP_ERROR, ERROR, WARNING, LOCKED
 
 class ServiceManagerTest(TestCase):
     '''Tests cases for the class ServiceManager'''
@@ -407,3 +408,82 @@ node [style=filled];
         conf = {'excluded_nodes': NodeSet()}
         manager._apply_config(conf)
         self.assertEqual(s1.target, localhost_ns)
+
+    def test_preflight(self):
+        '''Test _apply_config excludes nodes found unreachable'''
+        ActionManager._instance = None
+        action_manager_self().backend = FakeClusterBackend(
+                                   nodes={'foo[2,5]': {'failure_rate': 1.0}})
+        manager = service_manager_self()
+        s1 = Service('S1', target='foo[1-3]')
+        s1.add_action(Action('start', command=':'))
+        grp = ServiceGroup('G1')
+        s2 = Service('S2')
+        s2.add_action(Action('start', target='foo[4-5]', command=':'))
+        grp.add_inter_dep(target=s2)
+        manager.register_services(s1, grp)
+        manager._apply_config({'preflight': True, 'preflight_timeout': 1})
+        ActionManager._instance = None
+        self.assertEqual(manager.unreachable, NodeSet('foo[2,5]'))
+        self.assertEqual(s1.target, NodeSet('foo[1,3]'))
+        self.assertEqual(s2._actions['start'].target, NodeSet('foo4'))
+
+    def test_preflight_limited(self):
+        '''Test nodes are probed through a backend limiting commands'''
+        ActionManager._instance = None
+        action_manager_self().backend = NodeLimitedBackend(
+                                   FakeClusterBackend(
+                                   nodes={'foo2': {'failure_rate': 1.0}}), 1)
+        manager = service_manager_self()
+        s1 = Service('S1', target='foo[1-3]')
+        s1.add_action(Action('start', command=':'))
+        manager.register_services(s1)
+        manager._apply_config({'preflight': True, 'preflight_timeout': 1})
+        ActionManager._instance = None
+        self.assertEqual(manager.unreachable, NodeSet('foo2'))
+        self.assertEqual(s1.target, NodeSet('foo[1,3]'))
+
+    def test_preflight_delegate(self):
+        '''Test targets of delegated actions are not probed nor pruned'''
+        ActionManager._instance = None
+        action_manager_self().backend = FakeClusterBackend(
+                                   nodes={'foo[1-2]': {'failure_rate': 1.0}})
+        manager = service_manager_self()
+        s1 = Service('S1', target='foo[1-3]')
+        poweron = Action('start', command=':')
+        poweron.mode = 'delegate'
+        s1.add_actions(poweron, Action('status', command=':'))
+        s2 = Service('S2')
+        bmc = Action('start', target='foo4', command=':')
+        bmc.mode = 'delegate'
+        s2.add_action(bmc)
+        manager.register_services(s1, s2)
+        self.assertEqual(manager._all_targets(), NodeSet('foo[1-3]'))
+        manager._apply_config({'preflight': True, 'preflight_timeout': 1})
+        ActionManager._instance = None
+        self.assertEqual(manager.unreachable, NodeSet('foo[1-2]'))
+        self.assertEqual(s1.target, NodeSet('foo[1-3]'))
+        self.assertEqual(poweron.target, None)
+        self.assertEqual(s1._actions['status'].target, NodeSet('foo3'))
+        self.assertEqual(bmc.target, NodeSet('foo4'))
+
+    def test_restrict_to_failures(self):
+        '''Test only failing services run again on their failing nodes'''
+        manager = service_manager_self()
+        s1 = Service('S1', target='foo[1-3]')
+        s1.add_action(Action('start', command=':'))
+        grp = ServiceGroup('G1')
+        s2 = Service('S2')
+        s2.add_action(Action('start', target='foo[4-6]', command=':'))
+        grp.add_inter_dep(target=s2)
+        s3 = Service('S3')
+        s3.add_action(Action('start', command=':'))
+        s3.add_dep(s1)
+        s3.add_dep(grp)
+        manager.register_services(s1, grp, s3)
+        manager._restrict_to_failures({'G1.S2': NodeSet('foo5'), 'S3': None})
+        self.assertEqual(s1.status, LOCKED)
+        self.assertEqual(s2._actions['start'].target, NodeSet('foo5'))
+        self.assertEqual(grp.status, NO_STATUS)
+        self.assertEqual(s3.status, NO_STATUS)
+        self.assertEqual(s3._actions['start'].target, None)
@@ -16,7 +16,7 @@ from MilkCheck.UI.Cli import CommandLine, ConsoleDisplay, MAXTERMWIDTH
 import MilkCheck.ServiceManager
 from MilkCheck.ServiceManager import ServiceManager, service_manager_self
 from MilkCheck.Engine.Service import Service
-from MilkCheck.Engine.Action import Action, ActionManager
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
 from MilkCheck.Engine.ServiceGroup import ServiceGroup
 from MilkCheck.Callback import CallbackHandler
 from MilkCheck.Config.ConfigParser import ConfigParser
@@ -250,14 +250,39 @@ G1                                                                [DEP_ERROR]
 S3 - I am the service S3                                          [DEP_ERROR]
 """,
 """[00:00:00] DEBUG    - Configuration
-nodeps: False
+max_per_node: 0
+output_max_lines: 0
+ssh_multiplex: False
+output_action_budget: 0
+fanout_min: 1
+batch: False
 dryrun: False
-verbosity: 5
-summary: False
 fanout: 64
+critical_path: False
+backend_options: {}
+ui_queue_policy: block
+cache_ttl: 0
+summary: False
+config_dir: 
+backend: clustershell
+fanout_max: 256
+nodeps: False
+refresh_rate: 0
+trace_nodes: False
+adaptive_fanout: False
+preflight_timeout: 5
+cache_file: ~/.milkcheck/cache
+dedup: False
+timings: False
+circuit_breaker: 0
+fail_fast: False
+output_budget: 0
+preflight: False
 reverse_actions: ['stop']
 debug: True
-config_dir: 
+ui_queue_size: 0
+output_max_bytes: 0
+verbosity: 5
 [I1]\r[I1]\r[I2]\r[I2]\r""")
 
     def test_excluded_node(self):
@@ -298,15 +323,40 @@ start S3 ran in 0.00 s
 S3 - I am the service S3                                          [  ERROR  ]
 """,
 """[00:00:00] DEBUG    - Configuration
-nodeps: False
+max_per_node: 0
+output_max_lines: 0
+ssh_multiplex: False
+output_action_budget: 0
+fanout_min: 1
+batch: False
 dryrun: False
-verbosity: 5
 only_nodes: HOSTNAME
-summary: False
 fanout: 64
+critical_path: False
+backend_options: {}
+ui_queue_policy: block
+cache_ttl: 0
+summary: False
+config_dir: 
+backend: clustershell
+fanout_max: 256
+nodeps: False
+refresh_rate: 0
+trace_nodes: False
+adaptive_fanout: False
+preflight_timeout: 5
+cache_file: ~/.milkcheck/cache
+dedup: False
+timings: False
+circuit_breaker: 0
+fail_fast: False
+output_budget: 0
+preflight: False
 reverse_actions: ['stop']
 debug: True
-config_dir: 
+ui_queue_size: 0
+output_max_bytes: 0
+verbosity: 5
 [I1]\r[I1]\r[I2]\r[I2]\r[S3]\r[S3]\r""")
 
     def test_execute_explicit_service(self):
@@ -379,15 +429,40 @@ start S3 ran in 0.00 s
 S3 - I am the service S3                                          [  ERROR  ]
 """,
 """[00:00:00] DEBUG    - Configuration
-nodeps: False
+max_per_node: 0
+output_max_lines: 0
+ssh_multiplex: False
+output_action_budget: 0
+fanout_min: 1
+batch: False
 dryrun: False
-verbosity: 5
+fanout: 64
+critical_path: False
+backend_options: {}
+ui_queue_policy: block
+cache_ttl: 0
 summary: False
+config_dir: 
+backend: clustershell
+fanout_max: 256
+nodeps: False
+refresh_rate: 0
+trace_nodes: False
+adaptive_fanout: False
+preflight_timeout: 5
+cache_file: ~/.milkcheck/cache
+dedup: False
+timings: False
+circuit_breaker: 0
+fail_fast: False
+output_budget: 0
 excluded_nodes: BADNODE
-fanout: 64
+preflight: False
 reverse_actions: ['stop']
 debug: True
-config_dir: 
+ui_queue_size: 0
+output_max_bytes: 0
+verbosity: 5
 [I1]\r[I1]\r[I2]\r[I2]\r[S3]\r[S3]\r""")
 
     def test_multiple_services_reverse(self):
@@ -407,15 +482,40 @@ stop S3 ran in 0.00 s
 S3 - I am the service S3                                          [  ERROR  ]
 """,
 """[00:00:00] DEBUG    - Configuration
-nodeps: False
+max_per_node: 0
+output_max_lines: 0
+ssh_multiplex: False
+output_action_budget: 0
+fanout_min: 1
+batch: False
 dryrun: False
-verbosity: 5
+fanout: 64
+critical_path: False
+backend_options: {}
+ui_queue_policy: block
+cache_ttl: 0
 summary: False
+config_dir: 
+backend: clustershell
+fanout_max: 256
+nodeps: False
+refresh_rate: 0
+trace_nodes: False
+adaptive_fanout: False
+preflight_timeout: 5
+cache_file: ~/.milkcheck/cache
+dedup: False
+timings: False
+circuit_breaker: 0
+fail_fast: False
+output_budget: 0
 excluded_nodes: BADNODE
-fanout: 64
+preflight: False
 reverse_actions: ['stop']
 debug: True
-config_dir: 
+ui_queue_size: 0
+output_max_bytes: 0
+verbosity: 5
 [S1]\r[S1]\r[S1]\r[S3]\r[S3]\r""")
 
     def test_overall_graph(self):
@@ -524,9 +624,20 @@ Options:
   -d, --debug           Set debug mode and maximum verbosity
   -g, --graph           Output dependencies graph
   -s, --summary         Display summary of executed actions
+  --timings             Add timing statistics to the summary
+  --critical-path       Display the chain of actions the run waited for
   -c CONFIG_DIR, --config-dir=CONFIG_DIR
                         Change configuration files directory
   -q, --quiet           Enable quiet mode
+  --output-format=FORMAT
+                        Display events on the console or as JSON lines
+                        (console, jsonl)
+  --events-file=FILE    Write events as JSON lines in FILE
+  --trace=FILE          Write the timeline of the run in FILE (Chrome trace
+                        format)
+  --profile             Display the time spent in each phase of the run
+  --profile-file=FILE   Profile the run and write the statistics in FILE
+                        (implies --profile)
 
   Engine parameters:
     Those options allow you to configure the behaviour of the engine
@@ -541,6 +652,22 @@ Options:
     -D DEFINES, --define=DEFINES, --var=DEFINES
                         Define custom variables
     --nodeps            Do not run dependencies
+    --backend=BACKEND   Use the specified execution backend
+    --adaptive-fanout   Adjust fanout to the responsiveness of nodes
+    --preflight         Exclude unreachable nodes before running actions
+    --batch             Run actions of each node within a single script
+    --max-output-lines=N
+                        Keep at most N lines of output per node
+    --max-output-bytes=N
+                        Keep at most N bytes of output per node
+    --fail-fast         Cancel remaining actions once the run failed
+    --cache-ttl=SECONDS
+                        Reuse results of idempotent actions for SECONDS
+    --journal=FILE      Record completed actions in FILE
+    --resume=FILE       Resume the run recorded in FILE
+    --results=FILE      Write status of actions and nodes in FILE
+    --rerun-failed=FILE
+                        Run again what failed in the results FILE
 """)
 
     def test_command_output_checkconfig(self):
@@ -617,6 +744,25 @@ ServiceGroup                                                      [DEP_ERROR]
  + ServiceGroup.service.stop - I am the service
 """)
 
+    def test_command_output_queued(self):
+        '''Test command line output of events displayed by another thread'''
+        ConfigParser.DEFAULT_FIELDS['ui_queue_size']['value'] = 10
+        try:
+            self._output_check(['ServiceGroup', 'stop', '-vv', '-s'],
+                               RC_ERROR,
+"""stop ServiceGroup.service on localhost
+ > /bin/false
+stop ServiceGroup.service ran in 0.00 s
+ > localhost exited with 1
+ServiceGroup.service - I am the service                           [  ERROR  ]
+ServiceGroup                                                      [DEP_ERROR]
+
+ SUMMARY - 1 action (1 failed)
+ + ServiceGroup.service.stop - I am the service
+""", show_running=False)
+        finally:
+            ConfigParser.DEFAULT_FIELDS['ui_queue_size']['value'] = 0
+
     def test_command_output_timeout(self):
         '''Test command line output with local timeout'''
         self._output_check(['ServiceGroup', 'timeout'], RC_ERROR,
@@ -981,9 +1127,20 @@ Options:
   -d, --debug           Set debug mode and maximum verbosity
   -g, --graph           Output dependencies graph
   -s, --summary         Display summary of executed actions
+  --timings             Add timing statistics to the summary
+  --critical-path       Display the chain of actions the run waited for
   -c CONFIG_DIR, --config-dir=CONFIG_DIR
                         Change configuration files directory
   -q, --quiet           Enable quiet mode
+  --output-format=FORMAT
+                        Display events on the console or as JSON lines
+                        (console, jsonl)
+  --events-file=FILE    Write events as JSON lines in FILE
+  --trace=FILE          Write the timeline of the run in FILE (Chrome trace
+                        format)
+  --profile             Display the time spent in each phase of the run
+  --profile-file=FILE   Profile the run and write the statistics in FILE
+                        (implies --profile)
 
   Engine parameters:
     Those options allow you to configure the behaviour of the engine
@@ -998,6 +1155,22 @@ Options:
     -D DEFINES, --define=DEFINES, --var=DEFINES
                         Define custom variables
     --nodeps            Do not run dependencies
+    --backend=BACKEND   Use the specified execution backend
+    --adaptive-fanout   Adjust fanout to the responsiveness of nodes
+    --preflight         Exclude unreachable nodes before running actions
+    --batch             Run actions of each node within a single script
+    --max-output-lines=N
+                        Keep at most N lines of output per node
+    --max-output-bytes=N
+                        Keep at most N bytes of output per node
+    --fail-fast         Cancel remaining actions once the run failed
+    --cache-ttl=SECONDS
+                        Reuse results of idempotent actions for SECONDS
+    --journal=FILE      Record completed actions in FILE
+    --resume=FILE       Resume the run recorded in FILE
+    --results=FILE      Write status of actions and nodes in FILE
+    --rerun-failed=FILE
+                        Run again what failed in the results FILE
 ''',
 '''[00:00:00] CRITICAL - Invalid options: 
 
@@ -1027,14 +1200,39 @@ Options:
 ZeroDivisionError
 ''',
 '''[00:00:00] DEBUG    - Configuration
-nodeps: False
+max_per_node: 0
+output_max_lines: 0
+ssh_multiplex: False
+output_action_budget: 0
+fanout_min: 1
+batch: False
 dryrun: False
-verbosity: 5
-summary: False
 fanout: 64
+critical_path: False
+backend_options: {}
+ui_queue_policy: block
+cache_ttl: 0
+summary: False
+config_dir: 
+backend: clustershell
+fanout_max: 256
+nodeps: False
+refresh_rate: 0
+trace_nodes: False
+adaptive_fanout: False
+preflight_timeout: 5
+cache_file: ~/.milkcheck/cache
+dedup: False
+timings: False
+circuit_breaker: 0
+fail_fast: False
+output_budget: 0
+preflight: False
 reverse_actions: ['stop']
 debug: True
-config_dir: 
+ui_queue_size: 0
+output_max_bytes: 0
+verbosity: 5
 ''')
 
 class ConsoleOutputTest(TestCase):
@@ -1066,3 +1264,24 @@ class ConsoleOutputTest(TestCase):
         test_str = "Test"
         test_str_colored = self.display.string_color(test_str, 'GREEN')
         self.assertEqual(len(test_str_colored), len(test_str))
+
+    def test_refresh_rate(self):
+        '''Test running tasks line is not drawn more than refresh_rate'''
+        ActionManager._instance = None
+        svc = Service('S1')
+        svc.add_action(Action('start'))
+        action_manager_self().add_task(svc._actions['start'])
+        self.display._show_running = True
+        self.display.refresh_rate = 1
+        sys.stderr = StringIO()
+        try:
+            self.display.print_running_tasks()
+            self.display.print_running_tasks()
+            output = sys.stderr.getvalue()
+            self.assertTrue(self.display.refresh_timer is not None)
+        finally:
+            sys.stderr = sys.__stderr__
+            self.display.close()
+            ActionManager._instance = None
+        self.assertEqual(output.count('[S1]'), 1)
+        self.assertEqual(self.display.refresh_timer, None)
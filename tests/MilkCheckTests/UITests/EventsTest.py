@@ -0,0 +1,64 @@
+# Copyright CEA (2011-2014)
+
+"""
+This modules defines the tests cases targeting the JSON lines events
+"""
+
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+from MilkCheck.Engine.Action import Action, ActionManager, action_manager_self
+from MilkCheck.Engine.Service import Service
+from MilkCheck.Engine.Backend import FakeClusterBackend
+from MilkCheck.Callback import CallbackHandler, call_back_self
+from MilkCheck.UI.Events import JsonLinesWriter
+
+class JsonLinesWriterTest(TestCase):
+    """Test engine events written as JSON lines"""
+
+    def setUp(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+
+    def tearDown(self):
+        ActionManager._instance = None
+        CallbackHandler._instance = None
+
+    def test_events(self):
+        """Test each event is written with the results of actions"""
+        action_manager_self().backend = FakeClusterBackend(
+                                    nodes={'foo2': {'failure_rate': 1.0}})
+        stream = StringIO()
+        writer = JsonLinesWriter(stream)
+        call_back_self().attach(writer)
+        svc1 = Service('S1')
+        svc1.add_action(Action('start', target='foo[1-2]', command='true'))
+        svc2 = Service('S2')
+        svc2.add_action(Action('start', command='true'))
+        svc2.add_dep(svc1)
+        svc2.run('start')
+        writer.flush()
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        times = [event['time'] for event in events]
+        self.assertEqual(times, sorted(times))
+        complete = [event for event in events
+                    if event['event'] == 'complete' and
+                       event['type'] == 'action']
+        self.assertEqual(complete[0]['name'], 'S1.start')
+        self.assertEqual(complete[0]['status'], 'ERROR')
+        self.assertEqual(complete[0]['target'], 'foo[1-2]')
+        self.assertEqual(complete[0]['retcodes'], {'0': 'foo1', '255': 'foo2'})
+        triggers = [event['triggered'] for event in events
+                    if event['event'] == 'trigger_dep']
+        self.assertTrue('S2' in triggers)
+
+    def test_buffer(self):
+        """Test lines are written by chunks"""
+        stream = StringIO()
+        writer = JsonLinesWriter(stream, buffer_size=2)
+        service = Service('S1')
+        writer.ev_status_changed(service)
+        self.assertEqual(stream.getvalue(), '')
+        writer.ev_started(service)
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)